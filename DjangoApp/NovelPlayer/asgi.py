@@ -14,3 +14,7 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'NovelPlayer.settings')
 
 application = get_asgi_application()
+
+from game.maintenance import start_scheduler
+
+start_scheduler()
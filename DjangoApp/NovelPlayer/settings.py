@@ -54,6 +54,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'game.middleware.upstream_timing_middleware',
 ]
 
 ROOT_URLCONF = 'NovelPlayer.urls'
@@ -88,6 +89,69 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# Flask API reads are cached here (see game/services.py). locmem is per
+# process; use a file, database or memcached backend to share entries and
+# invalidations between workers.
+#
+# The API cache keeps several keys per story and per page, so the entry
+# limit of the backends that have one (locmem, file, database) is raised
+# from Django's 300; at that size they cull at random, generation tokens
+# included, long before entries expire. Memcached and Redis size
+# themselves by memory and take no MAX_ENTRIES.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'nahb'),
+    }
+}
+if not CACHES['default']['BACKEND'].endswith(('MemcacheCache', 'RedisCache')):
+    CACHES['default']['OPTIONS'] = {'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 50000))}
+
+
+# Finished plays are buffered and written in batches by a background thread
+# (see game/recorder.py). The spool directory keeps unwritten plays across
+# crashes; it must be on local disk and writable by every worker.
+
+PLAY_RECORDER_ENABLED = os.getenv('PLAY_RECORDER_ENABLED', 'True') == 'True'
+PLAY_RECORDER_BATCH_SIZE = int(os.getenv('PLAY_RECORDER_BATCH_SIZE', 100))
+PLAY_RECORDER_FLUSH_MS = int(os.getenv('PLAY_RECORDER_FLUSH_MS', 500))
+PLAY_SPOOL_DIR = Path(os.getenv('PLAY_SPOOL_DIR', BASE_DIR / 'play_spool'))
+
+# Seconds between in-process runs of the orphan play cleanup (0 disables it;
+# the cleanup_orphan_plays command can be scheduled with cron instead).
+PLAY_CLEANUP_INTERVAL = int(os.getenv('PLAY_CLEANUP_INTERVAL', 0))
+
+# Seconds between in-process runs of the play step rollup behind the funnel
+# stats (0 disables it; use the rollup_play_steps command instead). Steps
+# already rolled up are deleted after PLAY_STEP_RETENTION_DAYS (0 keeps them).
+# A run only folds steps that existed PLAY_ROLLUP_SETTLE seconds before it,
+# which must outlast the longest transaction writing steps.
+PLAY_ROLLUP_INTERVAL = int(os.getenv('PLAY_ROLLUP_INTERVAL', 60))
+PLAY_ROLLUP_SETTLE = int(os.getenv('PLAY_ROLLUP_SETTLE', 30))
+PLAY_STEP_RETENTION_DAYS = int(os.getenv('PLAY_STEP_RETENTION_DAYS', 30))
+
+
+# Requests taking at least UPSTREAM_SLOW_REQUEST_MS are logged with every
+# Flask API call they made. Per-view upstream totals are shared with the
+# other workers through the default cache every UPSTREAM_STATS_PUBLISH_INTERVAL
+# seconds (see game/instrumentation.py).
+
+UPSTREAM_SLOW_REQUEST_MS = int(os.getenv('UPSTREAM_SLOW_REQUEST_MS', 500))
+UPSTREAM_STATS_PUBLISH_INTERVAL = int(os.getenv('UPSTREAM_STATS_PUBLISH_INTERVAL', 10))
+
+
+# The profile backend loads user.userprofile with the session user. Sessions
+# started before it was added keep using ModelBackend until the next login.
+
+AUTHENTICATION_BACKENDS = [
+    'game.backends.ProfileModelBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
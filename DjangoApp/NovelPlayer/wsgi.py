@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'NovelPlayer.settings')
 
 application = get_wsgi_application()
+
+from game.maintenance import start_scheduler
+
+start_scheduler()
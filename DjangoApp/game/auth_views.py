@@ -39,7 +39,7 @@ class RegisterView(View):
 
         UserProfile.objects.create(user=user, role=role)
 
-        login(request, user)
+        login(request, user, backend='game.backends.ProfileModelBackend')
         return redirect('stories_list')
 
 
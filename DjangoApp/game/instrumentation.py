@@ -0,0 +1,178 @@
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+TRACE_HEADER = 'X-Request-ID'
+MAX_LOGGED_CALLS = 50
+WORKERS_KEY = 'upstream-stats:workers'
+
+_current = ContextVar('upstream_timing', default=None)
+
+
+class UpstreamTiming:
+    """Flask API calls and API cache lookups made while serving one request.
+
+    Async views run service calls on worker threads that see the same
+    object through the copied context, so updates take a lock.
+    """
+
+    def __init__(self, trace_id):
+        self.trace_id = trace_id
+        self.started = time.perf_counter()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def add_call(self, method, path, status, seconds):
+        with self._lock:
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+            if len(self.calls) < MAX_LOGGED_CALLS:
+                self.calls.append((method, path, status, seconds))
+
+    def add_cache_lookup(self, hit):
+        with self._lock:
+            if hit:
+                self.cache_hits += 1
+            else:
+                self.cache_misses += 1
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self, elapsed):
+        return (
+            f'flask;dur={self.total * 1000:.1f};desc="{self.count} Flask API calls", '
+            f'flask-max;dur={self.max * 1000:.1f}, '
+            f'cache;desc="{self.cache_hits} hits, {self.cache_misses} misses", '
+            f'total;dur={elapsed * 1000:.1f}'
+        )
+
+    def breakdown(self):
+        return ', '.join(
+            f'{method} {path} {status} {seconds * 1000:.0f}ms' for method, path, status, seconds in self.calls
+        )
+
+
+def start(trace_id=None):
+    timing = UpstreamTiming(trace_id or uuid.uuid4().hex)
+    return timing, _current.set(timing)
+
+
+def stop(token):
+    _current.reset(token)
+
+
+def current_trace_id():
+    timing = _current.get()
+    return timing.trace_id if timing is not None else None
+
+
+def record_call(method, path, status, seconds):
+    timing = _current.get()
+    if timing is not None:
+        timing.add_call(method, path, status, seconds)
+
+
+def record_cache_lookup(hit):
+    timing = _current.get()
+    if timing is not None:
+        timing.add_cache_lookup(hit)
+
+
+class UpstreamStats:
+    """Per-view totals of this process, shared with the other workers through the cache.
+
+    Requests only update in-process counters. At most once per publish
+    interval a request also writes this process's snapshot to the cache, so
+    the cost per request stays a dictionary update.
+    """
+
+    FIELDS = ('requests', 'slow', 'calls', 'upstream_ms', 'max_call_ms', 'total_ms', 'cache_hits', 'cache_misses')
+
+    def __init__(self):
+        self._views = {}
+        self._published = 0
+        self._pid = None
+        self._worker_key = None
+        self._lock = threading.Lock()
+
+    @property
+    def worker_key(self):
+        # Forked workers must not publish under their parent's key.
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._worker_key = f'upstream-stats:{socket.gethostname()}:{self._pid}:{uuid.uuid4().hex[:8]}'
+        return self._worker_key
+
+    def observe(self, view, timing, elapsed, slow):
+        with self._lock:
+            row = self._views.get(view)
+            if row is None:
+                row = self._views[view] = dict.fromkeys(self.FIELDS, 0)
+            row['requests'] += 1
+            row['slow'] += slow
+            row['calls'] += timing.count
+            row['upstream_ms'] += timing.total * 1000
+            row['max_call_ms'] = max(row['max_call_ms'], timing.max * 1000)
+            row['total_ms'] += elapsed * 1000
+            row['cache_hits'] += timing.cache_hits
+            row['cache_misses'] += timing.cache_misses
+
+    def snapshot(self):
+        with self._lock:
+            return {view: dict(row) for view, row in self._views.items()}
+
+    def publish_due(self, interval):
+        with self._lock:
+            now = time.monotonic()
+            if now - self._published < interval:
+                return False
+            self._published = now
+            return True
+
+    def publish(self, interval):
+        try:
+            # Snapshots of workers that stopped expire on their own.
+            cache.set(self.worker_key, self.snapshot(), interval * 10)
+            workers = cache.get(WORKERS_KEY) or []
+            if self.worker_key not in workers:
+                # Two workers registering at once may drop one; it is added
+                # back on its next publish.
+                cache.set(WORKERS_KEY, workers + [self.worker_key], None)
+        except Exception as e:
+            logger.warning('Could not publish upstream stats: %s', e)
+
+    @staticmethod
+    def aggregate():
+        """Sums the published snapshots of every worker, dropping expired ones."""
+        workers = cache.get(WORKERS_KEY) or []
+        snapshots = cache.get_many(workers)
+        if len(snapshots) < len(workers):
+            cache.set(WORKERS_KEY, [key for key in workers if key in snapshots], None)
+        totals = {}
+        for snapshot in snapshots.values():
+            for view, row in snapshot.items():
+                total = totals.setdefault(view, dict.fromkeys(UpstreamStats.FIELDS, 0))
+                for field, value in row.items():
+                    if field == 'max_call_ms':
+                        total[field] = max(total[field], value)
+                    else:
+                        total[field] += value
+        return totals, len(snapshots)
+
+
+upstream_stats = UpstreamStats()
@@ -0,0 +1,153 @@
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, transaction
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from game.models import ChoiceStats, PageStats, Play, PlayStep, RollupCursor, StoryPlayStats, _increment
+from game.services import FlaskAPIService
+
+logger = logging.getLogger(__name__)
+
+CLEANUP_BATCH_SIZE = 500
+ROLLUP_BATCH_SIZE = 10000
+STEP_ROLLUP = 'play_steps'
+
+
+def _delete_in_batches(queryset, batch_size):
+    # Deletes in primary-key batches, each in its own short transaction, so
+    # other writers are never locked out for the length of the whole job.
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            ids = list(queryset.order_by().values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return deleted
+            deleted += queryset.model.objects.filter(id__in=ids).delete()[0]
+
+
+def delete_story_plays(story_ids, batch_size=CLEANUP_BATCH_SIZE):
+    story_ids = list(story_ids)
+    deleted = _delete_in_batches(Play.objects.filter(story_id__in=story_ids), batch_size)
+    _delete_in_batches(PlayStep.objects.filter(story_id__in=story_ids), batch_size)
+    StoryPlayStats.forget(story_ids)
+    PageStats.objects.filter(story_id__in=story_ids).delete()
+    ChoiceStats.objects.filter(story_id__in=story_ids).delete()
+    return deleted
+
+
+def rollup_play_steps(batch_size=ROLLUP_BATCH_SIZE):
+    """Folds PlayStep rows added since the last run into PageStats and ChoiceStats.
+
+    Steps are aggregated in the database one id range at a time, so a run
+    costs a few GROUP BY queries plus one UPDATE per page and choice that
+    was played, however many steps were recorded.
+
+    Ids are handed out before commit, so a step with a lower id can appear
+    after a higher one. A run therefore only folds up to the highest id seen
+    at least PLAY_ROLLUP_SETTLE seconds earlier, and records the current
+    highest id for a later run.
+    """
+    RollupCursor.objects.get_or_create(name=STEP_ROLLUP)
+    cursor = RollupCursor.objects.get(name=STEP_ROLLUP)
+    position = cursor.position
+    now = timezone.now()
+    settled = cursor.horizon_at is not None and now - cursor.horizon_at >= timedelta(seconds=settings.PLAY_ROLLUP_SETTLE)
+    end = cursor.horizon if settled else position
+    if settled or cursor.horizon_at is None:
+        RollupCursor.objects.filter(name=STEP_ROLLUP).update(
+            horizon=PlayStep.objects.aggregate(end=Max('id'))['end'] or 0, horizon_at=now
+        )
+    folded = 0
+    while position < end:
+        upper = min(position + batch_size, end)
+        steps = PlayStep.objects.filter(id__gt=position, id__lte=upper).order_by()
+        taken = steps.filter(choice_id__isnull=False)
+        with transaction.atomic():
+            # Moving the cursor first makes a concurrent run of the same
+            # range update nothing and back off instead of counting twice.
+            if not RollupCursor.objects.filter(name=STEP_ROLLUP, position=position).update(position=upper):
+                break
+            for row in steps.values('story_id', 'page_id', 'is_ending').annotate(total=Count('id')):
+                folded += row['total']
+                _increment(PageStats, {'story_id': row['story_id'], 'page_id': row['page_id']}, 'visits',
+                           row['total'], defaults={'is_ending': row['is_ending']})
+            for row in taken.values('story_id', 'from_page_id').annotate(total=Count('id')):
+                _increment(PageStats, {'story_id': row['story_id'], 'page_id': row['from_page_id']}, 'departures',
+                           row['total'])
+            for row in taken.values('story_id', 'from_page_id', 'choice_id').annotate(total=Count('id')):
+                _increment(ChoiceStats, {'story_id': row['story_id'], 'choice_id': row['choice_id']}, 'picks',
+                           row['total'], defaults={'page_id': row['from_page_id']})
+        position = upper
+
+    retention = settings.PLAY_STEP_RETENTION_DAYS
+    if retention:
+        # Only steps already folded into the rollups are pruned.
+        cutoff = timezone.now() - timedelta(days=retention)
+        _delete_in_batches(PlayStep.objects.filter(id__lte=position, created_at__lt=cutoff), CLEANUP_BATCH_SIZE)
+    return folded
+
+
+def rebuild_step_stats():
+    with transaction.atomic():
+        PageStats.objects.all().delete()
+        ChoiceStats.objects.all().delete()
+        RollupCursor.objects.update_or_create(name=STEP_ROLLUP, defaults={'position': 0})
+    return rollup_play_steps()
+
+
+def cleanup_orphan_plays(batch_size=CLEANUP_BATCH_SIZE):
+    """Removes plays whose story no longer exists in the Flask catalog."""
+    # Played stories are read before the catalog, so a story created and
+    # played in between is in the catalog rather than taken for an orphan.
+    played = set(Play.objects.order_by().values_list('story_id', flat=True).distinct())
+    if not played:
+        return 0
+    catalog = set(FlaskAPIService.get_story_ids())
+    if not catalog:
+        # Never read an empty catalog as "every story was deleted".
+        logger.warning('Skipping orphan play cleanup: the story catalog is empty')
+        return 0
+
+    orphans = sorted(played - catalog)
+    if not orphans:
+        return 0
+    deleted = delete_story_plays(orphans, batch_size)
+    logger.info('Deleted %s plays of %s missing stories', deleted, len(orphans))
+    return deleted
+
+
+def _run_scheduler(job, interval):
+    name = job.__name__
+    while True:
+        time.sleep(interval)
+        # With a shared cache only one worker runs the job per interval.
+        if not cache.add(f'maintenance:{name}', 1, interval):
+            continue
+        try:
+            job()
+        except Exception as e:
+            logger.warning('%s failed: %s', name, e)
+        finally:
+            close_old_connections()
+
+
+_schedulers = {}
+
+
+def start_scheduler():
+    jobs = (
+        (cleanup_orphan_plays, settings.PLAY_CLEANUP_INTERVAL),
+        (rollup_play_steps, settings.PLAY_ROLLUP_INTERVAL),
+    )
+    for job, interval in jobs:
+        if not interval or job.__name__ in _schedulers:
+            continue
+        thread = threading.Thread(target=_run_scheduler, args=(job, interval), name=job.__name__, daemon=True)
+        _schedulers[job.__name__] = thread
+        thread.start()
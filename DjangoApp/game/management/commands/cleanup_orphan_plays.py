@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from game.maintenance import CLEANUP_BATCH_SIZE, cleanup_orphan_plays
+
+
+class Command(BaseCommand):
+    help = 'Deletes plays of stories that no longer exist in the Flask API, in small batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=CLEANUP_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        deleted = cleanup_orphan_plays(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} orphaned plays'))
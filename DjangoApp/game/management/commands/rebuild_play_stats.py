@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from game.models import StoryPlayStats
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the StoryPlayStats, EndingStats and PlayBucket rollups from Play records'
+
+    def add_arguments(self, parser):
+        parser.add_argument('story_ids', nargs='*', type=int, help='Only rebuild these stories')
+
+    def handle(self, *args, **options):
+        story_ids = options['story_ids'] or None
+        StoryPlayStats.rebuild(story_ids)
+        scope = f"{len(story_ids)} stories" if story_ids else 'all stories'
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt play stats for {scope}'))
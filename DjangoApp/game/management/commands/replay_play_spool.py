@@ -0,0 +1,12 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from game.recorder import replay_spools
+
+
+class Command(BaseCommand):
+    help = 'Writes plays left in spool files by Django processes that are no longer running'
+
+    def handle(self, *args, **options):
+        replayed = replay_spools(settings.PLAY_SPOOL_DIR) if settings.PLAY_SPOOL_DIR.exists() else 0
+        self.stdout.write(self.style.SUCCESS(f'Replayed {replayed} plays'))
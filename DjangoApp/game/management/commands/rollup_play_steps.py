@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from game.maintenance import ROLLUP_BATCH_SIZE, rebuild_step_stats, rollup_play_steps
+
+
+class Command(BaseCommand):
+    help = 'Folds new PlayStep records into the PageStats and ChoiceStats rollups'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=ROLLUP_BATCH_SIZE)
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Start over from the steps still kept (see PLAY_STEP_RETENTION_DAYS)')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            folded = rebuild_step_stats()
+        else:
+            folded = rollup_play_steps(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Rolled up {folded} play steps'))
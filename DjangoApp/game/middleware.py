@@ -0,0 +1,78 @@
+import logging
+import re
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.utils.decorators import sync_and_async_middleware
+
+from game import instrumentation
+from game.instrumentation import TRACE_HEADER, upstream_stats
+
+logger = logging.getLogger(__name__)
+
+TRACE_ID = re.compile(r'^[\w.:-]{1,128}$')
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    func = getattr(match.func, 'view_class', match.func)
+    return func.__name__
+
+
+def _start(request):
+    incoming = request.headers.get(TRACE_HEADER, '')
+    return instrumentation.start(incoming if TRACE_ID.match(incoming) else None)
+
+
+def _finish(request, response, timing):
+    elapsed = timing.elapsed()
+    slow = elapsed * 1000 >= settings.UPSTREAM_SLOW_REQUEST_MS
+    view = _view_name(request)
+    upstream_stats.observe(view, timing, elapsed, slow)
+    response[TRACE_HEADER] = timing.trace_id
+    response['Server-Timing'] = timing.server_timing(elapsed)
+    if slow:
+        logger.warning(
+            'Slow request %s %s (%s): %.0fms, %.0fms waiting on %s Flask API calls (slowest %.0fms), '
+            '%s cache hits, %s misses [trace %s] %s',
+            request.method, request.path, view, elapsed * 1000, timing.total * 1000, timing.count,
+            timing.max * 1000, timing.cache_hits, timing.cache_misses, timing.trace_id, timing.breakdown()
+        )
+    return upstream_stats.publish_due(settings.UPSTREAM_STATS_PUBLISH_INTERVAL)
+
+
+@sync_and_async_middleware
+def upstream_timing_middleware(get_response):
+    """Times the Flask API calls behind each request.
+
+    Adds X-Request-ID (the incoming one, or a new ID that is also sent to
+    the Flask API) and Server-Timing headers, logs requests slower than
+    UPSTREAM_SLOW_REQUEST_MS with every upstream call, and adds the numbers
+    to the per-view totals shown to staff on the upstream stats page.
+    """
+    interval = settings.UPSTREAM_STATS_PUBLISH_INTERVAL
+
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            timing, token = _start(request)
+            try:
+                response = await get_response(request)
+            finally:
+                instrumentation.stop(token)
+            if _finish(request, response, timing):
+                await sync_to_async(upstream_stats.publish)(interval)
+            return response
+    else:
+        def middleware(request):
+            timing, token = _start(request)
+            try:
+                response = get_response(request)
+            finally:
+                instrumentation.stop(token)
+            if _finish(request, response, timing):
+                upstream_stats.publish(interval)
+            return response
+
+    return middleware
@@ -0,0 +1,54 @@
+# Generated by Django 4.2 on 2026-10-18 08:38
+
+from django.db import migrations, models
+
+
+def build_stats(apps, schema_editor):
+    Play = apps.get_model('game', 'Play')
+    StoryPlayStats = apps.get_model('game', 'StoryPlayStats')
+    EndingStats = apps.get_model('game', 'EndingStats')
+    plays = Play.objects.order_by()
+
+    StoryPlayStats.objects.bulk_create([
+        StoryPlayStats(story_id=row['story_id'], total_plays=row['total'])
+        for row in plays.values('story_id').annotate(total=models.Count('id'))
+    ])
+    endings = {}
+    for row in plays.values('story_id', 'ending_label').annotate(total=models.Count('id')):
+        key = (row['story_id'], row['ending_label'] or '')
+        endings[key] = endings.get(key, 0) + row['total']
+    EndingStats.objects.bulk_create([
+        EndingStats(story_id=story_id, ending_label=label, count=total)
+        for (story_id, label), total in endings.items()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0002_play_user_userprofile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EndingStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('story_id', models.IntegerField()),
+                ('ending_label', models.CharField(blank=True, default='', max_length=255)),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StoryPlayStats',
+            fields=[
+                ('story_id', models.IntegerField(primary_key=True, serialize=False)),
+                ('total_plays', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='endingstats',
+            constraint=models.UniqueConstraint(fields=('story_id', 'ending_label'), name='unique_story_ending'),
+        ),
+        migrations.RunPython(build_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2 on 2026-10-18 08:39
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0003_play_stats'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='play',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 4.2 on 2026-10-18 08:44
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0004_play_created_at_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChoiceStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('story_id', models.IntegerField()),
+                ('page_id', models.IntegerField()),
+                ('choice_id', models.IntegerField()),
+                ('picks', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PageStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('story_id', models.IntegerField()),
+                ('page_id', models.IntegerField()),
+                ('is_ending', models.BooleanField(default=False)),
+                ('visits', models.PositiveIntegerField(default=0)),
+                ('departures', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PlayStep',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('play_key', models.CharField(max_length=32)),
+                ('story_id', models.IntegerField()),
+                ('from_page_id', models.IntegerField(blank=True, null=True)),
+                ('choice_id', models.IntegerField(blank=True, null=True)),
+                ('page_id', models.IntegerField()),
+                ('is_ending', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RollupCursor',
+            fields=[
+                ('name', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('position', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='playstep',
+            index=models.Index(fields=['story_id'], name='playstep_story_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='pagestats',
+            constraint=models.UniqueConstraint(fields=('story_id', 'page_id'), name='unique_story_page'),
+        ),
+        migrations.AddConstraint(
+            model_name='choicestats',
+            constraint=models.UniqueConstraint(fields=('story_id', 'choice_id'), name='unique_story_choice'),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 4.2 on 2026-10-18 08:46
+
+from datetime import timezone
+
+from django.db import migrations, models
+from django.db.models.functions import TruncDay, TruncHour
+
+
+def build_buckets(apps, schema_editor):
+    Play = apps.get_model('game', 'Play')
+    PlayBucket = apps.get_model('game', 'PlayBucket')
+    plays = Play.objects.order_by()
+
+    for granularity, trunc in (('hour', TruncHour), ('day', TruncDay)):
+        buckets = {}
+        rows = plays.annotate(bucket=trunc('created_at', tzinfo=timezone.utc)).values(
+            'story_id', 'ending_label', 'bucket'
+        ).annotate(total=models.Count('id'))
+        for row in rows:
+            key = (row['story_id'], row['ending_label'] or '', row['bucket'])
+            buckets[key] = buckets.get(key, 0) + row['total']
+        PlayBucket.objects.bulk_create([
+            PlayBucket(story_id=story_id, ending_label=label, granularity=granularity, start=start, count=total)
+            for (story_id, label, start), total in buckets.items()
+        ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0005_play_steps'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlayBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('story_id', models.IntegerField()),
+                ('ending_label', models.CharField(blank=True, default='', max_length=255)),
+                ('granularity', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('start', models.DateTimeField()),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='play',
+            index=models.Index(fields=['story_id', 'created_at'], name='play_story_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='play',
+            index=models.Index(fields=['story_id', 'ending_label'], name='play_story_ending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='playbucket',
+            index=models.Index(fields=['granularity', 'start'], name='playbucket_start_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='playbucket',
+            constraint=models.UniqueConstraint(fields=('story_id', 'granularity', 'start', 'ending_label'), name='unique_play_bucket'),
+        ),
+        migrations.RunPython(build_buckets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2 on 2026-10-18 09:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0006_play_buckets'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rollupcursor',
+            name='horizon',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='rollupcursor',
+            name='horizon_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,15 +1,24 @@
-from django.db import models
+from datetime import timedelta, timezone as dt_timezone
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, Sum
+from django.db.models.functions import TruncDay, TruncHour
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 class Play(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
     story_id = models.IntegerField()
     ending_page_id = models.IntegerField()
     ending_label = models.CharField(max_length=255, null=True, blank=True)
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(default=timezone.now)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['story_id', 'created_at'], name='play_story_created_idx'),
+            models.Index(fields=['story_id', 'ending_label'], name='play_story_ending_idx'),
+        ]
 
     def __str__(self):
         return f"Play {self.id} - Story {self.story_id}"
@@ -25,4 +34,247 @@ class UserProfile(models.Model):
     role = models.CharField(max_length=10, choices=ROLE_CHOICES, default='reader')
 
     def __str__(self):
-        return f"{self.user.username} - {self.role}"
\ No newline at end of file
+        return f"{self.user.username} - {self.role}"
+
+
+class StoryPlayStats(models.Model):
+    """Running play totals per story, kept in step with Play rows.
+
+    Together with EndingStats and PlayBucket these are the play rollups;
+    rebuild them from Play with ``python manage.py rebuild_play_stats``.
+    """
+    story_id = models.IntegerField(primary_key=True)
+    total_plays = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"Story {self.story_id} - {self.total_plays} plays"
+
+    @staticmethod
+    def record(story_id, ending_label, plays=1, played_at=None):
+        # Unlabeled endings are counted under '' so they stay unique.
+        with transaction.atomic():
+            _increment(StoryPlayStats, {'story_id': story_id}, 'total_plays', plays)
+            _increment(EndingStats, {'story_id': story_id, 'ending_label': ending_label or ''}, 'count', plays)
+            if played_at is not None:
+                for granularity in (PlayBucket.HOUR, PlayBucket.DAY):
+                    _increment(PlayBucket, {
+                        'story_id': story_id,
+                        'ending_label': ending_label or '',
+                        'granularity': granularity,
+                        'start': PlayBucket.floor(played_at, granularity)
+                    }, 'count', plays)
+
+    @staticmethod
+    def rebuild(story_ids=None):
+        plays = Play.objects.order_by()
+        if story_ids is not None:
+            plays = plays.filter(story_id__in=story_ids)
+        with transaction.atomic():
+            StoryPlayStats.forget(story_ids)
+            StoryPlayStats.objects.bulk_create([
+                StoryPlayStats(story_id=row['story_id'], total_plays=row['total'])
+                for row in plays.values('story_id').annotate(total=models.Count('id'))
+            ])
+            endings = {}
+            for row in plays.values('story_id', 'ending_label').annotate(total=models.Count('id')):
+                key = (row['story_id'], row['ending_label'] or '')
+                endings[key] = endings.get(key, 0) + row['total']
+            EndingStats.objects.bulk_create([
+                EndingStats(story_id=story_id, ending_label=label, count=total)
+                for (story_id, label), total in endings.items()
+            ])
+            for granularity, trunc in ((PlayBucket.HOUR, TruncHour), (PlayBucket.DAY, TruncDay)):
+                buckets = {}
+                rows = plays.annotate(bucket=trunc('created_at', tzinfo=dt_timezone.utc)).values(
+                    'story_id', 'ending_label', 'bucket'
+                ).annotate(total=models.Count('id'))
+                for row in rows:
+                    key = (row['story_id'], row['ending_label'] or '', row['bucket'])
+                    buckets[key] = buckets.get(key, 0) + row['total']
+                PlayBucket.objects.bulk_create([
+                    PlayBucket(story_id=story_id, ending_label=label, granularity=granularity, start=start, count=total)
+                    for (story_id, label, start), total in buckets.items()
+                ], batch_size=500)
+
+    @staticmethod
+    def forget(story_ids=None):
+        for model in (StoryPlayStats, EndingStats, PlayBucket):
+            rows = model.objects.all()
+            if story_ids is not None:
+                rows = rows.filter(story_id__in=story_ids)
+            rows.delete()
+
+
+class EndingStats(models.Model):
+    story_id = models.IntegerField()
+    ending_label = models.CharField(max_length=255, blank=True, default='')
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['story_id', 'ending_label'], name='unique_story_ending')
+        ]
+
+    def __str__(self):
+        return f"Story {self.story_id} - {self.ending_label or 'Unlabeled'}: {self.count}"
+
+
+class PlayBucket(models.Model):
+    """Plays per story and ending label within one UTC hour or day.
+
+    Date-range totals and trend charts add up one row per bucket instead of
+    scanning Play. Hour buckets serve short ranges, day buckets the rest.
+    """
+    HOUR = 'hour'
+    DAY = 'day'
+    GRANULARITY_CHOICES = [
+        (HOUR, 'Hour'),
+        (DAY, 'Day'),
+    ]
+
+    story_id = models.IntegerField()
+    ending_label = models.CharField(max_length=255, blank=True, default='')
+    granularity = models.CharField(max_length=4, choices=GRANULARITY_CHOICES)
+    start = models.DateTimeField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['story_id', 'granularity', 'start', 'ending_label'], name='unique_play_bucket')
+        ]
+        indexes = [
+            models.Index(fields=['granularity', 'start'], name='playbucket_start_idx'),
+        ]
+
+    def __str__(self):
+        return f"Story {self.story_id} - {self.granularity} {self.start:%Y-%m-%d %H:00}: {self.count}"
+
+    @staticmethod
+    def floor(moment, granularity):
+        moment = moment.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+        if granularity == PlayBucket.DAY:
+            moment = moment.replace(hour=0)
+        return moment
+
+    @staticmethod
+    def totals(start=None, end=None, story_ids=None):
+        """Plays per (story_id, ending_label) from day buckets in [start, end)."""
+        buckets = PlayBucket.objects.filter(granularity=PlayBucket.DAY)
+        if start is not None:
+            buckets = buckets.filter(start__gte=start)
+        if end is not None:
+            buckets = buckets.filter(start__lt=end)
+        if story_ids is not None:
+            buckets = buckets.filter(story_id__in=story_ids)
+        return {
+            (row['story_id'], row['ending_label']): row['total']
+            for row in buckets.values('story_id', 'ending_label').annotate(total=Sum('count'))
+        }
+
+    @staticmethod
+    def series(story_id, start, end, granularity):
+        """Plays per bucket in [start, end), with empty buckets filled in."""
+        counts = dict(PlayBucket.objects.filter(
+            story_id=story_id, granularity=granularity, start__gte=start, start__lt=end
+        ).values('start').annotate(total=Sum('count')).values_list('start', 'total'))
+        step = timedelta(hours=1) if granularity == PlayBucket.HOUR else timedelta(days=1)
+        points = []
+        moment = start
+        while moment < end:
+            points.append((moment, counts.get(moment, 0)))
+            moment += step
+        return points
+
+
+def _increment(model, key, field, amount, defaults=None):
+    # UPDATE ... SET field = field + n first; create the row on the first
+    # play, and fall back to the UPDATE if another request created it.
+    if model.objects.filter(**key).update(**{field: F(field) + amount}):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**key, **(defaults or {}), **{field: amount})
+    except IntegrityError:
+        model.objects.filter(**key).update(**{field: F(field) + amount})
+
+
+class PlayStep(models.Model):
+    """Append-only log of every page a reader reached during a play.
+
+    ``play_key`` groups the steps of one playthrough. ``choice_id`` is the
+    choice taken on ``from_page_id`` to arrive at ``page_id``; both are empty
+    for the start page. Steps are written in batches by the play recorder
+    and summarised into PageStats and ChoiceStats by the rollup job.
+    """
+    play_key = models.CharField(max_length=32)
+    story_id = models.IntegerField()
+    from_page_id = models.IntegerField(null=True, blank=True)
+    choice_id = models.IntegerField(null=True, blank=True)
+    page_id = models.IntegerField()
+    is_ending = models.BooleanField(default=False)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['story_id'], name='playstep_story_idx'),
+        ]
+
+    def __str__(self):
+        return f"Play {self.play_key} - Page {self.page_id}"
+
+
+class PageStats(models.Model):
+    """Visits per page, and how many of them went on through a choice.
+
+    Visits that neither went on nor reached an ending are drop-offs.
+    """
+    story_id = models.IntegerField()
+    page_id = models.IntegerField()
+    is_ending = models.BooleanField(default=False)
+    visits = models.PositiveIntegerField(default=0)
+    departures = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['story_id', 'page_id'], name='unique_story_page')
+        ]
+
+    def __str__(self):
+        return f"Story {self.story_id} - Page {self.page_id}: {self.visits}"
+
+    @property
+    def drop_offs(self):
+        if self.is_ending:
+            return 0
+        return max(self.visits - self.departures, 0)
+
+
+class ChoiceStats(models.Model):
+    story_id = models.IntegerField()
+    page_id = models.IntegerField()
+    choice_id = models.IntegerField()
+    picks = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['story_id', 'choice_id'], name='unique_story_choice')
+        ]
+
+    def __str__(self):
+        return f"Story {self.story_id} - Choice {self.choice_id}: {self.picks}"
+
+
+class RollupCursor(models.Model):
+    """Last source row id a rollup job has folded into its tables.
+
+    ``horizon`` is the highest source id seen at ``horizon_at``. Ids are not
+    committed in order, so a job only folds up to a horizon old enough that
+    every transaction holding a lower id has finished.
+    """
+    name = models.CharField(max_length=64, primary_key=True)
+    position = models.BigIntegerField(default=0)
+    horizon = models.BigIntegerField(default=0)
+    horizon_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.name}: {self.position}"
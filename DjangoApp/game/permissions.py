@@ -0,0 +1,51 @@
+from asgiref.sync import sync_to_async
+from django.contrib.auth.views import redirect_to_login
+from django.http import HttpResponseForbidden
+from django.shortcuts import redirect
+
+from game.services import FlaskAPIService
+
+AUTHOR_ROLES = ('author', 'admin')
+
+
+def is_author(user):
+    profile = getattr(user, 'userprofile', None)
+    return user.is_staff or (profile is not None and profile.role in AUTHOR_ROLES)
+
+
+class AuthorRequiredMixin:
+    """Lets only authors in and, on URLs with a ``story_id``, only the story's author.
+
+    Staff pass both checks. The role is read from the profile loaded with the
+    user (see game.backends) and the owner from the ownership cache in
+    FlaskAPIService, so an allowed request normally costs no extra query and
+    no API call. Works for both sync and async views.
+    """
+    role_denied_message = 'Only authors can edit stories'
+    owner_denied_message = 'You can only edit your own stories'
+
+    def check_permissions(self, request, story_id=None):
+        # Returns the response that ends the request, or None to go on.
+        user = request.user
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        if not is_author(user):
+            return HttpResponseForbidden(self.role_denied_message)
+        if story_id is None:
+            return None
+        owner = FlaskAPIService.get_story_owner(story_id)
+        if owner is None:
+            return redirect('stories_list')
+        if owner != user.username and not user.is_staff:
+            return HttpResponseForbidden(self.owner_denied_message)
+        return None
+
+    def dispatch(self, request, *args, **kwargs):
+        if self.view_is_async:
+            return self._async_dispatch(request, *args, **kwargs)
+        denied = self.check_permissions(request, kwargs.get('story_id'))
+        return denied or super().dispatch(request, *args, **kwargs)
+
+    async def _async_dispatch(self, request, *args, **kwargs):
+        denied = await sync_to_async(self.check_permissions)(request, kwargs.get('story_id'))
+        return denied or await super().dispatch(request, *args, **kwargs)
@@ -0,0 +1,248 @@
+import atexit
+import json
+import logging
+import os
+import threading
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from game.models import Play, PlayBucket, PlayStep, StoryPlayStats
+
+logger = logging.getLogger(__name__)
+
+
+def _lock(handle):
+    # Each live process holds an exclusive lock on its own spool file, so a
+    # spool that can be locked belongs to a process that is gone.
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+def write_records(records):
+    # Spools written before steps were recorded only hold plays.
+    plays = [record for record in records if record.get('type', 'play') == 'play']
+    steps = [record for record in records if record.get('type') == 'step']
+    endings = Counter(
+        (record['story_id'], record['ending_label'], PlayBucket.floor(datetime.fromisoformat(record['created_at']), PlayBucket.HOUR))
+        for record in plays
+    )
+    with transaction.atomic():
+        Play.objects.bulk_create([Play(
+            user_id=record['user_id'],
+            story_id=record['story_id'],
+            ending_page_id=record['ending_page_id'],
+            ending_label=record['ending_label'],
+            created_at=datetime.fromisoformat(record['created_at'])
+        ) for record in plays])
+        for (story_id, ending_label, hour), plays_count in endings.items():
+            StoryPlayStats.record(story_id, ending_label, plays_count, played_at=hour)
+        PlayStep.objects.bulk_create([PlayStep(
+            play_key=record['play_key'],
+            story_id=record['story_id'],
+            from_page_id=record['from_page_id'],
+            choice_id=record['choice_id'],
+            page_id=record['page_id'],
+            is_ending=record['is_ending'],
+            created_at=datetime.fromisoformat(record['created_at'])
+        ) for record in steps], batch_size=500)
+
+
+def _read_spool(handle):
+    handle.seek(0)
+    records = []
+    for line in handle:
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            # A crash mid-write leaves at most one truncated last line.
+            logger.warning('Skipping unreadable play spool line')
+    return records
+
+
+def replay_spools(spool_dir, skip=None):
+    """Writes plays and steps left in spool files of processes that are no longer running."""
+    replayed = 0
+    for path in sorted(Path(spool_dir).glob('plays-*.spool')):
+        if skip is not None and path == skip:
+            continue
+        with open(path, 'r+', encoding='utf-8') as handle:
+            if not _lock(handle):
+                continue
+            records = _read_spool(handle)
+            if records:
+                write_records(records)
+                replayed += len(records)
+        path.unlink()
+    return replayed
+
+
+class PlayRecorder:
+    """Write-behind buffer for finished plays and play steps.
+
+    ``record`` appends the records to this process's spool file and to an
+    in-memory queue, and returns without touching the database. A background
+    thread writes the queue with one ``bulk_create`` per model (plus the
+    play-count rollups) every ``batch_size`` records or ``flush_ms``
+    milliseconds, then empties the spool. The queue is flushed at interpreter exit; after a
+    crash, the next process's thread replays spool files whose owner is gone
+    before its first flush, so no request waits on the backlog. Plays
+    are written at least once: a crash between the database commit and the
+    spool truncation replays that batch again.
+    """
+
+    def __init__(self, spool_dir, batch_size=100, flush_ms=500):
+        self.spool_dir = Path(spool_dir)
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000
+        self._queue = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self._spool = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self.spool_dir.mkdir(parents=True, exist_ok=True)
+            path = self.spool_dir / f'plays-{os.getpid()}.spool'
+            self._spool = open(path, 'a+', encoding='utf-8')
+            _lock(self._spool)
+            # A file with our pid can only be left over from an earlier run.
+            self._queue.extend(_read_spool(self._spool))
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, args=(path,), name='play-recorder', daemon=True)
+            self._thread.start()
+        atexit.register(self.stop)
+
+    def record(self, *records):
+        if self._thread is None:
+            self.start()
+        with self._lock:
+            self._spool.write(''.join(json.dumps(record) + '\n' for record in records))
+            self._spool.flush()
+            self._queue.extend(records)
+            if len(self._queue) >= self.batch_size:
+                self._wakeup.set()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                batch = list(self._queue)
+            if not batch:
+                return 0
+            write_records(batch)
+            with self._lock:
+                del self._queue[:len(batch)]
+                # Keep only what arrived while the batch was being written.
+                self._spool.seek(0)
+                self._spool.truncate()
+                for record in self._queue:
+                    self._spool.write(json.dumps(record) + '\n')
+                self._spool.flush()
+            return len(batch)
+
+    def _replay(self, own_spool):
+        if fcntl is None:
+            # Without file locks a live process's spool cannot be told apart
+            # from a dead one's; use the replay_play_spool command instead.
+            return
+        try:
+            replayed = replay_spools(self.spool_dir, skip=own_spool)
+            if replayed:
+                logger.info('Replayed %s spooled plays', replayed)
+        except Exception as e:
+            logger.warning('Could not replay play spools: %s', e)
+        finally:
+            close_old_connections()
+
+    def _run(self, own_spool):
+        # start() runs inside the first request that records a play, so the
+        # backlog of crashed processes is written from here instead.
+        self._replay(own_spool)
+        while not self._stopping:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                # The plays stay queued and spooled; try again next round.
+                logger.warning('Could not write buffered plays: %s', e)
+            finally:
+                close_old_connections()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        self._thread.join(timeout=5)
+        try:
+            self.flush()
+        except Exception as e:
+            logger.warning('Could not write buffered plays at shutdown, they stay spooled: %s', e)
+            return
+        with self._lock:
+            if not self._queue:
+                os.unlink(self._spool.name)
+                self._spool.close()
+                self._spool = None
+                self._thread = None
+
+
+play_recorder = PlayRecorder(
+    settings.PLAY_SPOOL_DIR,
+    batch_size=settings.PLAY_RECORDER_BATCH_SIZE,
+    flush_ms=settings.PLAY_RECORDER_FLUSH_MS
+)
+
+
+def _record(records):
+    if settings.PLAY_RECORDER_ENABLED:
+        play_recorder.record(*records)
+    else:
+        write_records(records)
+
+
+def record_play(user_id, story_id, ending_page_id, ending_label):
+    _record([{
+        'type': 'play',
+        'user_id': user_id,
+        'story_id': story_id,
+        'ending_page_id': ending_page_id,
+        'ending_label': ending_label,
+        'created_at': timezone.now().isoformat()
+    }])
+
+
+def record_steps(play_key, story_id, steps):
+    """Queues (from_page_id, choice_id, page_id, is_ending, created_at) steps of one play."""
+    if not steps:
+        return
+    _record([{
+        'type': 'step',
+        'play_key': play_key,
+        'story_id': story_id,
+        'from_page_id': from_page_id,
+        'choice_id': choice_id,
+        'page_id': page_id,
+        'is_ending': is_ending,
+        'created_at': (created_at or timezone.now()).isoformat()
+    } for from_page_id, choice_id, page_id, is_ending, created_at in steps])
@@ -1,13 +1,172 @@
-import requests
+import json
+import logging
 import os
+import threading
+import time
+from collections import OrderedDict
 from pathlib import Path
+from urllib.parse import urlencode
+from asgiref.sync import sync_to_async
 from dotenv import load_dotenv
+from django.core.cache import caches
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from game.instrumentation import TRACE_HEADER, current_trace_id, record_cache_lookup, record_call
+from game.upstream import CircuitBreaker, UpstreamClient
+
+logger = logging.getLogger(__name__)
 
 ENV_PATH = Path(__file__).resolve().parent.parent / '.env'
 load_dotenv(ENV_PATH)
 
 FLASK_API_URL = os.getenv('FLASK_API_URL', 'http://localhost:5000/api')
 FLASK_API_KEY = os.getenv('FLASK_API_KEY', 'nahb-secret-key-2026')
+FLASK_API_VALIDATOR_CACHE_BYTES = int(os.getenv('FLASK_API_VALIDATOR_CACHE_BYTES', 8 * 1024 * 1024))
+STORIES_PAGE_SIZE = 24
+# 'msgpack' asks the API for MessagePack reads (smaller bodies; the API
+# answers JSON if it lacks msgpack). With orjson on both sides JSON decodes
+# faster, so it stays the default; see FlaskAPI/benchmarks/serialization.py.
+FLASK_API_FORMAT = os.getenv('FLASK_API_FORMAT', 'json')
+MSGPACK_MIMETYPE = 'application/x-msgpack'
+FLASK_API_CACHE = os.getenv('FLASK_API_CACHE', 'default')
+FLASK_API_CACHE_STALE = int(os.getenv('FLASK_API_CACHE_STALE', 300))
+
+# Seconds a cached read is served without asking the API again. After that
+# it is still served for FLASK_API_CACHE_STALE seconds while one background
+# request refreshes it.
+CACHE_TTLS = {
+    'stories': 15,
+    'story': 30,
+    'start': 60,
+    'page': 60,
+    'pages': 30,
+    'bundle': 30,
+}
+REFRESH_LOCK_TIMEOUT = 30
+
+# Ownership is set on every create, import and delete made through this app,
+# but stories deleted elsewhere (the Flask CLI, bulk deletes) leave their entry
+# behind and SQLite may hand the id to a new story, so entries live no longer
+# than a cached story does.
+OWNER_CACHE_TTL = int(os.getenv('FLASK_API_OWNER_CACHE_TTL', CACHE_TTLS['story']))
+
+_client = UpstreamClient(
+    FLASK_API_URL,
+    pool_size=int(os.getenv('FLASK_API_POOL_SIZE', 20)),
+    connect_timeout=float(os.getenv('FLASK_API_CONNECT_TIMEOUT', 1.0)),
+    read_timeout=float(os.getenv('FLASK_API_READ_TIMEOUT', 5.0)),
+    retries=int(os.getenv('FLASK_API_GET_RETRIES', 2)),
+    backoff=float(os.getenv('FLASK_API_RETRY_BACKOFF', 0.1)),
+    breaker=CircuitBreaker(
+        threshold=int(os.getenv('FLASK_API_BREAKER_THRESHOLD', 5)),
+        reset_timeout=float(os.getenv('FLASK_API_BREAKER_RESET', 30))
+    )
+)
+
+# Last ETag and raw body seen per GET URL. The Flask API answers a matching
+# If-None-Match with an empty 304, so unchanged data is not re-downloaded
+# when a cached read expires. Bounded by the total size of the bodies.
+_validator_cache = OrderedDict()
+_validator_bytes = 0
+_validator_lock = threading.Lock()
+
+def _cache():
+    return caches[FLASK_API_CACHE]
+
+
+def _request(method, path, **kwargs):
+    # Every Flask API call goes through here, so it carries the request's
+    # trace ID and is counted by the upstream timing middleware.
+    trace_id = current_trace_id()
+    if trace_id:
+        kwargs['headers'] = dict(kwargs.get('headers') or {}, **{TRACE_HEADER: trace_id})
+    started = time.perf_counter()
+    status = 'error'
+    try:
+        response = _client.request(method, path, **kwargs)
+        status = response.status_code
+        return response
+    finally:
+        record_call(method, path, status, time.perf_counter() - started)
+
+
+def _remember_validator(key, etag, content_type, body):
+    global _validator_bytes
+    with _validator_lock:
+        previous = _validator_cache.pop(key, None)
+        if previous is not None:
+            _validator_bytes -= len(previous[2])
+        if not etag or len(body) > FLASK_API_VALIDATOR_CACHE_BYTES:
+            return
+        _validator_cache[key] = (etag, content_type, body)
+        _validator_bytes += len(body)
+        while _validator_bytes > FLASK_API_VALIDATOR_CACHE_BYTES:
+            _, evicted = _validator_cache.popitem(last=False)
+            _validator_bytes -= len(evicted[2])
+
+
+def _forget_validators(story_id):
+    # Deleted ids can be handed to a new story, so its URLs must not be
+    # revalidated with the old story's ETags.
+    global _validator_bytes
+    path = f'/stories/{story_id}'
+    with _validator_lock:
+        for key in [key for key in _validator_cache if key[0] == path or key[0].startswith(path + '/')]:
+            _validator_bytes -= len(_validator_cache.pop(key)[2])
+
+
+def _accept_header():
+    if FLASK_API_FORMAT == 'msgpack' and msgpack is not None:
+        return f'{MSGPACK_MIMETYPE}, application/json;q=0.9'
+    return 'application/json'
+
+
+def _decode(content_type, body):
+    if content_type.startswith(MSGPACK_MIMETYPE):
+        return msgpack.unpackb(body, raw=False, strict_map_key=False)
+    return orjson.loads(body) if orjson is not None else json.loads(body)
+
+
+def _generation(scope):
+    # Cache keys embed a generation token per story (and one for the story
+    # list); writes replace the token instead of hunting down every key.
+    cache = _cache()
+    key = f'flaskapi:gen:{scope}'
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, time.time_ns(), None)
+        generation = cache.get(key)
+    return generation
+
+
+def _invalidate(*scopes):
+    _cache().set_many({f'flaskapi:gen:{scope}': time.time_ns() for scope in scopes}, None)
+
+
+def _owner_key(story_id):
+    return f'flaskapi:owner:{story_id}'
+
+
+def _remember_owner(story):
+    _cache().set(_owner_key(story['id']), story.get('author_id') or '', OWNER_CACHE_TTL)
+
+
+def _page_story_key(page_id):
+    return f'flaskapi:page-story:{page_id}'
+
+
+def _story_scopes(story_id):
+    return ('catalog', f'story:{story_id}') if story_id is not None else ('catalog',)
+
 
 class FlaskAPIService:
     
@@ -17,63 +176,275 @@ class FlaskAPIService:
             'Content-Type': 'application/json',
             'X-API-KEY': FLASK_API_KEY
         }
+
+    @staticmethod
+    def _get(path, params=None):
+        key = (path, tuple(sorted((params or {}).items())))
+
+        with _validator_lock:
+            cached = _validator_cache.get(key)
+        headers = {'Accept': _accept_header()}
+        if cached:
+            headers['If-None-Match'] = cached[0]
+
+        response = _request('GET', path, retry=True, params=params, headers=headers)
+        if response.status_code == 304 and cached:
+            with _validator_lock:
+                if key in _validator_cache:
+                    _validator_cache.move_to_end(key)
+            return 200, _decode(cached[1], cached[2])
+
+        etag = response.headers.get('ETag')
+        content_type = response.headers.get('Content-Type', '')
+        _remember_validator(key, etag if response.status_code == 200 else None, content_type, response.content)
+
+        if response.status_code != 200:
+            return response.status_code, None
+        return 200, _decode(content_type, response.content)
     
+    @staticmethod
+    def _cache_key(scope, path, params=None):
+        query = urlencode(sorted(params.items())) if params else ''
+        return f'flaskapi:{_generation(scope)}:{path}?{query}'
+
+    @staticmethod
+    def _store(key, endpoint, data):
+        ttl = CACHE_TTLS[endpoint]
+        _cache().set(key, {'data': data, 'fresh_until': time.time() + ttl}, ttl + FLASK_API_CACHE_STALE)
+
+    @staticmethod
+    def _refresh(key, endpoint, path, params=None):
+        status, data = FlaskAPIService._get(path, params)
+        if status == 200:
+            FlaskAPIService._store(key, endpoint, data)
+        return status, data
+
+    @staticmethod
+    def _refresh_in_background(key, endpoint, path, params=None):
+        # Only this path takes the refresh lock (in _cached_get), so only it
+        # releases it; a foreground miss must not free another refresher's lock.
+        try:
+            FlaskAPIService._refresh(key, endpoint, path, params)
+        except Exception as e:
+            logger.warning("Error refreshing %s: %s", path, e)
+        finally:
+            _cache().delete(f'{key}:refresh')
+
+    @staticmethod
+    def _cached_get(endpoint, scope, path, params=None):
+        key = FlaskAPIService._cache_key(scope, path, params)
+        entry = _cache().get(key)
+        record_cache_lookup(entry is not None)
+        if entry is None:
+            return FlaskAPIService._refresh(key, endpoint, path, params)
+
+        # Stale entries are served as is; only the caller that wins the
+        # refresh lock asks the API again, off the request thread.
+        if entry['fresh_until'] <= time.time() and _cache().add(f'{key}:refresh', 1, REFRESH_LOCK_TIMEOUT):
+            threading.Thread(
+                target=FlaskAPIService._refresh_in_background,
+                args=(key, endpoint, path, params),
+                daemon=True
+            ).start()
+        return 200, entry['data']
+
     @staticmethod
     def get_published_stories():
         try:
-            response = requests.get(f'{FLASK_API_URL}/stories', params={'status': 'published'})
-            return response.json() if response.status_code == 200 else []
+            status, data = FlaskAPIService._cached_get('stories', 'catalog', '/stories', params={'status': 'published'})
+            return data if status == 200 else []
         except Exception as e:
-            print(f"Error fetching stories: {e}")
+            logger.warning("Error fetching stories: %s", e)
             return []
 
+    @staticmethod
+    def get_stories_page(status=None, author_id=None, after=None, limit=STORIES_PAGE_SIZE, fields=None):
+        try:
+            params = {'limit': limit}
+            if status:
+                params['status'] = status
+            if author_id:
+                params['author'] = author_id
+            if after is not None:
+                params['after'] = after
+            if fields:
+                params['fields'] = ','.join(fields)
+            status_code, data = FlaskAPIService._cached_get('stories', 'catalog', '/stories', params=params)
+            return data if status_code == 200 else {'stories': [], 'next_cursor': None}
+        except Exception as e:
+            logger.warning("Error fetching stories: %s", e)
+            return {'stories': [], 'next_cursor': None}
+
+    @staticmethod
+    def iter_stories(status=None, author_id=None, fields=None, limit=200):
+        after = None
+        while True:
+            page = FlaskAPIService.get_stories_page(status, author_id, after, limit, fields)
+            yield from page['stories']
+            after = page['next_cursor']
+            if after is None:
+                return
+
+    @staticmethod
+    def get_story_ids():
+        # Unlike iter_stories this raises on any failure, so callers that
+        # delete data never act on a partial catalog.
+        story_ids = []
+        after = None
+        while True:
+            params = {'limit': 200, 'fields': 'id'}
+            if after is not None:
+                params['after'] = after
+            status, data = FlaskAPIService._get('/stories', params=params)
+            if status != 200:
+                raise RuntimeError(f'Flask API answered {status} to the story list')
+            story_ids.extend(story['id'] for story in data['stories'])
+            after = data['next_cursor']
+            if after is None:
+                return story_ids
+
     @staticmethod
     def get_story(story_id):
         try:
-            response = requests.get(f'{FLASK_API_URL}/stories/{story_id}')
-            return response.json() if response.status_code == 200 else None
+            status, data = FlaskAPIService._cached_get('story', f'story:{story_id}', f'/stories/{story_id}')
+            return data if status == 200 else None
         except Exception as e:
-            print(f"Error fetching story {story_id}: {e}")
+            logger.warning("Error fetching story %s: %s", story_id, e)
             return None
 
+    @staticmethod
+    def get_story_owner(story_id):
+        """Returns the story's author_id ('' if it has none), or None if the story does not exist."""
+        owner = _cache().get(_owner_key(story_id))
+        if owner is not None:
+            return owner
+        # Asks the API rather than the story cache, which may still hold a
+        # deleted story whose id now belongs to someone else. The request is
+        # conditional, so an unchanged story costs an empty 304.
+        try:
+            status, story = FlaskAPIService._get(f'/stories/{story_id}')
+        except Exception as e:
+            logger.warning("Error fetching the owner of story %s: %s", story_id, e)
+            return None
+        if status != 200 or not story:
+            return None
+        _remember_owner(story)
+        return story.get('author_id') or ''
+
     @staticmethod
     def get_story_start(story_id):
         try:
-            response = requests.get(f'{FLASK_API_URL}/stories/{story_id}/start')
-            return response.json() if response.status_code == 200 else None
+            status, data = FlaskAPIService._cached_get('start', f'story:{story_id}', f'/stories/{story_id}/start')
+            return data if status == 200 else None
         except Exception as e:
-            print(f"Error fetching story start {story_id}: {e}")
+            logger.warning("Error fetching story start %s: %s", story_id, e)
             return None
 
     @staticmethod
     def get_page(page_id):
         try:
-            response = requests.get(f'{FLASK_API_URL}/pages/{page_id}')
-            return response.json() if response.status_code == 200 else None
+            # Pages are cached under their story's generation; the owning
+            # story is learned from the first response.
+            story_id = _cache().get(_page_story_key(page_id))
+            if story_id is not None:
+                status, data = FlaskAPIService._cached_get('page', f'story:{story_id}', f'/pages/{page_id}')
+            else:
+                status, data = FlaskAPIService._get(f'/pages/{page_id}')
+                if status == 200:
+                    # Lives as long as the cached page it points to; deleted
+                    # page ids can be reused by another story.
+                    _cache().set(_page_story_key(page_id), data['story_id'], CACHE_TTLS['page'] + FLASK_API_CACHE_STALE)
+                    key = FlaskAPIService._cache_key(f"story:{data['story_id']}", f'/pages/{page_id}')
+                    FlaskAPIService._store(key, 'page', data)
+            return data if status == 200 else None
         except Exception as e:
-            print(f"Error fetching page {page_id}: {e}")
+            logger.warning("Error fetching page %s: %s", page_id, e)
             return None
 
     @staticmethod
     def get_story_pages(story_id):
         try:
-            response = requests.get(f'{FLASK_API_URL}/stories/{story_id}/pages')
-            return response.json() if response.status_code == 200 else []
+            status, data = FlaskAPIService._cached_get('pages', f'story:{story_id}', f'/stories/{story_id}/pages')
+            return data if status == 200 else []
         except Exception as e:
-            print(f"Error: {e}")
+            logger.warning("Error fetching pages for story %s: %s", story_id, e)
             return []
 
+    @staticmethod
+    def get_story_bundle(story_id):
+        try:
+            status, data = FlaskAPIService._cached_get('bundle', f'story:{story_id}', f'/stories/{story_id}/bundle')
+            return data if status == 200 else None
+        except Exception as e:
+            logger.warning("Error fetching story bundle %s: %s", story_id, e)
+            return None
+
+    @staticmethod
+    def get_story_analysis(story_id):
+        try:
+            status, data = FlaskAPIService._get(f'/stories/{story_id}/analysis')
+            return data if status == 200 else None
+        except Exception as e:
+            logger.warning("Error fetching story analysis %s: %s", story_id, e)
+            return None
+
+    @staticmethod
+    def validate_story(story_id):
+        try:
+            status, data = FlaskAPIService._get(f'/stories/{story_id}/validation')
+            return data if status == 200 else None
+        except Exception as e:
+            logger.warning("Error validating story %s: %s", story_id, e)
+            return None
+
+    @staticmethod
+    def iter_export(since=None, status=None, cursor=None):
+        # Yields export records one by one; resume with the last 'cursor' seen.
+        params = {}
+        if since:
+            params['since'] = since
+        if status:
+            params['status'] = status
+        if cursor is not None:
+            params['cursor'] = cursor
+        with _request('GET', '/export', retry=True, params=params, stream=True) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+
     @staticmethod
     def create_story(title, description, author_id=None):
         try:
             data = {'title': title, 'description': description}
             if author_id:
                 data['author_id'] = author_id
-            response = requests.post(f'{FLASK_API_URL}/stories', json=data, headers=FlaskAPIService._get_headers())
-            return response.json() if response.status_code == 201 else None
+            response = _request('POST', '/stories', json=data, headers=FlaskAPIService._get_headers())
+            if response.status_code != 201:
+                return None
+            story = response.json()
+            _remember_owner(story)
+            return story
+        except Exception as e:
+            logger.warning("Error creating story: %s", e)
+            return None
+        finally:
+            _invalidate(*_story_scopes(None))
+
+    @staticmethod
+    def import_story(story_graph):
+        try:
+            response = _request('POST', '/stories/import', json=story_graph, headers=FlaskAPIService._get_headers())
+            if response.status_code != 201:
+                return None
+            story = response.json()
+            _remember_owner(story)
+            return story
         except Exception as e:
-            print(f"Error creating story: {e}")
+            logger.warning("Error importing story: %s", e)
             return None
+        finally:
+            _invalidate(*_story_scopes(None))
 
     @staticmethod
     def update_story(story_id, title=None, description=None, status=None):
@@ -85,20 +456,26 @@ class FlaskAPIService:
                 data['description'] = description
             if status:
                 data['status'] = status
-            response = requests.put(f'{FLASK_API_URL}/stories/{story_id}', json=data, headers=FlaskAPIService._get_headers())
+            response = _request('PUT', f'/stories/{story_id}', json=data, headers=FlaskAPIService._get_headers())
             return response.json() if response.status_code == 200 else None
         except Exception as e:
-            print(f"Error updating story {story_id}: {e}")
+            logger.warning("Error updating story %s: %s", story_id, e)
             return None
+        finally:
+            _invalidate(*_story_scopes(story_id))
     
     @staticmethod
     def delete_story(story_id):
         try:
-            response = requests.delete(f'{FLASK_API_URL}/stories/{story_id}', headers=FlaskAPIService._get_headers())
+            response = _request('DELETE', f'/stories/{story_id}', headers=FlaskAPIService._get_headers())
             return response.status_code == 200
         except Exception as e:
-            print(f"Error deleting story {story_id}: {e}")
+            logger.warning("Error deleting story %s: %s", story_id, e)
             return False
+        finally:
+            _cache().delete(_owner_key(story_id))
+            _forget_validators(story_id)
+            _invalidate(*_story_scopes(story_id))
     
     @staticmethod
     def create_page(story_id, text, is_ending=False, ending_label=None):
@@ -109,46 +486,89 @@ class FlaskAPIService:
             }
             if ending_label:
                 data['ending_label'] = ending_label
-            response = requests.post(f'{FLASK_API_URL}/stories/{story_id}/pages', json=data, headers=FlaskAPIService._get_headers())
+            response = _request('POST', f'/stories/{story_id}/pages', json=data, headers=FlaskAPIService._get_headers())
             return response.json() if response.status_code == 201 else None
         except Exception as e:
-            print(f"Error creating page: {e}")
+            logger.warning("Error creating page: %s", e)
             return None
+        finally:
+            _invalidate(*_story_scopes(story_id))
     
     @staticmethod
-    def create_choice(page_id, text, next_page_id):
+    def create_choice(page_id, text, next_page_id, story_id=None):
+        if story_id is None:
+            story_id = _cache().get(_page_story_key(page_id))
         try:
             data = {'text': text, 'next_page_id': next_page_id}
-            response = requests.post(f'{FLASK_API_URL}/pages/{page_id}/choices', json=data, headers=FlaskAPIService._get_headers())
+            response = _request('POST', f'/pages/{page_id}/choices', json=data, headers=FlaskAPIService._get_headers())
             return response.json() if response.status_code == 201 else None
         except Exception as e:
-            print(f"Error creating choice: {e}")
+            logger.warning("Error creating choice: %s", e)
             return None
+        finally:
+            _invalidate(*_story_scopes(story_id))
 
     @staticmethod
-    def delete_page(page_id):
+    def delete_page(page_id, story_id=None):
+        if story_id is None:
+            story_id = _cache().get(_page_story_key(page_id))
         try:
-            response = requests.delete(f'{FLASK_API_URL}/pages/{page_id}', headers=FlaskAPIService._get_headers())
+            response = _request('DELETE', f'/pages/{page_id}', headers=FlaskAPIService._get_headers())
             return response.status_code == 200
         except Exception as e:
-            print(f"Error: {e}")
+            logger.warning("Error deleting page %s: %s", page_id, e)
             return False
+        finally:
+            _cache().delete(_page_story_key(page_id))
+            _invalidate(*_story_scopes(story_id))
 
     @staticmethod
-    def delete_choice(choice_id):
+    def delete_choice(choice_id, story_id=None):
         try:
-            response = requests.delete(f'{FLASK_API_URL}/choices/{choice_id}', headers=FlaskAPIService._get_headers())
+            response = _request('DELETE', f'/choices/{choice_id}', headers=FlaskAPIService._get_headers())
             return response.status_code == 200
         except Exception as e:
-            print(f"Error: {e}")
+            logger.warning("Error deleting choice %s: %s", choice_id, e)
             return False
+        finally:
+            _invalidate(*_story_scopes(story_id))
         
     @staticmethod
     def get_all_stories():
 
         try:
-            response = requests.get(f'{FLASK_API_URL}/stories')
-            return response.json() if response.status_code == 200 else []
+            status, data = FlaskAPIService._cached_get('stories', 'catalog', '/stories')
+            return data if status == 200 else []
         except Exception as e:
-            print(f"Error fetching stories: {e}")
-            return []
\ No newline at end of file
+            logger.warning("Error fetching stories: %s", e)
+            return []
+
+
+def _async(method):
+    # thread_sensitive=False runs each call on its own worker thread, so
+    # several upstream calls awaited together really overlap.
+    return staticmethod(sync_to_async(method, thread_sensitive=False))
+
+
+class AsyncFlaskAPIService:
+    """Awaitable versions of the FlaskAPIService calls, for async views."""
+
+    get_published_stories = _async(FlaskAPIService.get_published_stories)
+    get_stories_page = _async(FlaskAPIService.get_stories_page)
+    get_story = _async(FlaskAPIService.get_story)
+    get_story_owner = _async(FlaskAPIService.get_story_owner)
+    get_story_start = _async(FlaskAPIService.get_story_start)
+    get_page = _async(FlaskAPIService.get_page)
+    get_story_pages = _async(FlaskAPIService.get_story_pages)
+    get_story_bundle = _async(FlaskAPIService.get_story_bundle)
+    get_story_analysis = _async(FlaskAPIService.get_story_analysis)
+    validate_story = _async(FlaskAPIService.validate_story)
+    create_story = _async(FlaskAPIService.create_story)
+    import_story = _async(FlaskAPIService.import_story)
+    update_story = _async(FlaskAPIService.update_story)
+    delete_story = _async(FlaskAPIService.delete_story)
+    create_page = _async(FlaskAPIService.create_page)
+    create_choice = _async(FlaskAPIService.create_choice)
+    delete_page = _async(FlaskAPIService.delete_page)
+    delete_choice = _async(FlaskAPIService.delete_choice)
+    get_all_stories = _async(FlaskAPIService.get_all_stories)
@@ -1,3 +1,350 @@
+import tempfile
+import threading
+from datetime import timedelta
+from unittest import mock
+
+import requests
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.test import TestCase
+from django.utils import timezone
+
+from game.maintenance import STEP_ROLLUP, cleanup_orphan_plays, rollup_play_steps
+from game.models import PageStats, Play, PlayStep, RollupCursor, StoryPlayStats, UserProfile
+from game import recorder as recorder_module
+from game import services
+from game.recorder import PlayRecorder
+from game.services import FlaskAPIService
+from game.upstream import CircuitBreaker, UpstreamClient
+
+
+def make_stories(count):
+    return [{
+        'id': story_id,
+        'title': f'Story {story_id}',
+        'description': 'A test story',
+        'status': 'published',
+        'author_id': 'author'
+    } for story_id in range(1, count + 1)]
+
+
+def record_plays(stories, played_at=None):
+    for story in stories:
+        for label in ('Good end', 'Bad end', ''):
+            StoryPlayStats.record(story['id'], label, plays=3, played_at=played_at or timezone.now())
+
+
+class QueryCountTestCase(TestCase):
+    """The stats views read rollup tables, so their query count must not
+    depend on how many stories, endings or plays there are. The Flask API
+    is mocked out; only database queries are counted.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user('reader', 'reader@example.com', 'password')
+        UserProfile.objects.create(user=self.user, role='reader')
+
+    def login(self):
+        self.client.force_login(self.user)
+
+    def assertQueriesStayFlat(self, queries, url, sizes=(2, 25)):
+        # Same number of queries for a small and a large catalog.
+        for size in sizes:
+            stories = make_stories(size)
+            record_plays(stories)
+            with self.patch_stories(stories):
+                with self.assertNumQueries(queries):
+                    response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+
+    def patch_stories(self, stories):
+        return mock.patch.multiple(
+            FlaskAPIService,
+            get_stories_page=mock.Mock(return_value={'stories': stories, 'next_cursor': None}),
+            iter_stories=mock.Mock(return_value=iter(stories)),
+            get_story=mock.Mock(side_effect=lambda story_id: stories[story_id - 1])
+        )
+
+
+class StoriesListViewQueryTests(QueryCountTestCase):
+
+    def test_anonymous(self):
+        # Play totals for the whole page in one query.
+        self.assertQueriesStayFlat(1, '/')
+
+    def test_logged_in(self):
+        # Plus the session and the user, loaded with its profile.
+        self.login()
+        self.assertQueriesStayFlat(3, '/')
+
+
+class StatsViewQueryTests(QueryCountTestCase):
+
+    def test_all_time(self):
+        # Story totals, ending counts and the overall total.
+        self.assertQueriesStayFlat(3, '/stats/')
+
+    def test_date_range(self):
+        # One query over the day buckets, however long the range.
+        start = (timezone.now() - timedelta(days=90)).date()
+        self.assertQueriesStayFlat(1, f'/stats/?start={start}')
+
+
+class StoryDetailViewQueryTests(QueryCountTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.login()
+
+    def test_all_time(self):
+        # Session, user, story total, endings and the trend series.
+        self.assertQueriesStayFlat(5, '/stories/1/')
+
+    def test_date_range(self):
+        # Session, user, range totals and the trend series.
+        start = (timezone.now() - timedelta(days=90)).date()
+        self.assertQueriesStayFlat(4, f'/stories/1/?start={start}')
+
+    def test_many_plays(self):
+        stories = make_stories(1)
+        for days_ago in range(60):
+            record_plays(stories, timezone.now() - timedelta(days=days_ago))
+        with self.patch_stories(stories):
+            with self.assertNumQueries(5):
+                response = self.client.get('/stories/1/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['total_plays'], 60 * 9)
+
+
+class UpstreamTimingMiddlewareTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.upstream = mock.Mock(return_value=mock.Mock(
+            status_code=200,
+            headers={'Content-Type': 'application/json'},
+            content=b'{"stories": [], "next_cursor": null}'
+        ))
+
+    def test_upstream_calls_are_timed_and_traced(self):
+        with mock.patch.object(services._client, 'request', self.upstream):
+            response = self.client.get('/', HTTP_X_REQUEST_ID='trace-1')
+            cached = self.client.get('/')
+
+        self.assertEqual(response['X-Request-ID'], 'trace-1')
+        self.assertIn('desc="1 Flask API calls"', response['Server-Timing'])
+        self.assertIn('desc="0 hits, 1 misses"', response['Server-Timing'])
+        self.assertEqual(self.upstream.call_args.kwargs['headers']['X-Request-ID'], 'trace-1')
+        # The second request is served from the API cache under a new trace ID.
+        self.assertEqual(len(cached['X-Request-ID']), 32)
+        self.assertIn('desc="0 Flask API calls"', cached['Server-Timing'])
+        self.assertIn('desc="1 hits, 0 misses"', cached['Server-Timing'])
+
+    def test_stats_page_is_staff_only(self):
+        self.client.force_login(User.objects.create_user('reader', 'reader@example.com', 'password'))
+        self.assertEqual(self.client.get('/stats/upstream/').status_code, 302)
+
+        self.client.force_login(User.objects.create_user('staff', 'staff@example.com', 'password', is_staff=True))
+        with mock.patch.object(services._client, 'request', self.upstream):
+            self.client.get('/')
+        response = self.client.get('/stats/upstream/')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'StoriesListView')
+
+
+class CircuitBreakerTests(TestCase):
+
+    def test_probe_that_raises_unexpectedly_does_not_wedge_the_circuit(self):
+        breaker = CircuitBreaker(threshold=1, reset_timeout=0)
+        client = UpstreamClient('http://upstream.invalid', retries=0, breaker=breaker)
+        breaker.record_failure()
+
+        with mock.patch.object(requests.Session, 'request', side_effect=ValueError('bad body')):
+            with self.assertRaises(ValueError):
+                client.request('GET', '/stories')
+        self.assertEqual(breaker.state, 'half-open')
+
+        with mock.patch.object(requests.Session, 'request', return_value=mock.Mock(status_code=200)):
+            client.request('GET', '/stories')
+        self.assertEqual(breaker.state, 'closed')
+
+
+class StaleWhileRevalidateTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_foreground_miss_keeps_the_background_refresh_lock(self):
+        key = FlaskAPIService._cache_key('catalog', '/stories')
+        cache.add(f'{key}:refresh', 1, 30)
+        with mock.patch.object(FlaskAPIService, '_get', return_value=(200, [])):
+            FlaskAPIService._cached_get('stories', 'catalog', '/stories')
+        self.assertEqual(cache.get(f'{key}:refresh'), 1)
+
+    def test_background_refresh_releases_its_lock(self):
+        key = FlaskAPIService._cache_key('catalog', '/stories')
+        cache.add(f'{key}:refresh', 1, 30)
+        with mock.patch.object(FlaskAPIService, '_get', side_effect=RuntimeError('down')):
+            FlaskAPIService._refresh_in_background(key, 'stories', '/stories')
+        self.assertIsNone(cache.get(f'{key}:refresh'))
+
+
+class StoryOwnerCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_import_primes_the_owner_of_the_new_story(self):
+        cache.set(services._owner_key(7), 'previous-author')
+        response = mock.Mock(status_code=201)
+        response.json.return_value = {'id': 7, 'author_id': 'importer'}
+        with mock.patch.object(services, '_request', return_value=response):
+            FlaskAPIService.import_story({'title': 'T', 'description': 'D', 'pages': [], 'choices': []})
+        with mock.patch.object(FlaskAPIService, '_get') as get:
+            self.assertEqual(FlaskAPIService.get_story_owner(7), 'importer')
+        get.assert_not_called()
+
+    def test_owner_is_not_read_from_the_story_cache(self):
+        # The cached story is a deleted one whose id was reused.
+        with mock.patch.object(FlaskAPIService, '_get', return_value=(200, {'id': 7, 'author_id': 'old-author'})):
+            FlaskAPIService.get_story(7)
+        with mock.patch.object(FlaskAPIService, '_get', return_value=(200, {'id': 7, 'author_id': 'new-author'})):
+            self.assertEqual(FlaskAPIService.get_story_owner(7), 'new-author')
+
+
+class ValidatorCacheTests(TestCase):
+
+    def tearDown(self):
+        for story_id in (4, 40):
+            services._forget_validators(story_id)
+
+    def test_deleting_a_story_forgets_its_etags(self):
+        for path in ('/stories/4', '/stories/4/pages', '/stories/40'):
+            services._remember_validator((path, ()), '"4.0"', 'application/json', b'{}')
+        with mock.patch.object(services, '_request', return_value=mock.Mock(status_code=200)):
+            FlaskAPIService.delete_story(4)
+        self.assertNotIn(('/stories/4', ()), services._validator_cache)
+        self.assertNotIn(('/stories/4/pages', ()), services._validator_cache)
+        self.assertIn(('/stories/40', ()), services._validator_cache)
+
+
+class DeleteFromStoryViewTests(TestCase):
+
+    def setUp(self):
+        user = User.objects.create_user('author', 'author@example.com', 'password')
+        UserProfile.objects.create(user=user, role='author')
+        self.client.force_login(user)
+        # The author owns story 1; page 20 belongs to someone else's story 2.
+        owner = mock.patch.object(FlaskAPIService, 'get_story_owner', return_value='author')
+        page = mock.patch.object(FlaskAPIService, 'get_page', return_value={
+            'id': 20, 'story_id': 2, 'choices': [{'id': 30, 'text': 'Go', 'next_page_id': 21}]
+        })
+        owner.start()
+        page.start()
+        self.addCleanup(owner.stop)
+        self.addCleanup(page.stop)
+
+    def test_page_of_another_story_is_not_deleted(self):
+        with mock.patch.object(FlaskAPIService, 'delete_page') as delete_page:
+            response = self.client.post('/author/delete-page/1/20/')
+        self.assertEqual(response.status_code, 404)
+        delete_page.assert_not_called()
+
+    def test_choice_of_another_story_is_not_deleted(self):
+        with mock.patch.object(FlaskAPIService, 'delete_choice') as delete_choice:
+            response = self.client.post('/author/delete-choice/1/20/30/')
+        self.assertEqual(response.status_code, 404)
+        delete_choice.assert_not_called()
+
+    def test_choice_must_be_on_the_page(self):
+        with mock.patch.object(FlaskAPIService, 'delete_choice') as delete_choice:
+            response = self.client.post('/author/delete-choice/2/20/31/')
+        self.assertEqual(response.status_code, 404)
+        delete_choice.assert_not_called()
+
+    def test_own_page_is_deleted(self):
+        with mock.patch.object(FlaskAPIService, 'delete_page') as delete_page:
+            response = self.client.post('/author/delete-page/2/20/')
+        self.assertEqual(response.status_code, 302)
+        delete_page.assert_called_once_with(20, story_id=2)
+
+
+class PageStoryCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_deleting_a_page_forgets_its_story(self):
+        with mock.patch.object(FlaskAPIService, '_get', return_value=(200, {'id': 20, 'story_id': 2, 'choices': []})):
+            FlaskAPIService.get_page(20)
+        self.assertEqual(cache.get(services._page_story_key(20)), 2)
+        with mock.patch.object(services, '_request', return_value=mock.Mock(status_code=200)):
+            FlaskAPIService.delete_page(20)
+        self.assertIsNone(cache.get(services._page_story_key(20)))
+
+
+class OrphanPlayCleanupTests(TestCase):
+
+    def test_story_created_during_the_cleanup_keeps_its_plays(self):
+        Play.objects.create(story_id=1, ending_page_id=10)
+
+        def story_ids():
+            # Story 5 is created and played right after the catalog is read.
+            Play.objects.create(story_id=5, ending_page_id=50)
+            return [1]
+
+        with mock.patch.object(FlaskAPIService, 'get_story_ids', side_effect=story_ids):
+            self.assertEqual(cleanup_orphan_plays(), 0)
+        self.assertEqual(Play.objects.filter(story_id=5).count(), 1)
+
+
+class PlayStepRollupTests(TestCase):
+
+    def add_steps(self, count):
+        PlayStep.objects.bulk_create([
+            PlayStep(play_key='play', story_id=1, page_id=10, is_ending=False) for _ in range(count)
+        ])
+
+    def age_horizon(self):
+        RollupCursor.objects.filter(name=STEP_ROLLUP).update(
+            horizon_at=timezone.now() - timedelta(seconds=settings.PLAY_ROLLUP_SETTLE)
+        )
+
+    def test_only_steps_seen_a_settle_period_ago_are_folded(self):
+        self.add_steps(3)
+        # The first run only records how far the steps go.
+        self.assertEqual(rollup_play_steps(), 0)
+        # A step with a lower id could still commit, so nothing is folded
+        # before the settle period is over.
+        self.assertEqual(rollup_play_steps(), 0)
+
+        self.age_horizon()
+        self.add_steps(2)
+        self.assertEqual(rollup_play_steps(), 3)
+        self.assertEqual(PageStats.objects.get(story_id=1, page_id=10).visits, 3)
+
+        self.age_horizon()
+        self.assertEqual(rollup_play_steps(), 2)
+        self.assertEqual(PageStats.objects.get(story_id=1, page_id=10).visits, 5)
+
+
+class PlayRecorderTests(TestCase):
+
+    def test_spools_of_crashed_processes_are_replayed_off_the_request(self):
+        replayed = threading.Event()
+        threads = []
+
+        def replay(spool_dir, skip=None):
+            threads.append(threading.current_thread().name)
+            replayed.set()
+            return 0
 
-# Create your tests here.
+        with tempfile.TemporaryDirectory() as spool_dir:
+            recorder = PlayRecorder(spool_dir, flush_ms=10)
+            with mock.patch.object(recorder_module, 'replay_spools', side_effect=replay), \
+                    mock.patch.object(recorder_module, 'write_records'):
+                recorder.record({'type': 'play'})
+                self.assertTrue(replayed.wait(5))
+                recorder.stop()
+        self.assertEqual(threads, ['play-recorder'])
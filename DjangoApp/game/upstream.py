@@ -0,0 +1,137 @@
+import logging
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.utils import DEFAULT_ACCEPT_ENCODING
+
+logger = logging.getLogger(__name__)
+
+
+class UpstreamUnavailable(requests.RequestException):
+    """Raised without touching the network while the circuit is open."""
+
+
+class CircuitBreaker:
+    """Stops calling an upstream that keeps failing.
+
+    After ``threshold`` consecutive failures the circuit opens and every call
+    fails immediately for ``reset_timeout`` seconds. Then a single probe call
+    is let through: success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, threshold=5, reset_timeout=30):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self.opened_at is None:
+                return 'closed'
+            if self._probing or time.monotonic() - self.opened_at >= self.reset_timeout:
+                return 'half-open'
+            return 'open'
+
+    def before_call(self):
+        with self._lock:
+            if self.opened_at is None:
+                return
+            if self._probing or time.monotonic() - self.opened_at < self.reset_timeout:
+                raise UpstreamUnavailable('Flask API circuit is open')
+            self._probing = True
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                logger.info('Flask API recovered, closing circuit')
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.failures >= self.threshold:
+                if self.opened_at is None:
+                    logger.warning('Flask API failed %s times in a row, opening circuit', self.failures)
+                self.opened_at = time.monotonic()
+
+
+class UpstreamClient:
+    """Pooled keep-alive HTTP client for one upstream base URL.
+
+    Connections are reused through a shared ``requests.Session``; every call
+    has connect/read timeouts. Idempotent calls can be retried with full
+    jitter on connection errors, timeouts and gateway errors. Those same
+    failures feed the circuit breaker; other responses, including 500s
+    raised by the application itself, count as the upstream being up.
+    """
+
+    RETRY_STATUSES = (502, 503, 504)
+
+    def __init__(self, base_url, pool_size=20, connect_timeout=1.0, read_timeout=5.0,
+                 retries=2, backoff=0.1, breaker=None):
+        self.base_url = base_url
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+        self._session = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        # Pools must not be shared with a parent process after a fork.
+        with self._lock:
+            if self._session is None or self._pid != os.getpid():
+                session = requests.Session()
+                # Large reads come back compressed; this lists gzip, plus br
+                # when a brotli package is installed to decode it.
+                session.headers['Accept-Encoding'] = DEFAULT_ACCEPT_ENCODING
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._session = session
+                self._pid = os.getpid()
+            return self._session
+
+    def request(self, method, path, retry=False, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        url = f'{self.base_url}{path}'
+        attempts = self.retries + 1 if retry else 1
+
+        for attempt in range(attempts):
+            self.breaker.before_call()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.RequestException as e:
+                self.breaker.record_failure()
+                if attempt + 1 == attempts:
+                    raise
+                logger.info('%s %s failed (%s), retrying', method, path, e)
+            except BaseException:
+                # Anything else still ends a half-open probe; otherwise the
+                # circuit would wait for a probe result that never comes.
+                self.breaker.record_failure()
+                raise
+            else:
+                if response.status_code not in self.RETRY_STATUSES:
+                    self.breaker.record_success()
+                    return response
+                self.breaker.record_failure()
+                if attempt + 1 == attempts:
+                    return response
+                response.close()
+                logger.info('%s %s returned %s, retrying', method, path, response.status_code)
+            time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
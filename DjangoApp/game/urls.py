@@ -15,9 +15,13 @@ urlpatterns = [
     # Playing
     path('play/<int:story_id>/', PlayStoryView.as_view(), name='play_story'),
     path('play/<int:story_id>/<int:page_id>/', PlayStoryView.as_view(), name='play_page'),
+    path('play/<int:story_id>/finish/', FinishPlayView.as_view(), name='finish_play'),
+    path('play/<int:story_id>/steps/', PlayStepsView.as_view(), name='play_steps'),
     
     # Statistics
     path('stats/', StatsView.as_view(), name='stats'),
+    path('stats/<int:story_id>/funnel/', StoryFunnelView.as_view(), name='story_funnel'),
+    path('stats/upstream/', UpstreamStatsView.as_view(), name='upstream_stats'),
     
     # Author tools
     path('author/create/', CreateStoryView.as_view(), name='create_story'),
@@ -1,37 +1,252 @@
+import asyncio
+import json
+import re
+import uuid
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.views import redirect_to_login
 from django.shortcuts import render, redirect, get_object_or_404
 from django.views import View
-from django.db.models import Count, Q
-from game.services import FlaskAPIService
-from game.models import Play
+from django.db.models import Count, Q, Sum
+from django.http import Http404, HttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from game.services import FlaskAPIService, AsyncFlaskAPIService
+from game.models import Play, StoryPlayStats, EndingStats, PageStats, ChoiceStats, PlayBucket
+from game.maintenance import delete_story_plays
+from game.permissions import AuthorRequiredMixin
+from game.recorder import record_play, record_steps
+from game.instrumentation import upstream_stats
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
-from game.models import UserProfile
-from django.http import HttpResponseForbidden
-from game.models import UserProfile
 
 
-class StoriesListView(View):
-
-    def get(self, request):
+def _load_user(request):
+    user = request.user
+    if user.is_authenticated:
+        # Load the profile now so role checks and templates do not have to
+        # query it from the event loop.
+        getattr(user, 'userprofile', None)
+    return user
 
-        all_stories = FlaskAPIService.get_all_stories()
 
-        if request.user.is_staff:
-
-            stories = all_stories
+def _update_session(request, **values):
+    for key, value in values.items():
+        if value is None:
+            request.session.pop(key, None)
         else:
+            request.session[key] = value
+
+
+def _read_session(request, *keys):
+    return [request.session.get(key) for key in keys]
+
+
+# Rendering and session access may hit the database (the auth context
+# processor, lazy session loading), so async views run them off the loop.
+_arender = sync_to_async(render)
+_aupdate_session = sync_to_async(_update_session)
+_aread_session = sync_to_async(_read_session)
+_arecord_steps = sync_to_async(record_steps)
+
+MAX_PLAY_STEPS = 500
+PLAY_KEY = re.compile(r'[0-9a-f]{32}')
+TREND_DAYS = 30
+MAX_TREND_DAYS = 366
+
+
+def async_login_required(view_func):
+    # login_required in Django 4.2 reads request.user synchronously, which
+    # is not allowed inside an async view.
+    @wraps(view_func)
+    async def wrapper(request, *args, **kwargs):
+        user = await sync_to_async(_load_user)(request)
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        return await view_func(request, *args, **kwargs)
+    return wrapper
+
+
+def _compact_bundle(bundle):
+    # Embedded in the player page, so keys are kept short: t=text,
+    # e=is ending, c=[[choice text, next page id, choice id], ...].
+    return {
+        's': bundle['story']['start_page_id'],
+        'p': {
+            page['id']: {
+                't': page['text'],
+                'e': 1 if page['is_ending'] else 0,
+                'c': [[choice['text'], choice['next_page_id'], choice['id']] for choice in page['choices']]
+            }
+            for page in bundle['pages']
+        }
+    }
+
+
+def _parse_choice(value):
+    # Choice inputs post "<next page id>:<choice id>"; older pages only
+    # sent the next page id.
+    next_page_id, _, choice_id = (value or '').partition(':')
+    return (
+        int(next_page_id) if next_page_id.isdigit() else None,
+        int(choice_id) if choice_id.isdigit() else None
+    )
+
+
+def _parse_steps(raw):
+    """Reads the [from page, choice, page, ms since start] steps the browser player posts."""
+    try:
+        entries = json.loads(raw or '[]')
+    except ValueError:
+        return []
+    if not isinstance(entries, list):
+        return []
+    steps = []
+    for entry in entries[:MAX_PLAY_STEPS]:
+        if not isinstance(entry, list) or len(entry) != 4 or not all(type(value) is int for value in entry):
+            break
+        steps.append(entry)
+    if not steps:
+        return []
+    # Client clocks are not trusted; times are taken relative to now.
+    now = timezone.now()
+    last = steps[-1][3]
+    return [
+        (from_page_id, choice_id, page_id, False, now - timedelta(milliseconds=max(last - offset, 0)))
+        for from_page_id, choice_id, page_id, offset in steps
+    ]
+
+
+async def _start_play(request, story_id, page):
+    play_key = uuid.uuid4().hex
+    await _aupdate_session(request, current_story=story_id, current_page=page['id'], play_key=play_key)
+    await _arecord_steps(play_key, story_id, [(None, None, page['id'], page.get('is_ending', False), None)])
+    return play_key
+
+
+async def _finish_play(request, story, page):
+    # Queued for a batched write; only spools to disk on this request.
+    await sync_to_async(record_play)(
+        request.user.id if request.user.is_authenticated else None,
+        story['id'],
+        page['id'],
+        page.get('ending_label', 'Unknown Ending')
+    )
+
+    await _aupdate_session(request, current_story=None, current_page=None, play_key=None)
+
+    return await _arender(request, 'play/ending.html', {
+        'story': story,
+        'page': page
+    })
+
+
+def _date_range(request):
+    """Reads the inclusive ?start= and ?end= dates (YYYY-MM-DD, UTC) of a stats filter."""
+    dates = []
+    for name in ('start', 'end'):
+        try:
+            dates.append(parse_date(request.GET.get(name, '')))
+        except ValueError:
+            dates.append(None)
+    return dates
+
+
+def _day_start(day):
+    return datetime.combine(day, time.min, tzinfo=dt_timezone.utc) if day else None
+
+
+def _ranged_totals(start_date, end_date, story_ids=None):
+    # Returns ({story_id: plays}, {story_id: [ending, ...]}) from day buckets.
+    counts = PlayBucket.totals(
+        _day_start(start_date),
+        _day_start(end_date + timedelta(days=1)) if end_date else None,
+        story_ids
+    )
+    totals = {}
+    endings_by_story = {}
+    for (story_id, ending_label), count in sorted(counts.items()):
+        if not count:
+            continue
+        totals[story_id] = totals.get(story_id, 0) + count
+        endings_by_story.setdefault(story_id, []).append({'ending_label': ending_label, 'count': count})
+    return totals, endings_by_story
+
+
+def _play_trend(story_id, start_date, end_date):
+    end_date = end_date or timezone.now().date()
+    start_date = start_date or end_date - timedelta(days=TREND_DAYS - 1)
+    start_date = max(start_date, end_date - timedelta(days=MAX_TREND_DAYS - 1))
+    # Hourly bars for a range of up to two days, daily bars otherwise.
+    granularity = PlayBucket.HOUR if (end_date - start_date).days < 2 else PlayBucket.DAY
+    points = PlayBucket.series(
+        story_id, _day_start(start_date), _day_start(end_date + timedelta(days=1)), granularity
+    )
+    peak = max((count for _, count in points), default=0)
+    return {
+        'granularity': granularity,
+        'start': start_date,
+        'end': end_date,
+        'points': [{
+            'start': moment,
+            'count': count,
+            'height': round(count / peak * 100) if peak else 0
+        } for moment, count in points]
+    }
+
+
+def _validation_problems(report, pages):
+    sequence = {page['id']: page['sequence'] for page in pages or []}
+    problems = []
+    if report['start_page_missing']:
+        problems.append('The story has no start page.')
+    for page_id in report['dead_end_pages']:
+        if page_id not in report['unreachable_pages']:
+            problems.append(f"Page {sequence.get(page_id, '?')} has no choices and is not an ending.")
+    for choice in report['broken_choices']:
+        if choice['page_id'] not in report['unreachable_pages']:
+            problems.append(f"A choice on page {sequence.get(choice['page_id'], '?')} leads to a page that no longer exists.")
+    for cycle in report['trapped_cycles']:
+        pages_in_cycle = ', '.join(str(sequence.get(page_id, '?')) for page_id in cycle)
+        problems.append(f"Pages {pages_in_cycle} loop forever without reaching an ending.")
+    return problems
+
+
+def _page_of_story(story_id, page_id):
+    # The permission check only covers the story in the URL, so the page
+    # must really belong to it.
+    page = FlaskAPIService.get_page(page_id)
+    if not page or page.get('story_id') != story_id:
+        raise Http404('Page not found')
+    return page
+
 
-            stories = [s for s in all_stories if s.get('status') == 'published']
+class StoriesListView(View):
 
-        published = [s['id'] for s in all_stories if s.get('status') == 'published']
-        if published:
-            Play.objects.exclude(story_id__in=published).delete()
+    def get(self, request):
 
+        after = request.GET.get('after')
+        page = FlaskAPIService.get_stories_page(
+            status=None if request.user.is_staff else 'published',
+            after=int(after) if after and after.isdigit() else None,
+            fields=['title', 'description', 'status']
+        )
+        stories = page['stories']
+
+        plays = dict(StoryPlayStats.objects.filter(
+            story_id__in=[story['id'] for story in stories]
+        ).values_list('story_id', 'total_plays'))
         for story in stories:
-            story['plays'] = Play.objects.filter(story_id=story['id']).count()
+            story['plays'] = plays.get(story['id'], 0)
         
         return render(request, 'stories/list.html', {
             'stories': stories,
+            'next_cursor': page['next_cursor'],
+            'is_first_page': not after,
         })
 
 @method_decorator(login_required, name='dispatch')
@@ -42,104 +257,234 @@ class StoryDetailView(View):
         if not story:
             return redirect('stories_list')
 
-        plays = Play.objects.filter(story_id=story_id)
-        total_plays = plays.count()
+        start_date, end_date = _date_range(request)
+        if start_date or end_date:
+            totals, endings_by_story = _ranged_totals(start_date, end_date, [story_id])
+            total_plays = totals.get(story_id, 0)
+            endings = endings_by_story.get(story_id, [])
+        else:
+            total_plays = StoryPlayStats.objects.filter(story_id=story_id).values_list('total_plays', flat=True).first() or 0
+            endings = list(EndingStats.objects.filter(story_id=story_id, count__gt=0).values('ending_label', 'count'))
 
-        endings = plays.values('ending_label').annotate(count=Count('id'))
+        for ending in endings:
+            ending['percentage'] = round((ending['count'] / total_plays) * 100, 1) if total_plays else 0
 
         return render(request, 'stories/detail.html', {
             'story': story,
             'total_plays': total_plays,
-            'endings': endings
+            'endings': endings,
+            'start_date': start_date,
+            'end_date': end_date,
+            'trend': _play_trend(story_id, start_date, end_date)
         })
 
 @method_decorator(login_required, name='dispatch')
+class StoryFunnelView(View):
+
+    def get(self, request, story_id):
+        story = FlaskAPIService.get_story(story_id)
+        if not story:
+            return redirect('stories_list')
+        pages = FlaskAPIService.get_story_pages(story_id) or []
+
+        page_stats = {stats.page_id: stats for stats in PageStats.objects.filter(story_id=story_id)}
+        picks = dict(ChoiceStats.objects.filter(story_id=story_id).values_list('choice_id', 'picks'))
+
+        funnel = []
+        for page in sorted(pages, key=lambda page: page['sequence']):
+            stats = page_stats.get(page['id'])
+            visits = stats.visits if stats else 0
+            drop_offs = stats.drop_offs if stats else 0
+            choices = [{
+                'text': choice['text'],
+                'next_page_sequence': choice.get('next_page_sequence'),
+                'picks': picks.get(choice['id'], 0)
+            } for choice in page['choices']]
+            taken = sum(choice['picks'] for choice in choices)
+            for choice in choices:
+                choice['percentage'] = round((choice['picks'] / taken) * 100, 1) if taken else 0
+            funnel.append({
+                'page': page,
+                'visits': visits,
+                'drop_offs': drop_offs,
+                'drop_off_rate': round((drop_offs / visits) * 100, 1) if visits else 0,
+                'choices': choices
+            })
+
+        return render(request, 'stats/funnel.html', {
+            'story': story,
+            'funnel': funnel
+        })
+
+@method_decorator(async_login_required, name='dispatch')
 class PlayStoryView(View):
 
     
-    def get(self, request, story_id, page_id=None):
+    async def get(self, request, story_id, page_id=None):
+
+        # A new play downloads the whole story once and is walked in the
+        # browser; ?mode=server keeps the page-by-page flow.
+        if page_id is None and request.GET.get('mode') != 'server':
+            bundle = await AsyncFlaskAPIService.get_story_bundle(story_id)
+            if bundle:
+                return await self._play_in_browser(request, bundle)
+
+        if page_id is None:
+            page_call = AsyncFlaskAPIService.get_story_start(story_id)
+        else:
+            page_call = AsyncFlaskAPIService.get_page(page_id)
+        story, page = await asyncio.gather(AsyncFlaskAPIService.get_story(story_id), page_call)
 
-        story = FlaskAPIService.get_story(story_id)
         if not story:
             return redirect('stories_list')
 
         if story.get('status') == 'suspended':
-            return render(request, 'play/suspended.html', {
+            return await _arender(request, 'play/suspended.html', {
                 'story': story
             })
-
-        if page_id is None:
-            page = FlaskAPIService.get_story_start(story_id)
-        else:
-            page = FlaskAPIService.get_page(page_id)
         
         if not page:
             return redirect('story_detail', story_id=story_id)
 
-        request.session['current_story'] = story_id
-        request.session['current_page'] = page['id']
+        if page_id is None:
+            await _start_play(request, story_id, page)
+        else:
+            await _aupdate_session(request, current_story=story_id, current_page=page['id'])
         
-        return render(request, 'play/page.html', {
+        return await _arender(request, 'play/page.html', {
             'story': story,
             'page': page,
             'is_ending': page.get('is_ending', False)
         })
     
-    def post(self, request, story_id, page_id=None):
-        story = FlaskAPIService.get_story(story_id)
+    async def post(self, request, story_id, page_id=None):
+        next_page_id, choice_id = _parse_choice(request.POST.get('next_page_id'))
+
+        if next_page_id:
+            story, next_page = await asyncio.gather(
+                AsyncFlaskAPIService.get_story(story_id),
+                AsyncFlaskAPIService.get_page(next_page_id)
+            )
+        else:
+            story, next_page = await AsyncFlaskAPIService.get_story(story_id), None
 
         if story and story.get('status') == 'suspended':
-            return render(request, 'play/suspended.html', {
+            return await _arender(request, 'play/suspended.html', {
                 'story': story
             })
         
-        next_page_id = request.POST.get('next_page_id')
-        
         if not next_page_id:
             return redirect('play_story', story_id=story_id)
 
-        next_page = FlaskAPIService.get_page(int(next_page_id))
         if not next_page:
             return redirect('play_story', story_id=story_id)
 
-        if next_page.get('is_ending', False):
-            Play.objects.create(
-                user=request.user if request.user.is_authenticated else None,
-                story_id=story_id,
-                ending_page_id=next_page['id'],
-                ending_label=next_page.get('ending_label', 'Unknown Ending')
-            )
+        play_key, current_page = await _aread_session(request, 'play_key', 'current_page')
+        if play_key and next_page.get('story_id') == story_id:
+            await _arecord_steps(play_key, story_id, [
+                (current_page, choice_id, next_page['id'], next_page.get('is_ending', False), None)
+            ])
 
-            request.session.pop('current_story', None)
-            request.session.pop('current_page', None)
-            
-            return render(request, 'play/ending.html', {
-                'story': story,
-                'page': next_page
-            })
+        if next_page.get('is_ending', False):
+            return await _finish_play(request, story, next_page)
 
-        request.session['current_page'] = next_page['id']
-        return render(request, 'play/page.html', {
+        await _aupdate_session(request, current_page=next_page['id'])
+        return await _arender(request, 'play/page.html', {
             'story': story,
             'page': next_page,
             'is_ending': False
         })
 
+    async def _play_in_browser(self, request, bundle):
+        story = bundle['story']
+        if story.get('status') == 'suspended':
+            return await _arender(request, 'play/suspended.html', {
+                'story': story
+            })
+
+        page = next((p for p in bundle['pages'] if p['id'] == story['start_page_id']), None)
+        if not page:
+            return redirect('story_detail', story_id=story['id'])
+
+        play_key = await _start_play(request, story['id'], page)
+
+        return await _arender(request, 'play/player.html', {
+            'story': story,
+            'page': page,
+            'play_key': play_key,
+            'bundle': _compact_bundle(bundle)
+        })
+
+
+@method_decorator(async_login_required, name='dispatch')
+class FinishPlayView(View):
+
+    async def post(self, request, story_id):
+        ending_page_id = request.POST.get('ending_page_id')
+        if not ending_page_id or not ending_page_id.isdigit():
+            return redirect('play_story', story_id=story_id)
+
+        story, page = await asyncio.gather(
+            AsyncFlaskAPIService.get_story(story_id),
+            AsyncFlaskAPIService.get_page(int(ending_page_id))
+        )
+        if not story:
+            return redirect('stories_list')
+
+        if story.get('status') == 'suspended':
+            return await _arender(request, 'play/suspended.html', {
+                'story': story
+            })
+
+        # Only real endings of this story are recorded.
+        if not page or page.get('story_id') != story_id or not page.get('is_ending'):
+            return redirect('play_story', story_id=story_id)
+
+        play_key = request.POST.get('play_key', '')
+        steps = _parse_steps(request.POST.get('steps'))
+        if PLAY_KEY.fullmatch(play_key) and steps:
+            from_page_id, choice_id, page_id, _, created_at = steps[-1]
+            if page_id == page['id']:
+                steps[-1] = (from_page_id, choice_id, page_id, True, created_at)
+            await _arecord_steps(play_key, story_id, steps)
+
+        return await _finish_play(request, story, page)
+
+
+@method_decorator(async_login_required, name='dispatch')
+class PlayStepsView(View):
+    """Receives the steps of a browser play the reader left before an ending."""
+
+    async def post(self, request, story_id):
+        play_key = request.POST.get('play_key', '')
+        steps = _parse_steps(request.POST.get('steps'))
+        if PLAY_KEY.fullmatch(play_key) and steps:
+            await _arecord_steps(play_key, story_id, steps)
+        return HttpResponse(status=204)
+
 
 class StatsView(View):
 
     def get(self, request):
 
-        stories = FlaskAPIService.get_all_stories()
+        stories = FlaskAPIService.iter_stories(fields=['title'])
+
+        start_date, end_date = _date_range(request)
+        if start_date or end_date:
+            totals, endings_by_story = _ranged_totals(start_date, end_date)
+        else:
+            totals = dict(StoryPlayStats.objects.filter(total_plays__gt=0).values_list('story_id', 'total_plays'))
+            endings_by_story = {}
+            for ending in EndingStats.objects.filter(count__gt=0).values('story_id', 'ending_label', 'count'):
+                endings_by_story.setdefault(ending.pop('story_id'), []).append(ending)
         
         stats_data = []
         for story in stories:
-            plays = Play.objects.filter(story_id=story['id'])
-            total_plays = plays.count()
+            total_plays = totals.get(story['id'], 0)
             
             if total_plays > 0:
 
-                endings = plays.values('ending_label').annotate(count=Count('id'))
+                endings = endings_by_story.get(story['id'], [])
 
                 for ending in endings:
                     ending['percentage'] = round((ending['count'] / total_plays) * 100, 1)
@@ -147,115 +492,128 @@ class StatsView(View):
                 stats_data.append({
                     'story': story,
                     'total_plays': total_plays,
-                    'endings': list(endings)
+                    'endings': endings
                 })
         
-        total_plays_overall = Play.objects.count()
+        if start_date or end_date:
+            total_plays_overall = sum(totals.values())
+        else:
+            total_plays_overall = StoryPlayStats.objects.aggregate(total=Sum('total_plays'))['total'] or 0
         
         return render(request, 'stats/index.html', {
             'stats_data': stats_data,
-            'total_plays': total_plays_overall
+            'total_plays': total_plays_overall,
+            'start_date': start_date,
+            'end_date': end_date
         })
 
-@method_decorator(login_required, name='dispatch')
-class EditStoryView(View):
+@method_decorator(staff_member_required, name='dispatch')
+class UpstreamStatsView(View):
 
-    def get(self, request, story_id):
-        if not request.user.is_authenticated:
-            return redirect('login')
+    def get(self, request):
+        # Publish this worker's numbers first so the page includes them.
+        upstream_stats.publish(settings.UPSTREAM_STATS_PUBLISH_INTERVAL)
+        totals, workers = upstream_stats.aggregate()
+
+        views = []
+        for view, row in totals.items():
+            requests = row['requests']
+            views.append(dict(
+                row,
+                view=view,
+                calls_per_request=round(row['calls'] / requests, 2),
+                avg_upstream_ms=round(row['upstream_ms'] / requests, 1),
+                avg_total_ms=round(row['total_ms'] / requests, 1),
+                max_call_ms=round(row['max_call_ms'], 1),
+                upstream_share=round((row['upstream_ms'] / row['total_ms']) * 100, 1) if row['total_ms'] else 0
+            ))
+        views.sort(key=lambda row: row['upstream_ms'], reverse=True)
+
+        return render(request, 'stats/upstream.html', {
+            'views': views,
+            'workers': workers,
+            'slow_ms': settings.UPSTREAM_SLOW_REQUEST_MS
+        })
 
-        user_profile = request.user.userprofile
-        if user_profile.role not in ['author', 'admin'] and not request.user.is_staff:
-            return HttpResponseForbidden("Only authors can edit stories")
-        
-        story = FlaskAPIService.get_story(story_id)
+class EditStoryView(AuthorRequiredMixin, View):
+
+    async def get(self, request, story_id):
+        story, pages, analysis = await asyncio.gather(
+            AsyncFlaskAPIService.get_story(story_id),
+            AsyncFlaskAPIService.get_story_pages(story_id),
+            AsyncFlaskAPIService.get_story_analysis(story_id)
+        )
         if not story:
             return redirect('stories_list')
 
-        if story.get('author_id') != request.user.username and not request.user.is_staff:
-            return HttpResponseForbidden("You can only edit your own stories")
+        if analysis:
+            for ending in analysis['endings']:
+                ending['percentage'] = round(ending['probability'] * 100, 1)
         
-        pages = FlaskAPIService.get_story_pages(story_id)
-        
-        return render(request, 'author/edit_story.html', {
+        return await _arender(request, 'author/edit_story.html', {
             'story': story,
-            'pages': pages
+            'pages': pages,
+            'analysis': analysis
         })
 
-    def post(self, request, story_id):
-        if not request.user.is_authenticated:
-            return redirect('login')
-
-        user_profile = request.user.userprofile
-        if user_profile.role not in ['author', 'admin'] and not request.user.is_staff:
-            return HttpResponseForbidden("Only authors can edit stories")
+    async def post(self, request, story_id):
+        title = request.POST.get('title')
+        description = request.POST.get('description')
+        status = request.POST.get('status', 'draft')
 
-        story = FlaskAPIService.get_story(story_id)
+        # The validation report is only needed when publishing; fetch it
+        # alongside the story rather than after it.
+        if status == 'published':
+            story, report, pages = await asyncio.gather(
+                AsyncFlaskAPIService.get_story(story_id),
+                AsyncFlaskAPIService.validate_story(story_id),
+                AsyncFlaskAPIService.get_story_pages(story_id)
+            )
+        else:
+            story, report, pages = await AsyncFlaskAPIService.get_story(story_id), None, None
         if not story:
             return redirect('stories_list')
 
-        if story.get('author_id') != request.user.username and not request.user.is_staff:
-            return HttpResponseForbidden("You can only edit your own stories")
-        
-        title = request.POST.get('title')
-        description = request.POST.get('description')
-        status = request.POST.get('status', 'draft')
-        
-        story = FlaskAPIService.update_story(story_id, title, description, status)
+        if story.get('status') != 'published' and report and not report['valid']:
+            return await _arender(request, 'author/edit_story.html', {
+                'story': story,
+                'pages': pages,
+                'error': 'This story cannot be published yet',
+                'problems': _validation_problems(report, pages)
+            })
+
+        story = await AsyncFlaskAPIService.update_story(story_id, title, description, status)
         if story:
             return redirect('edit_story', story_id=story_id)
         else:
-            return render(request, 'author/edit_story.html', {
-                'story': FlaskAPIService.get_story(story_id),
-                'pages': FlaskAPIService.get_story_pages(story_id),
+            story, pages = await asyncio.gather(
+                AsyncFlaskAPIService.get_story(story_id),
+                AsyncFlaskAPIService.get_story_pages(story_id)
+            )
+            return await _arender(request, 'author/edit_story.html', {
+                'story': story,
+                'pages': pages,
                 'error': 'Failed to update story'
             })
 
-@method_decorator(login_required, name='dispatch')
-class DeleteStoryView(View):
+class DeleteStoryView(AuthorRequiredMixin, View):
+    role_denied_message = 'Only authors can delete stories'
+    owner_denied_message = 'You can only delete your own stories'
 
     def post(self, request, story_id):
-        if not request.user.is_authenticated:
-            return redirect('login')
-
-        user_profile = request.user.userprofile
-        if user_profile.role not in ['author', 'admin'] and not request.user.is_staff:
-            return HttpResponseForbidden("Only authors can delete stories")
-
-        story = FlaskAPIService.get_story(story_id)
-        if not story:
-            return redirect('stories_list')
-
-        if story.get('author_id') != request.user.username and not request.user.is_staff:
-            return HttpResponseForbidden("You can only delete your own stories")
-
         if FlaskAPIService.delete_story(story_id):
-            Play.objects.filter(story_id=story_id).delete()
+            delete_story_plays([story_id])
             return redirect('stories_list')
         else:
             return redirect('edit_story', story_id=story_id)
 
-@method_decorator(login_required, name='dispatch')
-class CreateStoryView(View):
+class CreateStoryView(AuthorRequiredMixin, View):
+    role_denied_message = 'Only authors can create stories'
 
     def get(self, request):
-        if not request.user.is_authenticated:
-            return redirect('login')
-        
-        user_profile = request.user.userprofile
-        if user_profile.role not in ['author', 'admin'] and not request.user.is_staff:
-            return HttpResponseForbidden("Only authors can create stories")
-        
         return render(request, 'author/create_story.html')
     
     def post(self, request):
-        if not request.user.is_authenticated:
-            return redirect('login')
-        
-        user_profile = request.user.userprofile
-        if user_profile.role not in ['author', 'admin'] and not request.user.is_staff:
-            return HttpResponseForbidden("Only authors can create stories")
-        
         title = request.POST.get('title')
         description = request.POST.get('description')
         
@@ -266,69 +624,20 @@ class CreateStoryView(View):
 
         story = FlaskAPIService.create_story(title, description, author_id=request.user.username)
         if story:
-
-            if not story.get('author_id'):
-                story['author_id'] = request.user.username
             return redirect('edit_story', story_id=story['id'])
         else:
             return render(request, 'author/create_story.html', {
                 'error': 'Failed to create story'
             })
 
-@method_decorator(login_required, name='dispatch')
-class DeleteStoryView(View):
-
-    def post(self, request, story_id):
-        if FlaskAPIService.delete_story(story_id):
-            return redirect('stories_list')
-        else:
-            return redirect('edit_story', story_id=story_id)
-
-@method_decorator(login_required, name='dispatch')
-class AddPageView(View):
+class AddPageView(AuthorRequiredMixin, View):
 
     def get(self, request, story_id):
-        if not request.user.is_authenticated:
-            return redirect('login')
-        
         story = FlaskAPIService.get_story(story_id)
         if not story:
             return redirect('stories_list')
-
-        if story.get('author_id') != request.user.username and not request.user.is_staff:
-            return HttpResponseForbidden("You can only edit your own stories")
         
         return render(request, 'author/add_page.html', {'story': story})
-    
-    def post(self, request, story_id):
-        if not request.user.is_authenticated:
-            return redirect('login')
-        
-        story = FlaskAPIService.get_story(story_id)
-        if not story:
-            return redirect('stories_list')
-
-        if story.get('author_id') != request.user.username and not request.user.is_staff:
-            return HttpResponseForbidden("You can only edit your own stories")
-        
-        text = request.POST.get('text')
-        is_ending = request.POST.get('is_ending') == 'on'
-        ending_label = request.POST.get('ending_label') if is_ending else None
-        
-        if not text:
-            return render(request, 'author/add_page.html', {
-                'story': story,
-                'error': 'Page text is required'
-            })
-        
-        page = FlaskAPIService.create_page(story_id, text, is_ending, ending_label)
-        if page:
-            return redirect('edit_story', story_id=story_id)
-        else:
-            return render(request, 'author/add_page.html', {
-                'story': story,
-                'error': 'Failed to create page'
-            })
 
     def post(self, request, story_id):
         text = request.POST.get('text')
@@ -350,99 +659,72 @@ class AddPageView(View):
                 'error': 'Failed to create page'
             })
 
-@method_decorator(login_required, name='dispatch')
-class AddChoiceView(View):
+class AddChoiceView(AuthorRequiredMixin, View):
 
-    def get(self, request, story_id, page_id):
-        if not request.user.is_authenticated:
-            return redirect('login')
-        
-        story = FlaskAPIService.get_story(story_id)
-        page = FlaskAPIService.get_page(page_id)
+    async def get(self, request, story_id, page_id):
+        story, page, story_pages = await asyncio.gather(
+            AsyncFlaskAPIService.get_story(story_id),
+            AsyncFlaskAPIService.get_page(page_id),
+            AsyncFlaskAPIService.get_story_pages(story_id)
+        )
         
-        if not story or not page:
+        if not story or not page or page.get('story_id') != story_id:
             return redirect('stories_list')
-
-        if story.get('author_id') != request.user.username and not request.user.is_staff:
-            return HttpResponseForbidden("You can only edit your own stories")
         
-        return render(request, 'author/add_choice.html', {
+        return await _arender(request, 'author/add_choice.html', {
             'story': story,
             'page': page,
-            'story_pages': FlaskAPIService.get_story_pages(story_id)
+            'story_pages': story_pages
         })
     
-    def post(self, request, story_id, page_id):
-        if not request.user.is_authenticated:
-            return redirect('login')
-        
-        story = FlaskAPIService.get_story(story_id)
-        page = FlaskAPIService.get_page(page_id)
-        
-        if not story or not page:
+    async def post(self, request, story_id, page_id):
+        # The story itself is only needed to render the form again.
+        page = await AsyncFlaskAPIService.get_page(page_id)
+        if not page or page.get('story_id') != story_id:
             return redirect('stories_list')
-
-        if story.get('author_id') != request.user.username and not request.user.is_staff:
-            return HttpResponseForbidden("You can only edit your own stories")
         
         text = request.POST.get('text')
         next_page_id = request.POST.get('next_page_id')
         
         if not text or not next_page_id:
-            story_pages = FlaskAPIService.get_story_pages(story_id)
-            return render(request, 'author/add_choice.html', {
+            story, story_pages = await asyncio.gather(
+                AsyncFlaskAPIService.get_story(story_id),
+                AsyncFlaskAPIService.get_story_pages(story_id)
+            )
+            return await _arender(request, 'author/add_choice.html', {
                 'story': story,
                 'page': page,
                 'story_pages': story_pages,
                 'error': 'Text and next page are required'
             })
         
-        choice = FlaskAPIService.create_choice(page_id, text, int(next_page_id))
+        choice = await AsyncFlaskAPIService.create_choice(page_id, text, int(next_page_id), story_id=story_id)
         if choice:
             return redirect('edit_story', story_id=story_id)
         else:
-            story_pages = FlaskAPIService.get_story_pages(story_id)
-            return render(request, 'author/add_choice.html', {
+            story, story_pages = await asyncio.gather(
+                AsyncFlaskAPIService.get_story(story_id),
+                AsyncFlaskAPIService.get_story_pages(story_id)
+            )
+            return await _arender(request, 'author/add_choice.html', {
                 'story': story,
                 'page': page,
                 'story_pages': story_pages,
                 'error': 'Failed to create choice'
             })
 
-@method_decorator(login_required, name='dispatch')
-class DeletePageView(View):
+class DeletePageView(AuthorRequiredMixin, View):
 
     def post(self, request, story_id, page_id):
-        if not request.user.is_authenticated:
-            return redirect('login')
-        
-        story = FlaskAPIService.get_story(story_id)
-        if not story:
-            return redirect('stories_list')
-
-        if story.get('author_id') != request.user.username and not request.user.is_staff:
-            return HttpResponseForbidden("You can only edit your own stories")
-        
-        if FlaskAPIService.delete_page(page_id):
-            return redirect('edit_story', story_id=story_id)
-        else:
-            return redirect('edit_story', story_id=story_id)
+        _page_of_story(story_id, page_id)
+        FlaskAPIService.delete_page(page_id, story_id=story_id)
+        return redirect('edit_story', story_id=story_id)
 
-@method_decorator(login_required, name='dispatch')
-class DeleteChoiceView(View):
+class DeleteChoiceView(AuthorRequiredMixin, View):
 
     def post(self, request, story_id, page_id, choice_id):
-        if not request.user.is_authenticated:
-            return redirect('login')
-        
-        story = FlaskAPIService.get_story(story_id)
-        if not story:
-            return redirect('stories_list')
-
-        if story.get('author_id') != request.user.username and not request.user.is_staff:
-            return HttpResponseForbidden("You can only edit your own stories")
-        
-        if FlaskAPIService.delete_choice(choice_id):
-            return redirect('edit_story', story_id=story_id)
-        else:
-            return redirect('edit_story', story_id=story_id)
\ No newline at end of file
+        page = _page_of_story(story_id, page_id)
+        if choice_id not in {choice['id'] for choice in page.get('choices') or []}:
+            raise Http404('Choice not found')
+        FlaskAPIService.delete_choice(choice_id, story_id=story_id)
+        return redirect('edit_story', story_id=story_id)
@@ -1,20 +1,33 @@
 from flask import Flask
 from config import Config
+from cli import import_drawio_command
+from compression import init_compression
+from metrics import init_metrics
 from models import db
 from models.flaskModel import Story, Page, Choice
+from models.schema import upgrade_schema
 from routes.flaskRoutes import story_bp
+from services.storyGraphCache import story_graph_cache
 
-def create_app():
+def create_app(config=Config):
     app = Flask(__name__)
-    app.config.from_object(Config)
+    app.config.from_object(config)
     db.init_app(app)
+    story_graph_cache.configure(
+        max_bytes=app.config['STORY_GRAPH_CACHE_BYTES'],
+        ttl=app.config['STORY_GRAPH_CACHE_TTL']
+    )
     
     app.register_blueprint(story_bp)
+    init_metrics(app)
+    init_compression(app)
+    app.cli.add_command(import_drawio_command)
+
+    with app.app_context():
+        upgrade_schema()
     return app
 
 app = create_app()
 
 if __name__ == '__main__':
-    with app.app_context():
-        db.create_all()
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,76 @@
+"""Compares response encodings on a large get_story_pages payload.
+
+Run from the FlaskAPI directory:
+
+    python benchmarks/serialization.py [--pages 1000] [--repeat 50]
+
+Times encoding on the API side and decoding on the client side for Flask's
+jsonify, the stdlib json module, orjson and MessagePack (the last two only
+when installed), and prints the body size of each.
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+
+os.environ['DATABASE_URL'] = 'sqlite://'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import jsonify
+
+from app import create_app
+from serializers import dumps_json, dumps_msgpack
+from serializers.responseFormats import msgpack, orjson
+from services.flaskServices import StoryService
+
+
+def build_pages(pages):
+    keys = [str(i) for i in range(pages)]
+    story, _ = StoryService.import_story(
+        'Benchmark', 'A story for the serialization benchmark',
+        [{
+            'key': key,
+            'text': f'Page {key}. ' + 'The corridor splits in two and both ways smell of smoke. ' * 4,
+            'is_ending': i == pages - 1,
+            'ending_label': 'The end' if i == pages - 1 else None
+        } for i, key in enumerate(keys)],
+        [{'page': keys[i], 'next_page': keys[j], 'text': f'Take the way to page {j}'}
+         for i in range(pages - 1) for j in {i + 1, min(i + 7, pages - 1), pages - 1}],
+        status='published'
+    )
+    return StoryService.get_story_pages(story.id)
+
+
+def run(pages, repeat):
+    app = create_app()
+    with app.app_context(), app.test_request_context():
+        payload = build_pages(pages)
+        choices = sum(len(page['choices']) for page in payload)
+
+        encoders = [
+            ('flask jsonify', lambda: jsonify(payload).get_data(), json.loads),
+            ('stdlib json', lambda: json.dumps(payload, separators=(',', ':')).encode('utf-8'), json.loads),
+        ]
+        if orjson is not None:
+            encoders.append(('orjson', lambda: dumps_json(payload), orjson.loads))
+        if msgpack is not None:
+            encoders.append(('msgpack', lambda: dumps_msgpack(payload),
+                             lambda body: msgpack.unpackb(body, raw=False, strict_map_key=False)))
+
+        print(f'{pages} pages, {choices} choices, {repeat} runs each')
+        print(f"{'format':<14}{'encode ms':>11}{'decode ms':>11}{'bytes':>10}")
+        for name, encode, decode in encoders:
+            body = encode()
+            assert decode(body) == payload
+            encode_ms = min(timeit.repeat(encode, number=1, repeat=repeat)) * 1000
+            decode_ms = min(timeit.repeat(lambda: decode(body), number=1, repeat=repeat)) * 1000
+            print(f'{name:<14}{encode_ms:>11.2f}{decode_ms:>11.2f}{len(body):>10}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pages', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+    run(args.pages, args.repeat)
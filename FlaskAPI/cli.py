@@ -0,0 +1,28 @@
+from pathlib import Path
+
+import click
+from flask.cli import with_appcontext
+
+from services.flaskServices import StoryService
+
+
+@click.command('import-drawio')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--title', help='Story title (defaults to the file name).')
+@click.option('--description', help='Story description.')
+@click.option('--author', 'author_id', help='Username of the story author.')
+@with_appcontext
+def import_drawio_command(path, title, description, author_id):
+    """Import a draw.io diagram as a new draft story."""
+    with open(path, 'rb') as source:
+        story, key_to_id, warnings = StoryService.import_drawio(
+            source,
+            title=title or Path(path).stem,
+            description=description,
+            author_id=author_id
+        )
+
+    for warning in warnings:
+        click.echo(f'warning: {warning}', err=True)
+    click.echo(f'Imported story {story.id} "{story.title}" with {len(key_to_id)} pages '
+               f'(start page {story.start_page_id}).')
@@ -0,0 +1,120 @@
+import gzip
+import threading
+from collections import OrderedDict
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {'application/json', 'application/x-msgpack', 'text/html', 'text/plain', 'text/csv'}
+
+
+class CompressedBodyCache:
+    """LRU of compressed response bodies bounded by total size in bytes.
+
+    Entries are keyed by URL, ETag and encoding. The ETag changes with the
+    story revision, so entries never go stale; they simply stop being asked
+    for and age out.
+    """
+
+    def __init__(self, max_bytes=16 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._bodies = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            body = self._bodies.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self._bodies.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def put(self, key, body):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._bodies.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous)
+            self._bodies[key] = body
+            self._bytes += len(body)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._bodies.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._bodies.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._bodies),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+compressed_bodies = CompressedBodyCache()
+
+
+def _encodings():
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def _compress(body, encoding, config):
+    if encoding == 'br':
+        return brotli.compress(body, quality=config['COMPRESSION_BROTLI_QUALITY'])
+    return gzip.compress(body, compresslevel=config['COMPRESSION_GZIP_LEVEL'], mtime=0)
+
+
+def init_compression(app):
+    """Compresses large responses with the best encoding the client accepts.
+
+    Streamed responses (the NDJSON export compresses itself), bodies below
+    COMPRESSION_MIN_SIZE and responses that already carry a
+    Content-Encoding are sent as they are. Bodies of responses with an ETag
+    are compressed once and served from ``compressed_bodies`` afterwards.
+    """
+    compressed_bodies.max_bytes = app.config['COMPRESSION_CACHE_BYTES']
+
+    @app.after_request
+    def compress_response(response):
+        if (response.status_code != 200 or response.is_streamed or response.direct_passthrough
+                or 'Content-Encoding' in response.headers
+                or response.mimetype not in COMPRESSIBLE_MIMETYPES
+                or 'no-transform' in response.headers.get('Cache-Control', '')):
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = request.accept_encodings.best_match(_encodings())
+        if not encoding or response.content_length is None or response.content_length < app.config['COMPRESSION_MIN_SIZE']:
+            return response
+
+        etag, weak = response.get_etag()
+        key = (request.full_path, etag, encoding) if etag else None
+        body = compressed_bodies.get(key) if key else None
+        if body is None:
+            body = _compress(response.get_data(), encoding, app.config)
+            if key:
+                compressed_bodies.put(key, body)
+
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        if etag and not weak:
+            # The bytes differ from the identity body, so the tag can only
+            # promise equivalent content from here on.
+            response.set_etag(etag, weak=True)
+        return response
@@ -6,4 +6,10 @@ load_dotenv()
 class Config:
     SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL', 'sqlite:///mydatabase.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-    API_KEY = os.getenv('API_KEY', 'nahb-secret-key-2026')
\ No newline at end of file
+    API_KEY = os.getenv('API_KEY', 'nahb-secret-key-2026')
+    STORY_GRAPH_CACHE_BYTES = int(os.getenv('STORY_GRAPH_CACHE_BYTES', 32 * 1024 * 1024))
+    STORY_GRAPH_CACHE_TTL = int(os.getenv('STORY_GRAPH_CACHE_TTL', 30))
+    COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', 1024))
+    COMPRESSION_GZIP_LEVEL = int(os.getenv('COMPRESSION_GZIP_LEVEL', 6))
+    COMPRESSION_BROTLI_QUALITY = int(os.getenv('COMPRESSION_BROTLI_QUALITY', 5))
+    COMPRESSION_CACHE_BYTES = int(os.getenv('COMPRESSION_CACHE_BYTES', 16 * 1024 * 1024))
@@ -1,7 +1,82 @@
-from flask import request, jsonify
-from services.flaskServices import StoryService
+import binascii
+import hashlib
+import zlib
+from datetime import datetime
+from xml.etree.ElementTree import ParseError
+
+from flask import request, current_app, stream_with_context
+from metrics import record_error
+from serializers import dumps_json, encode_choice, encode_page, encode_story, format_tag, render
+from services.flaskServices import StoryService, STORY_LIST_FIELDS
+from services.storyAnalysis import StoryTooComplex
+from services.storyValidator import StoryValidationError
 from models.flaskModel import Story, Page, Choice
 
+MAX_STORY_PAGE_SIZE = 200
+MAX_BULK_DELETE = 500
+
+
+def _story_etag(story_id, version):
+    # created_at keeps a new story that reused a deleted story's id from
+    # matching tags handed out for the old one.
+    created = version.created_at.strftime('%Y%m%d%H%M%S%f') if version.created_at else '0'
+    return f'{story_id}.{version.revision}.{created}{format_tag()}'
+
+
+def _with_validators(response, etag, last_modified=None):
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def _ndjson(record):
+    return dumps_json(record) + b'\n'
+
+
+def _export_lines(stories, pages, choices):
+    pages_by_story = {}
+    for page in pages:
+        pages_by_story.setdefault(page.story_id, []).append(page)
+    choices_by_story = {}
+    for choice in choices:
+        choices_by_story.setdefault(choice.story_id, []).append(choice)
+
+    # A story's pages and choices always follow its own line, so a client that
+    # resumes from the last "cursor" record never sees a partial story.
+    lines = []
+    for story in stories:
+        lines.append(_ndjson(dict(story._asdict(), type='story')))
+        for page in pages_by_story.get(story.id, []):
+            lines.append(_ndjson(dict(page._asdict(), type='page')))
+        for choice in choices_by_story.get(story.id, []):
+            record = choice._asdict()
+            del record['story_id']
+            lines.append(_ndjson(dict(record, type='choice')))
+    lines.append(_ndjson({'type': 'cursor', 'cursor': stories[-1].id}))
+    return b''.join(lines)
+
+
+def _server_error(error):
+    record_error(error)
+    return render({'error': str(error)}), 500
+
+
+def _not_modified(etag, last_modified=None):
+    if request.if_none_match:
+        # Weak comparison: compressed responses carry the weakened tag.
+        matched = request.if_none_match.contains_weak(etag)
+    elif last_modified is not None and request.if_modified_since is not None:
+        # The header only has whole seconds; a story edited later within that
+        # second must not match, so the stored time is compared unrounded.
+        matched = last_modified <= request.if_modified_since.replace(tzinfo=None)
+    else:
+        matched = False
+    if not matched:
+        return None
+    return _with_validators(current_app.response_class(status=304), etag, last_modified)
+
 
 class StoryController:
 
@@ -10,86 +85,97 @@ class StoryController:
 
         try:
             status = request.args.get('status')
-            
-            if status:
-                stories = StoryService.get_stories_by_status(status)
+            author_id = request.args.get('author')
+            after = request.args.get('after', type=int)
+            limit = request.args.get('limit', type=int)
+            if limit is not None:
+                limit = max(1, min(limit, MAX_STORY_PAGE_SIZE))
+
+            fields = STORY_LIST_FIELDS
+            if request.args.get('fields'):
+                requested = [f.strip() for f in request.args['fields'].split(',') if f.strip()]
+                unknown = [f for f in requested if f not in STORY_LIST_FIELDS]
+                if unknown:
+                    return render({'error': f"Unknown fields: {', '.join(unknown)}"}), 400
+                fields = tuple(['id'] + [f for f in requested if f != 'id'])
+
+            version = StoryService.get_catalog_version(status, author_id)
+            key = (status, author_id, after, limit, fields, format_tag()) + tuple(version)
+            etag = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+            not_modified = _not_modified(etag)
+            if not_modified:
+                return not_modified
+
+            stories, next_cursor = StoryService.list_stories(status, author_id, after, limit, fields)
+
+            # Without a limit the endpoint keeps returning a bare list.
+            if limit is None:
+                response = render(stories)
             else:
-                stories = StoryService.get_all_stories()
-            
-            return jsonify([{
-                'id': s.id,
-                'title': s.title,
-                'description': s.description,
-                'status': s.status,
-                'start_page_id': s.start_page_id,
-                'author_id': s.author_id
-            } for s in stories]), 200
+                response = render({'stories': stories, 'next_cursor': next_cursor})
+            return _with_validators(response, etag), 200
         except Exception as e:
-            return jsonify({'error': str(e)}), 500
+            return _server_error(e)
 
     @staticmethod
     def get_story(story_id):
 
         try:
-            story = StoryService.get_story_by_id(story_id)
-            if not story:
-                return jsonify({'error': 'Story not found'}), 404
-            return jsonify({
-                'id': story.id,
-                'title': story.title,
-                'description': story.description,
-                'status': story.status,
-                'start_page_id': story.start_page_id,
-                'author_id': story.author_id
-            }), 200
+            version = StoryService.get_story_version(story_id)
+            if not version:
+                return render({'error': 'Story not found'}), 404
+            etag = _story_etag(story_id, version)
+            not_modified = _not_modified(etag, version.updated_at)
+            if not_modified:
+                return not_modified
+
+            graph = StoryService.get_story_graph(story_id, version)
+            if not graph:
+                return render({'error': 'Story not found'}), 404
+            response = render(graph.story_payload)
+            return _with_validators(response, etag, version.updated_at), 200
         except Exception as e:
-            return jsonify({'error': str(e)}), 500
+            return _server_error(e)
 
 
     @staticmethod
     def get_story_start(story_id):
 
         try:
-            page = StoryService.get_story_start_page(story_id)
+            version = StoryService.get_story_version(story_id)
+            if not version:
+                return render({'error': 'Story or start page not found'}), 404
+            etag = _story_etag(story_id, version)
+            not_modified = _not_modified(etag, version.updated_at)
+            if not_modified:
+                return not_modified
+
+            page = StoryService.get_story_start_page(story_id, version)
             if not page:
-                return jsonify({'error': 'Story or start page not found'}), 404
-            return jsonify({
-                'id': page.id,
-                'story_id': page.story_id,
-                'text': page.text,
-                'is_ending': page.is_ending,
-                'ending_label': page.ending_label,
-                'choices': [{
-                    'id': c.id,
-                    'text': c.text,
-                    'next_page_id': c.next_page_id
-                } for c in page.choices]
-            }), 200
+                return render({'error': 'Story or start page not found'}), 404
+            return _with_validators(render(page), etag, version.updated_at), 200
         except Exception as e:
-            return jsonify({'error': str(e)}), 500
+            return _server_error(e)
 
 
     @staticmethod
     def get_page(page_id):
 
         try:
-            page = StoryService.get_page_by_id(page_id)
+            version = StoryService.get_page_version(page_id)
+            if not version:
+                return render({'error': 'Page not found'}), 404
+            etag = _story_etag(version.story_id, version)
+            not_modified = _not_modified(etag, version.updated_at)
+            if not_modified:
+                return not_modified
+
+            page = StoryService.get_page_by_id(page_id, version.story_id, version)
             if not page:
-                return jsonify({'error': 'Page not found'}), 404
-            return jsonify({
-                'id': page.id,
-                'story_id': page.story_id,
-                'text': page.text,
-                'is_ending': page.is_ending,
-                'ending_label': page.ending_label,
-                'choices': [{
-                    'id': c.id,
-                    'text': c.text,
-                    'next_page_id': c.next_page_id
-                } for c in page.choices]
-            }), 200
+                return render({'error': 'Page not found'}), 404
+            return _with_validators(render(page), etag, version.updated_at), 200
         except Exception as e:
-            return jsonify({'error': str(e)}), 500
+            return _server_error(e)
 
 
     @staticmethod
@@ -98,20 +184,68 @@ class StoryController:
         try:
             data = request.get_json()
             if not data or not data.get('title') or not data.get('description'):
-                return jsonify({'error': 'title and description required'}), 400
+                return render({'error': 'title and description required'}), 400
 
             author_id = data.get('author_id')
             story = StoryService.create_story(data['title'], data['description'], author_id)
-            return jsonify({
-                'id': story.id,
-                'title': story.title,
-                'description': story.description,
-                'status': story.status,
-                'author_id': story.author_id,
-                'message': 'Story created'
-            }), 201
+            return render(encode_story(story, message='Story created')), 201
+        except Exception as e:
+            return _server_error(e)
+
+
+    @staticmethod
+    def import_story():
+
+        try:
+            data = request.get_json()
+            if not data or not data.get('title') or not data.get('description'):
+                return render({'error': 'title and description required'}), 400
+            if not isinstance(data.get('pages', []), list) or not isinstance(data.get('choices', []), list):
+                return render({'error': 'pages and choices must be lists'}), 400
+
+            try:
+                story, key_to_id = StoryService.import_story(
+                    data['title'],
+                    data['description'],
+                    data.get('pages', []),
+                    data.get('choices', []),
+                    author_id=data.get('author_id'),
+                    status=data.get('status', 'draft'),
+                    start_page=data.get('start_page')
+                )
+            except ValueError as e:
+                return render({'error': str(e)}), 400
+            except StoryValidationError as e:
+                return render({'error': str(e), 'problems': e.report}), 422
+
+            return render(encode_story(story, page_ids=key_to_id, message='Story imported')), 201
         except Exception as e:
-            return jsonify({'error': str(e)}), 500
+            return _server_error(e)
+
+
+    @staticmethod
+    def import_drawio_story():
+
+        try:
+            # Either a multipart upload in "file" or the raw diagram as the body;
+            # the body is parsed straight off the request stream.
+            upload = request.files.get('file')
+            params = request.form if upload else request.args
+            source = upload.stream if upload else request.stream
+
+            try:
+                story, key_to_id, warnings = StoryService.import_drawio(
+                    source,
+                    title=params.get('title'),
+                    description=params.get('description'),
+                    author_id=params.get('author_id')
+                )
+            except (ParseError, ValueError, zlib.error, binascii.Error) as e:
+                return render({'error': f'Invalid draw.io diagram: {e}'}), 400
+
+            return render(encode_story(story, page_ids=key_to_id, warnings=warnings, message='Story imported')), 201
+        except Exception as e:
+            return _server_error(e)
 
 
     @staticmethod
@@ -120,7 +254,7 @@ class StoryController:
         try:
             story = StoryService.get_story_by_id(story_id)
             if not story:
-                return jsonify({'error': 'Story not found'}), 404
+                return render({'error': 'Story not found'}), 404
             
             data = request.get_json()
             updated_story = StoryService.update_story(
@@ -129,29 +263,45 @@ class StoryController:
                 description=data.get('description'),
                 status=data.get('status')
             )
-            return jsonify({
-                'id': updated_story.id,
-                'title': updated_story.title,
-                'description': updated_story.description,
-                'status': updated_story.status,
-                'message': 'Story updated'
-            }), 200
+            return render(encode_story(updated_story, message='Story updated')), 200
+        except StoryValidationError as e:
+            return render({'error': str(e), 'problems': e.report}), 422
         except Exception as e:
-            return jsonify({'error': str(e)}), 500
+            return _server_error(e)
 
 
     @staticmethod
     def delete_story(story_id):
 
         try:
-            story = StoryService.get_story_by_id(story_id)
-            if not story:
-                return jsonify({'error': 'Story not found'}), 404
-            
-            StoryService.delete_story(story_id)
-            return jsonify({'message': 'Story deleted'}), 200
+            if not StoryService.delete_story(story_id):
+                return render({'error': 'Story not found'}), 404
+            return render({'message': 'Story deleted'}), 200
+        except Exception as e:
+            return _server_error(e)
+
+
+    @staticmethod
+    def delete_stories():
+
+        try:
+            try:
+                ids = {int(i) for i in request.args.get('ids', '').split(',') if i.strip()}
+            except ValueError:
+                return render({'error': 'ids must be a comma-separated list of story ids'}), 400
+            if not ids:
+                return render({'error': 'ids required'}), 400
+            if len(ids) > MAX_BULK_DELETE:
+                return render({'error': f'at most {MAX_BULK_DELETE} stories per request'}), 400
+
+            deleted = StoryService.delete_stories(ids)
+            return render({
+                'deleted': deleted,
+                'missing': sorted(ids - set(deleted)),
+                'message': f'{len(deleted)} stories deleted'
+            }), 200
         except Exception as e:
-            return jsonify({'error': str(e)}), 500
+            return _server_error(e)
 
 
     @staticmethod
@@ -160,11 +310,11 @@ class StoryController:
         try:
             story = StoryService.get_story_by_id(story_id)
             if not story:
-                return jsonify({'error': 'Story not found'}), 404
+                return render({'error': 'Story not found'}), 404
 
             data = request.get_json()
             if not data or not data.get('text'):
-                return jsonify({'error': 'text required'}), 400
+                return render({'error': 'text required'}), 400
 
             page = StoryService.create_page(
                 story_id,
@@ -172,73 +322,179 @@ class StoryController:
                 is_ending=data.get('is_ending', False),
                 ending_label=data.get('ending_label')
             )
-            return jsonify({
-                'id': page.id,
-                'story_id': page.story_id,
-                'text': page.text,
-                'is_ending': page.is_ending,
-                'ending_label': page.ending_label,
-                'message': 'Page created'
-            }), 201
+            return render(encode_page(page, message='Page created')), 201
         except Exception as e:
-            return jsonify({'error': str(e)}), 500
+            return _server_error(e)
 
 
     @staticmethod
     def create_choice(page_id):
 
         try:
-            page = StoryService.get_page_by_id(page_id)
-            if not page:
-                return jsonify({'error': 'Page not found'}), 404
-            
             data = request.get_json()
             if not data or not data.get('text') or not data.get('next_page_id'):
-                return jsonify({'error': 'text and next_page_id required'}), 400
-            
-            choice = StoryService.create_choice(
-                page_id,
-                text=data['text'],
-                next_page_id=data['next_page_id']
-            )
-            return jsonify({
-                'id': choice.id,
-                'page_id': choice.page_id,
-                'text': choice.text,
-                'next_page_id': choice.next_page_id,
-                'message': 'Choice created'
-            }), 201
+                return render({'error': 'text and next_page_id required'}), 400
+
+            # The write loads only the page row, never the compiled story.
+            try:
+                choice = StoryService.create_choice(
+                    page_id,
+                    text=data['text'],
+                    next_page_id=data['next_page_id']
+                )
+            except ValueError as e:
+                return render({'error': str(e)}), 400
+            if not choice:
+                return render({'error': 'Page not found'}), 404
+            return render(encode_choice(choice, message='Choice created')), 201
         except Exception as e:
-            return jsonify({'error': str(e)}), 500
+            return _server_error(e)
 
 
     @staticmethod
     def get_story_pages(story_id):
 
         try:
-            pages = StoryService.get_story_pages(story_id)
-            return jsonify(pages), 200
+            version = StoryService.get_story_version(story_id)
+            if not version:
+                return render([]), 200
+            etag = _story_etag(story_id, version)
+            not_modified = _not_modified(etag, version.updated_at)
+            if not_modified:
+                return not_modified
+
+            pages = StoryService.get_story_pages(story_id, version)
+            return _with_validators(render(pages), etag, version.updated_at), 200
         except Exception as e:
-            return jsonify({'error': str(e)}), 500
+            return _server_error(e)
         
+    @staticmethod
+    def get_story_bundle(story_id):
+
+        try:
+            version = StoryService.get_story_version(story_id)
+            if not version:
+                return render({'error': 'Story not found'}), 404
+            etag = _story_etag(story_id, version)
+            not_modified = _not_modified(etag, version.updated_at)
+            if not_modified:
+                return not_modified
+
+            bundle = StoryService.get_story_bundle(story_id, version)
+            if not bundle:
+                return render({'error': 'Story not found'}), 404
+            return _with_validators(render(bundle), etag, version.updated_at), 200
+        except Exception as e:
+            return _server_error(e)
+
+    @staticmethod
+    def get_story_analysis(story_id):
+
+        try:
+            version = StoryService.get_story_version(story_id)
+            if not version:
+                return render({'error': 'Story not found'}), 404
+
+            # POST carries play-derived weights per choice id; GET assumes
+            # every choice is equally likely and is cached per revision.
+            choice_weights = None
+            if request.method == 'POST':
+                data = request.get_json(silent=True) or {}
+                try:
+                    choice_weights = {int(k): float(v) for k, v in (data.get('choice_weights') or {}).items()}
+                except (TypeError, ValueError):
+                    return render({'error': 'choice_weights must map choice ids to numbers'}), 400
+            else:
+                etag = _story_etag(story_id, version)
+                not_modified = _not_modified(etag, version.updated_at)
+                if not_modified:
+                    return not_modified
+
+            try:
+                analysis = StoryService.get_story_analysis(story_id, version, choice_weights)
+            except StoryTooComplex as e:
+                return render({'error': str(e)}), 422
+            if analysis is None:
+                return render({'error': 'Story not found'}), 404
+            response = render(analysis)
+            if request.method == 'GET':
+                _with_validators(response, _story_etag(story_id, version), version.updated_at)
+            return response, 200
+        except Exception as e:
+            return _server_error(e)
+
+    @staticmethod
+    def get_story_validation(story_id):
+
+        try:
+            version = StoryService.get_story_version(story_id)
+            if not version:
+                return render({'error': 'Story not found'}), 404
+
+            etag = _story_etag(story_id, version)
+            not_modified = _not_modified(etag, version.updated_at)
+            if not_modified:
+                return not_modified
+
+            report = StoryService.validate_story(story_id, version)
+            if report is None:
+                return render({'error': 'Story not found'}), 404
+            return _with_validators(render(report), etag, version.updated_at), 200
+        except Exception as e:
+            return _server_error(e)
+
+    @staticmethod
+    def export_catalog():
+
+        try:
+            since = request.args.get('since')
+            if since:
+                try:
+                    since = datetime.fromisoformat(since)
+                except ValueError:
+                    return render({'error': 'since must be an ISO 8601 date or datetime'}), 400
+            status = request.args.get('status')
+            after = request.args.get('cursor', type=int)
+            use_gzip = 'gzip' in request.accept_encodings and request.args.get('gzip') != '0'
+
+            def generate():
+                compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if use_gzip else None
+                last_cursor = after
+                for stories, pages, choices in StoryService.iter_export(since, status, after):
+                    chunk = _export_lines(stories, pages, choices)
+                    last_cursor = stories[-1].id
+                    # Sync-flush each batch so the client can process (and
+                    # checkpoint) it while the next one is being read.
+                    yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH) if compressor else chunk
+                tail = _ndjson({'type': 'end', 'cursor': last_cursor})
+                yield compressor.compress(tail) + compressor.flush() if compressor else tail
+
+            response = current_app.response_class(stream_with_context(generate()), mimetype='application/x-ndjson')
+            response.headers['Vary'] = 'Accept-Encoding'
+            if use_gzip:
+                response.headers['Content-Encoding'] = 'gzip'
+            return response
+        except Exception as e:
+            return _server_error(e)
+
     @staticmethod
     def delete_page(page_id):
 
         try:
             if StoryService.delete_page(page_id):
-                return jsonify({'message': 'Page deleted'}), 200
+                return render({'message': 'Page deleted'}), 200
             else:
-                return jsonify({'error': 'Page not found'}), 404
+                return render({'error': 'Page not found'}), 404
         except Exception as e:
-            return jsonify({'error': str(e)}), 500
+            return _server_error(e)
 
     @staticmethod
     def delete_choice(choice_id):
 
         try:
             if StoryService.delete_choice(choice_id):
-                return jsonify({'message': 'Choice deleted'}), 200
+                return render({'message': 'Choice deleted'}), 200
             else:
-                return jsonify({'error': 'Choice not found'}), 404
+                return render({'error': 'Choice not found'}), 404
         except Exception as e:
-            return jsonify({'error': str(e)}), 500
\ No newline at end of file
+            return _server_error(e)
\ No newline at end of file
@@ -0,0 +1,210 @@
+import logging
+import re
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+from flask import current_app, g, has_app_context, request
+from sqlalchemy import event
+
+from compression import compressed_bodies
+from models import db
+from services.storyGraphCache import story_graph_cache
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+# W3C trace context: version-traceid-parentid-flags.
+TRACEPARENT = re.compile(r'^[0-9a-f]{2}-([0-9a-f]{32})-[0-9a-f]{16}-[0-9a-f]{2}$')
+REQUEST_ID = re.compile(r'^[\w.:-]{1,128}$')
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the shape Prometheus expects."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.total += 1
+        self.sum += value
+
+
+class RequestMetrics:
+    """In-process request, SQL and error counters, labelled by route.
+
+    Routes are labelled with their URL rule (``/api/pages/<int:page_id>``),
+    never the concrete path, so the number of series stays fixed. Every
+    worker process keeps its own numbers.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._empty()
+
+    def _empty(self):
+        self.requests = defaultdict(int)
+        self.latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self.statements = defaultdict(lambda: Histogram(STATEMENT_BUCKETS))
+        self.sql_seconds = defaultdict(float)
+        self.sizes = defaultdict(lambda: Histogram(SIZE_BUCKETS))
+        self.errors = defaultdict(int)
+
+    def reset(self):
+        with self._lock:
+            self._empty()
+
+    def observe_request(self, route, method, status, seconds, statements, sql_seconds, size):
+        key = (route, method)
+        with self._lock:
+            self.requests[(route, method, str(status))] += 1
+            self.latency[key].observe(seconds)
+            self.statements[key].observe(statements)
+            self.sql_seconds[key] += sql_seconds
+            if size is not None:
+                self.sizes[key].observe(size)
+
+    def observe_error(self, route, method, error):
+        with self._lock:
+            self.errors[(route, method, type(error).__name__)] += 1
+
+    def render(self):
+        lines = []
+        with self._lock:
+            _counter(lines, 'nahb_http_requests_total', 'Requests handled.',
+                     ('route', 'method', 'status'), self.requests)
+            _histogram(lines, 'nahb_http_request_duration_seconds', 'Time spent producing a response.',
+                       self.latency)
+            _histogram(lines, 'nahb_http_request_sql_statements', 'SQL statements issued per request.',
+                       self.statements)
+            _counter(lines, 'nahb_http_request_sql_seconds_total', 'Time spent in SQL statements.',
+                     ('route', 'method'), self.sql_seconds)
+            _histogram(lines, 'nahb_http_response_size_bytes', 'Response body size as sent.',
+                       self.sizes)
+            _counter(lines, 'nahb_http_request_errors_total', 'Exceptions caught by the controllers.',
+                     ('route', 'method', 'exception'), self.errors)
+        for prefix, stats in (('nahb_story_graph_cache', story_graph_cache.stats()),
+                              ('nahb_compressed_body_cache', compressed_bodies.stats())):
+            for name, value in stats.items():
+                kind = 'counter' if name in ('hits', 'misses', 'evictions') else 'gauge'
+                metric = f'{prefix}_{name}_total' if kind == 'counter' else f'{prefix}_{name}'
+                lines.append(f'# TYPE {metric} {kind}')
+                lines.append(f'{metric} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(names, values):
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in values)
+    return ','.join(f'{name}="{value}"' for name, value in zip(names, escaped))
+
+
+def _counter(lines, name, help_text, label_names, series):
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} counter')
+    for labels, value in sorted(series.items()):
+        lines.append(f'{name}{{{_labels(label_names, labels)}}} {value:g}')
+
+
+def _histogram(lines, name, help_text, series):
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} histogram')
+    for (route, method), histogram in sorted(series.items()):
+        labels = _labels(('route', 'method'), (route, method))
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            lines.append(f'{name}_bucket{{{labels},le="{bound:g}"}} {count}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.total}')
+        lines.append(f'{name}_sum{{{labels}}} {histogram.sum:g}')
+        lines.append(f'{name}_count{{{labels}}} {histogram.total}')
+
+
+request_metrics = RequestMetrics()
+
+
+def _route():
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+def record_error(error):
+    """Counts and logs an exception a controller turned into a 500 response."""
+    request_metrics.observe_error(_route(), request.method, error)
+    logger.exception('%s %s failed [request %s]', request.method, request.path, g.get('request_id'))
+
+
+def _request_id():
+    incoming = request.headers.get(REQUEST_ID_HEADER, '')
+    if REQUEST_ID.match(incoming):
+        return incoming
+    match = TRACEPARENT.match(request.headers.get('traceparent', ''))
+    if match:
+        return match.group(1)
+    return uuid.uuid4().hex
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info['query_started'] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # Statements run outside a request (CLI, schema upgrade) are not counted.
+    if has_app_context() and 'sql_statements' in g:
+        g.sql_statements += 1
+        g.sql_seconds += time.perf_counter() - conn.info['query_started']
+
+
+def init_metrics(app):
+    """Times every request and serves the numbers at /api/_metrics.
+
+    Latency runs from the start of the request until the response leaves the
+    after_request hooks, so it includes compression but not the time taken
+    to stream a body. Each response echoes the request ID, taken from an
+    incoming X-Request-ID or traceparent header or made up here.
+
+    Register this before ``init_compression``: after_request hooks run in
+    reverse, so sizes are then measured on the compressed body.
+    """
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(db.engine, 'after_cursor_execute', _after_cursor_execute)
+
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+        g.request_id = _request_id()
+        g.sql_statements = 0
+        g.sql_seconds = 0.0
+
+    @app.after_request
+    def observe_response(response):
+        response.headers[REQUEST_ID_HEADER] = g.get('request_id') or _request_id()
+        if 'traceparent' in request.headers:
+            response.headers['traceparent'] = request.headers['traceparent']
+        if request.endpoint == 'metrics':
+            return response
+        request_metrics.observe_request(
+            _route(),
+            request.method,
+            response.status_code,
+            time.perf_counter() - g.request_started,
+            g.sql_statements,
+            g.sql_seconds,
+            None if response.is_streamed else response.content_length
+        )
+        return response
+
+    @app.route('/api/_metrics', endpoint='metrics')
+    def metrics():
+        return current_app.response_class(
+            request_metrics.render(),
+            content_type='text/plain; version=0.0.4; charset=utf-8'
+        )
@@ -1,3 +1,5 @@
+from datetime import datetime
+
 from models import db
 
 class Story(db.Model):
@@ -8,6 +10,15 @@ class Story(db.Model):
     status = db.Column(db.String(20), default='draft', nullable=False)
     start_page_id = db.Column(db.Integer, db.ForeignKey('page.id'), nullable=True)
     author_id = db.Column(db.String(255), nullable=True)
+    revision = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=True)
+    # Tells a story apart from a deleted one whose id SQLite handed out again.
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_story_status_id', 'status', 'id'),
+        db.Index('ix_story_author_id_id', 'author_id', 'id'),
+    )
     
     def __str__(self):
         return self.title
@@ -0,0 +1,29 @@
+from sqlalchemy import inspect, text
+
+from models import db
+
+
+# Columns added to existing tables after their first release. db.create_all()
+# only creates missing tables, so these are applied with ALTER TABLE.
+ADDED_COLUMNS = [
+    ('story', 'revision', 'INTEGER NOT NULL DEFAULT 0'),
+    ('story', 'updated_at', 'DATETIME'),
+    ('story', 'created_at', 'DATETIME'),
+]
+
+
+def upgrade_schema():
+    db.create_all()
+
+    inspector = inspect(db.engine)
+    with db.engine.begin() as conn:
+        for table, column, ddl in ADDED_COLUMNS:
+            existing = {c['name'] for c in inspector.get_columns(table)}
+            if column not in existing:
+                conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}'))
+                if column in ('updated_at', 'created_at'):
+                    conn.execute(text(f'UPDATE {table} SET {column} = CURRENT_TIMESTAMP'))
+
+        for table in db.metadata.tables.values():
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
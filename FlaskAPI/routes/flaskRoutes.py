@@ -8,12 +8,19 @@ story_bp.route('/stories/<int:story_id>', methods=['GET'])(StoryController.get_s
 story_bp.route('/stories/<int:story_id>/start', methods=['GET'])(StoryController.get_story_start)
 story_bp.route('/pages/<int:page_id>', methods=['GET'])(StoryController.get_page)
 story_bp.route('/stories/<int:story_id>/pages', methods=['GET'])(StoryController.get_story_pages)
+story_bp.route('/stories/<int:story_id>/bundle', methods=['GET'])(StoryController.get_story_bundle)
+story_bp.route('/stories/<int:story_id>/analysis', methods=['GET', 'POST'])(StoryController.get_story_analysis)
+story_bp.route('/stories/<int:story_id>/validation', methods=['GET'])(StoryController.get_story_validation)
 story_bp.route('/stories', methods=['GET'])(StoryController.get_all_stories)
+story_bp.route('/export', methods=['GET'])(StoryController.export_catalog)
 
 
 story_bp.route('/stories', methods=['POST'])(StoryController.create_story)
+story_bp.route('/stories/import', methods=['POST'])(StoryController.import_story)
+story_bp.route('/stories/import/drawio', methods=['POST'])(StoryController.import_drawio_story)
 story_bp.route('/stories/<int:story_id>', methods=['PUT'])(StoryController.update_story)
 story_bp.route('/stories/<int:story_id>', methods=['DELETE'])(StoryController.delete_story)
+story_bp.route('/stories', methods=['DELETE'])(StoryController.delete_stories)
 story_bp.route('/stories/<int:story_id>/pages', methods=['POST'])(StoryController.create_page)
 story_bp.route('/pages/<int:page_id>/choices', methods=['POST'])(StoryController.create_choice)
 story_bp.route('/pages/<int:page_id>', methods=['DELETE'])(StoryController.delete_page)
@@ -0,0 +1,9 @@
+from serializers.modelEncoders import compile_encoder, encode_choice, encode_page, encode_story
+from serializers.responseFormats import (
+    JSON_MIMETYPE, MSGPACK_MIMETYPE, dumps_json, dumps_msgpack, format_tag, negotiate, render
+)
+
+__all__ = [
+    'compile_encoder', 'encode_story', 'encode_page', 'encode_choice',
+    'JSON_MIMETYPE', 'MSGPACK_MIMETYPE', 'dumps_json', 'dumps_msgpack', 'format_tag', 'negotiate', 'render'
+]
@@ -0,0 +1,28 @@
+from operator import attrgetter
+
+STORY_FIELDS = ('id', 'title', 'description', 'status', 'start_page_id', 'author_id')
+PAGE_FIELDS = ('id', 'story_id', 'text', 'is_ending', 'ending_label')
+CHOICE_FIELDS = ('id', 'page_id', 'text', 'next_page_id')
+
+
+def compile_encoder(fields):
+    """Builds a function that turns a model instance or result row into a dict.
+
+    The attribute getter is built once, so encoding an object is a single
+    C-level call plus a dict construction, with no per-field Python loop.
+    Keyword arguments are added to the dict, e.g. ``message='Story created'``.
+    """
+    fields = tuple(fields)
+    getter = attrgetter(*fields)
+    if len(fields) == 1:
+        def encode(obj, **extra):
+            return {fields[0]: getter(obj), **extra}
+    else:
+        def encode(obj, **extra):
+            return {**dict(zip(fields, getter(obj))), **extra}
+    return encode
+
+
+encode_story = compile_encoder(STORY_FIELDS)
+encode_page = compile_encoder(PAGE_FIELDS)
+encode_choice = compile_encoder(CHOICE_FIELDS)
@@ -0,0 +1,59 @@
+import json
+
+from flask import current_app, request
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_MIMETYPE = 'application/json'
+MSGPACK_MIMETYPE = 'application/x-msgpack'
+
+
+def _default(value):
+    # Dates are the only non-JSON values in the payloads.
+    return value.isoformat()
+
+
+if orjson is not None:
+    def dumps_json(payload):
+        return orjson.dumps(payload, default=_default, option=orjson.OPT_NON_STR_KEYS)
+else:
+    def dumps_json(payload):
+        return json.dumps(payload, default=_default, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def dumps_msgpack(payload):
+    return msgpack.packb(payload, default=_default, use_bin_type=True)
+
+
+def available_mimetypes():
+    return (JSON_MIMETYPE, MSGPACK_MIMETYPE) if msgpack is not None else (JSON_MIMETYPE,)
+
+
+def negotiate():
+    """Picks the response format from the Accept header; JSON unless MessagePack is preferred."""
+    mimetype = request.accept_mimetypes.best_match(available_mimetypes(), default=JSON_MIMETYPE)
+    # best_match picks the first offer on a tie, so */* and a missing
+    # header keep getting JSON.
+    return mimetype or JSON_MIMETYPE
+
+
+def format_tag():
+    # Appended to ETags: each format is a different representation and
+    # must not satisfy a conditional request made for the other.
+    return '.msgpack' if negotiate() == MSGPACK_MIMETYPE else ''
+
+
+def render(payload):
+    mimetype = negotiate()
+    body = dumps_msgpack(payload) if mimetype == MSGPACK_MIMETYPE else dumps_json(payload)
+    response = current_app.response_class(body, mimetype=mimetype)
+    response.vary.add('Accept')
+    return response
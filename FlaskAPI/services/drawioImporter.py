@@ -0,0 +1,308 @@
+import base64
+import html
+import re
+import zlib
+import xml.etree.ElementTree as ET
+from urllib.parse import unquote_to_bytes
+
+
+CHUNK_SIZE = 64 * 1024
+PAGE_TEXT_MAX = 4096
+LABEL_MAX = 255
+SNAP_TOLERANCE = 10
+SNAP_GRID = 200
+SNAP_MAX_GRID_CELLS = 64
+CELL_TAGS = ('mxCell', 'object', 'UserObject')
+
+_BLOCK_TAGS = re.compile(r'<\s*(br|/div|/p|/li)\b[^>]*>', re.IGNORECASE)
+_TAGS = re.compile(r'<[^>]+>')
+_SPACES = re.compile(r'[ \t\r\f\v]+')
+
+
+def _clean_text(value):
+    text = _BLOCK_TAGS.sub('\n', value or '')
+    text = html.unescape(_TAGS.sub('', text)).replace('\xa0', ' ')
+    lines = [_SPACES.sub(' ', line).strip() for line in text.split('\n')]
+    return '\n'.join(line for line in lines if line)
+
+
+def _vertex_kind(style):
+    # Diagram conventions: ellipses are choices, triangles are ending markers,
+    # free text and images are annotations, any other shape is a page.
+    shape = (style or '').split(';', 1)[0]
+    if shape == 'ellipse':
+        return 'choice'
+    if shape == 'triangle':
+        return 'ending'
+    if shape in ('text', 'shape=image') or 'edgeLabel' in (style or ''):
+        return 'annotation'
+    return 'page'
+
+
+def _decode_base64(payload):
+    # Decodes one slice of the diagram text at a time, carrying an
+    # incomplete 4-character group over to the next slice, so the decoded
+    # bytes never exist in one piece.
+    carry = ''
+    for offset in range(0, len(payload), CHUNK_SIZE):
+        chunk = carry + ''.join(payload[offset:offset + CHUNK_SIZE].split())
+        usable = len(chunk) - len(chunk) % 4
+        carry = chunk[usable:]
+        if usable:
+            yield base64.b64decode(chunk[:usable], validate=True)
+    if carry:
+        yield base64.b64decode(carry, validate=True)
+
+
+class DrawioParser:
+    """Stream-parses the first diagram of a .drawio file.
+
+    Cells are handled as soon as their closing tag is read and then dropped
+    from the tree, so memory grows with the number of cells kept (ids, labels
+    and endpoints), not with the size of the file. Compressed diagrams
+    (base64 + raw deflate + URL encoding) are inflated incrementally.
+    """
+
+    def __init__(self):
+        self.vertices = {}
+        self.order = []
+        self.edges = []
+        self.edge_labels = {}
+        self.bounds = {}
+        self.layers = set()
+        self.diagram_name = None
+        self._objects = []
+        self._diagrams_seen = 0
+        self._done = False
+
+    def parse(self, source):
+        stack = []
+        for event, elem in ET.iterparse(source, events=('start', 'end')):
+            if event == 'start':
+                stack.append(elem)
+                if elem.tag == 'diagram':
+                    self._diagrams_seen += 1
+                    if self._diagrams_seen == 1:
+                        self.diagram_name = elem.get('name')
+                self._start(elem)
+                continue
+
+            stack.pop()
+            if elem.tag == 'diagram' and self._diagrams_seen == 1 and not self._done:
+                if len(elem) == 0 and (elem.text or '').strip():
+                    self._parse_compressed(elem.text)
+                    elem.text = None
+                self._done = True
+            else:
+                self._end(elem)
+            if stack and elem.tag in CELL_TAGS:
+                stack[-1].remove(elem)
+        return self
+
+    def _parse_compressed(self, payload):
+        parser = ET.XMLPullParser(events=('start', 'end'))
+        inflater = zlib.decompressobj(-zlib.MAX_WBITS)
+        pending = b''
+        stack = []
+
+        def drain():
+            for event, elem in parser.read_events():
+                if event == 'start':
+                    stack.append(elem)
+                    self._start(elem)
+                else:
+                    stack.pop()
+                    self._end(elem)
+                    if stack and elem.tag in CELL_TAGS:
+                        stack[-1].remove(elem)
+
+        for chunk in _decode_base64(payload):
+            pending += inflater.decompress(chunk)
+            # Hold back a percent-escape split across chunk boundaries.
+            cut = pending.rfind(b'%', max(0, len(pending) - 2))
+            if cut == -1:
+                cut = len(pending)
+            parser.feed(unquote_to_bytes(pending[:cut]))
+            pending = pending[cut:]
+            drain()
+        pending += inflater.flush()
+        parser.feed(unquote_to_bytes(pending))
+        parser.close()
+        drain()
+
+    def _start(self, elem):
+        if elem.tag in ('object', 'UserObject'):
+            self._objects.append(elem.attrib)
+
+    def _end(self, elem):
+        if self._done:
+            return
+        if elem.tag in ('object', 'UserObject'):
+            self._objects.pop()
+            return
+        if elem.tag != 'mxCell':
+            return
+
+        attrs = elem.attrib
+        cell_id = attrs.get('id')
+        value = attrs.get('value')
+        if self._objects and cell_id is None:
+            cell_id = self._objects[-1].get('id')
+            value = self._objects[-1].get('label', value)
+
+        parent = attrs.get('parent')
+        geometry = elem.find('mxGeometry')
+        if attrs.get('edge') == '1':
+            source, target = attrs.get('source'), attrs.get('target')
+            # Arrows drawn up to a shape without being glued to it only carry
+            # a loose end point; keep it so the end can be snapped later.
+            if geometry is not None and parent in self.layers and not (source and target):
+                for point in geometry.iter('mxPoint'):
+                    end = point.get('as')
+                    if end in ('sourcePoint', 'targetPoint'):
+                        xy = (float(point.get('x', 0)), float(point.get('y', 0)))
+                        if end == 'sourcePoint' and not source:
+                            source = xy
+                        elif end == 'targetPoint' and not target:
+                            target = xy
+            self.edges.append((cell_id, source, target, _clean_text(value)))
+        elif attrs.get('vertex') == '1':
+            style = attrs.get('style', '')
+            self.vertices[cell_id] = (_vertex_kind(style), _clean_text(value), parent)
+            self.order.append(cell_id)
+            if geometry is not None and parent in self.layers:
+                x, y = float(geometry.get('x', 0)), float(geometry.get('y', 0))
+                self.bounds[cell_id] = (x, y, x + float(geometry.get('width', 0)), y + float(geometry.get('height', 0)))
+        elif parent is None or parent in self.layers or parent == '0':
+            self.layers.add(cell_id)
+        elem.clear()
+
+
+def build_story_graph(parser, title=None, description=None):
+    """Turns parsed cells into the payload accepted by StoryService.import_story."""
+    warnings = []
+    edge_ids = {edge[0] for edge in parser.edges}
+
+    # Labels drawn as child cells of an edge.
+    for cell_id in parser.order:
+        kind, text, parent = parser.vertices[cell_id]
+        if parent in edge_ids and text:
+            parser.edge_labels[parent] = text
+
+    kinds = {cell_id: parser.vertices[cell_id][0] for cell_id in parser.order
+             if parser.vertices[cell_id][2] not in edge_ids}
+    texts = {cell_id: parser.vertices[cell_id][1] for cell_id in kinds}
+
+    # Shapes are bucketed on a grid so a loose arrow end is only tested
+    # against the shapes around it; very large shapes are always tested.
+    grid = {}
+    large = []
+    for cell_id, (x1, y1, x2, y2) in parser.bounds.items():
+        if kinds.get(cell_id) in (None, 'annotation'):
+            continue
+        columns = range(int((x1 - SNAP_TOLERANCE) // SNAP_GRID), int((x2 + SNAP_TOLERANCE) // SNAP_GRID) + 1)
+        rows = range(int((y1 - SNAP_TOLERANCE) // SNAP_GRID), int((y2 + SNAP_TOLERANCE) // SNAP_GRID) + 1)
+        if len(columns) * len(rows) > SNAP_MAX_GRID_CELLS:
+            large.append(cell_id)
+            continue
+        for column in columns:
+            for row in rows:
+                grid.setdefault((column, row), []).append(cell_id)
+
+    def snap(point):
+        x, y = point
+        best = None
+        for cell_id in grid.get((int(x // SNAP_GRID), int(y // SNAP_GRID)), []) + large:
+            x1, y1, x2, y2 = parser.bounds[cell_id]
+            if x1 - SNAP_TOLERANCE <= x <= x2 + SNAP_TOLERANCE and y1 - SNAP_TOLERANCE <= y <= y2 + SNAP_TOLERANCE:
+                area = (x2 - x1) * (y2 - y1)
+                if best is None or area < best[0]:
+                    best = (area, cell_id)
+        return best[1] if best else None
+
+    outgoing = {}
+    has_incoming = set()
+    for edge_id, source, target, label in parser.edges:
+        if isinstance(source, tuple):
+            source = snap(source)
+        if isinstance(target, tuple):
+            target = snap(target)
+        if source not in kinds or target not in kinds:
+            warnings.append(f'edge {edge_id} is not connected at both ends')
+            continue
+        outgoing.setdefault(source, []).append((target, label or parser.edge_labels.get(edge_id)))
+        has_incoming.add(target)
+
+    pages = {}
+    page_order = []
+
+    def add_page(key, text, is_ending=False, ending_label=None):
+        if key not in pages:
+            pages[key] = {
+                'key': key,
+                'text': (text or '...')[:PAGE_TEXT_MAX],
+                'is_ending': is_ending,
+                'ending_label': ending_label[:LABEL_MAX] if ending_label else None
+            }
+            page_order.append(key)
+        return key
+
+    for cell_id, kind in kinds.items():
+        if kind == 'page':
+            add_page(cell_id, texts[cell_id])
+
+    def resolve(node, seen):
+        # Follows choice nodes until pages (or ending markers) are reached.
+        targets = []
+        for target, _label in outgoing.get(node, []):
+            kind = kinds[target]
+            if kind == 'page':
+                targets.append(target)
+            elif kind == 'ending':
+                targets.append(add_page(f'ending:{target}', texts[target], True, texts[target]))
+            elif kind == 'choice' and target not in seen:
+                seen.add(target)
+                targets.extend(resolve(target, seen))
+        return targets
+
+    choices = []
+    for key in list(page_order):
+        for target, label in outgoing.get(key, []):
+            kind = kinds[target]
+            if kind == 'page':
+                choices.append({'page': key, 'next_page': target, 'text': (label or 'Continue')[:LABEL_MAX]})
+            elif kind == 'ending':
+                pages[key]['is_ending'] = True
+                pages[key]['ending_label'] = texts[target][:LABEL_MAX] or None
+            elif kind == 'choice':
+                next_pages = resolve(target, {target})
+                if not next_pages:
+                    warnings.append(f"choice '{texts[target]}' does not lead to a page")
+                for next_page in next_pages:
+                    choices.append({
+                        'page': key,
+                        'next_page': next_page,
+                        'text': (label or texts[target] or 'Continue')[:LABEL_MAX]
+                    })
+
+    has_choice = {choice['page'] for choice in choices}
+    for key in page_order:
+        if key not in has_choice and not pages[key]['is_ending']:
+            pages[key]['is_ending'] = True
+
+    reached = {choice['next_page'] for choice in choices}
+    roots = [key for key in page_order if key not in reached and key not in has_incoming]
+    start_page = roots[0] if roots else (page_order[0] if page_order else None)
+
+    return {
+        'title': title or parser.diagram_name or 'Imported story',
+        'description': description or 'Imported from draw.io',
+        'pages': [pages[key] for key in page_order],
+        'choices': choices,
+        'start_page': start_page
+    }, warnings
+
+
+def parse_drawio(source, title=None, description=None):
+    parser = DrawioParser().parse(source)
+    return build_story_graph(parser, title, description)
@@ -1,33 +1,120 @@
+from datetime import datetime
+
+from sqlalchemy import delete, func, insert, or_, select, update
+
 from models import db
 from models.flaskModel import Story, Page, Choice
+from services.storyGraphCache import StoryGraph, story_graph_cache
+from services.drawioImporter import parse_drawio
+from services.storyAnalysis import analyze_story, cached_analysis
+from services.storyValidator import StoryValidationError, story_validation, validate_import
+
+STORY_LIST_FIELDS = ('id', 'title', 'description', 'status', 'start_page_id', 'author_id')
+STORY_STATUSES = ('draft', 'published', 'suspended')
+EXPORT_BATCH_SIZE = 200
 
 class StoryService:
 
     @staticmethod
-    def get_all_stories():
-        return Story.query.all()
+    def _touch_story(story_id):
+        # Every content change bumps the revision inside the same transaction,
+        # so a revision (with created_at, for reused ids) always identifies
+        # exactly one state of the story.
+        return db.session.execute(
+            update(Story).where(Story.id == story_id)
+            .values(revision=Story.revision + 1, updated_at=datetime.utcnow())
+            .returning(Story.revision, Story.created_at)
+            .execution_options(synchronize_session=False)
+        ).first()
+
+    @staticmethod
+    def get_story_version(story_id):
+        return db.session.query(Story.revision, Story.updated_at, Story.created_at).filter_by(id=story_id).first()
+
+    @staticmethod
+    def get_page_version(page_id):
+        return db.session.query(Page.story_id, Story.revision, Story.updated_at, Story.created_at) \
+            .join(Story, Page.story_id == Story.id) \
+            .filter(Page.id == page_id).first()
+
+    @staticmethod
+    def get_catalog_version(status=None, author_id=None):
+        query = db.session.query(
+            func.count(Story.id), func.max(Story.id), func.sum(Story.revision), func.max(Story.updated_at)
+        )
+        if status:
+            query = query.filter(Story.status == status)
+        if author_id:
+            query = query.filter(Story.author_id == author_id)
+        return query.one()
 
     @staticmethod
-    def get_stories_by_status(status):
-        return Story.query.filter_by(status=status).all()
+    def get_story_graph(story_id, version=None):
+        graph = story_graph_cache.get(story_id, version)
+        if graph is not None:
+            return graph
+
+        # Three statements whatever the story's size: the story, its pages and
+        # all of their choices. Page.choices is never loaded per page.
+        story = db.session.get(Story, story_id)
+        if not story:
+            return None
+        pages = Page.query.filter_by(story_id=story_id).order_by(Page.id).all()
+        choices = Choice.query.join(Page, Choice.page_id == Page.id).filter(Page.story_id == story_id).order_by(Choice.id).all()
+        return story_graph_cache.put(StoryGraph(story, pages, choices))
+
+    @staticmethod
+    def validate_story(story_id, version=None):
+        return story_validation.validate(
+            story_id, version, lambda: StoryService.get_story_graph(story_id, version)
+        )
+
+    @staticmethod
+    def list_stories(status=None, author_id=None, after=None, limit=None, fields=STORY_LIST_FIELDS):
+        # Keyset pagination on the primary key: the (status, id) and
+        # (author_id, id) indexes serve both the filter and the ordering.
+        query = db.session.query(*[getattr(Story, f) for f in fields])
+        if status:
+            query = query.filter(Story.status == status)
+        if author_id:
+            query = query.filter(Story.author_id == author_id)
+        if after is not None:
+            query = query.filter(Story.id > after)
+        query = query.order_by(Story.id)
+
+        if limit is None:
+            return [row._asdict() for row in query.all()], None
+
+        rows = query.limit(limit + 1).all()
+        next_cursor = rows[limit - 1].id if len(rows) > limit else None
+        return [row._asdict() for row in rows[:limit]], next_cursor
     
 
     @staticmethod
     def get_story_by_id(story_id):
-        return Story.query.get(story_id)
+        return db.session.get(Story, story_id)
     
 
     @staticmethod
-    def get_story_start_page(story_id):
-        story = Story.query.get(story_id)
-        if not story:
+    def get_story_start_page(story_id, version=None):
+        graph = StoryService.get_story_graph(story_id, version)
+        if not graph:
             return None
-        return Page.query.get(story.start_page_id)
+        return graph.start_page_payload()
 
 
     @staticmethod
-    def get_page_by_id(page_id):
-        return Page.query.get(page_id)
+    def get_page_by_id(page_id, story_id=None, version=None):
+        if story_id is None:
+            story_id = story_graph_cache.story_for_page(page_id)
+        if story_id is None:
+            story_id = db.session.query(Page.story_id).filter_by(id=page_id).scalar()
+            if story_id is None:
+                return None
+        graph = StoryService.get_story_graph(story_id, version)
+        if not graph:
+            return None
+        return graph.page_payload(page_id)
     
 
     @staticmethod
@@ -38,46 +125,184 @@ class StoryService:
         return story
     
     
+    @staticmethod
+    def import_story(title, description, pages, choices, author_id=None, status='draft', start_page=None):
+        # pages: [{'key', 'text', 'is_ending', 'ending_label'}]
+        # choices: [{'page', 'next_page', 'text'}], both ends given as page keys
+        keys = []
+        for page in pages:
+            if not isinstance(page, dict):
+                raise ValueError('every page must be an object')
+            if page.get('key') is None or not page.get('text'):
+                raise ValueError('every page needs a key and text')
+            keys.append(str(page['key']))
+        if len(set(keys)) != len(keys):
+            raise ValueError('page keys must be unique')
+
+        known = set(keys)
+        for choice in choices:
+            if not isinstance(choice, dict):
+                raise ValueError('every choice must be an object')
+            if not choice.get('text'):
+                raise ValueError('every choice needs text')
+            if str(choice.get('page')) not in known or str(choice.get('next_page')) not in known:
+                raise ValueError(f"choice '{choice.get('text')}' references an unknown page key")
+        if start_page is not None and str(start_page) not in known:
+            raise ValueError('start_page references an unknown page key')
+        if status not in STORY_STATUSES:
+            raise ValueError(f"status must be one of: {', '.join(STORY_STATUSES)}")
+        # Imports must pass the same check as publishing through update_story.
+        if status == 'published':
+            report = validate_import(keys, pages, choices, start_page)
+            if not report['valid']:
+                raise StoryValidationError(report)
+
+        try:
+            story = Story(title=title, description=description, status=status, author_id=author_id)
+            db.session.add(story)
+            db.session.flush()
+
+            page_ids = []
+            if pages:
+                db.session.execute(insert(Page), [{
+                    'story_id': story.id,
+                    'text': page['text'],
+                    'is_ending': bool(page.get('is_ending', False)),
+                    'ending_label': page.get('ending_label')
+                } for page in pages])
+                # The story is new, so its pages are exactly the rows just
+                # inserted, and ids are assigned in insertion order.
+                page_ids = db.session.scalars(
+                    db.select(Page.id).filter_by(story_id=story.id).order_by(Page.id)
+                ).all()
+            key_to_id = dict(zip(keys, page_ids))
+
+            if choices:
+                db.session.execute(insert(Choice), [{
+                    'page_id': key_to_id[str(choice['page'])],
+                    'next_page_id': key_to_id[str(choice['next_page'])],
+                    'text': choice['text']
+                } for choice in choices])
+
+            if keys:
+                story.start_page_id = key_to_id[str(start_page) if start_page is not None else keys[0]]
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        return story, key_to_id
+    
+    
+    @staticmethod
+    def import_drawio(source, title=None, description=None, author_id=None):
+        graph, warnings = parse_drawio(source, title, description)
+        story, key_to_id = StoryService.import_story(
+            graph['title'],
+            graph['description'],
+            graph['pages'],
+            graph['choices'],
+            author_id=author_id,
+            start_page=graph['start_page']
+        )
+        return story, key_to_id, warnings
+    
+    
     @staticmethod
     def update_story(story_id, title=None, description=None, status=None):
 
-        story = Story.query.get(story_id)
+        story = db.session.get(Story, story_id)
         if not story:
             return None
+        if status == 'published' and story.status != 'published':
+            report = StoryService.validate_story(story_id, story)
+            if not report['valid']:
+                raise StoryValidationError(report)
         if title:
             story.title = title
         if description:
             story.description = description
         if status:
             story.status = status
+        version = StoryService._touch_story(story_id)
         db.session.commit()
+        story_graph_cache.invalidate(story_id)
+        story_validation.apply(story_id, version)
         return story
     
     
     @staticmethod
-    def delete_story(story_id):
-        story = Story.query.get(story_id)
-        if story:
-            db.session.delete(story)
+    def _delete_choices_touching(page_ids, deleted_story_ids=()):
+        # Removes choices leaving or entering the given pages and bumps the
+        # revision of surviving stories whose choices pointed into them.
+        affected = set(db.session.scalars(
+            select(Page.story_id).distinct()
+            .join(Choice, Choice.page_id == Page.id)
+            .where(Choice.next_page_id.in_(page_ids))
+        ))
+        db.session.execute(
+            delete(Choice).where(or_(Choice.page_id.in_(page_ids), Choice.next_page_id.in_(page_ids)))
+            .execution_options(synchronize_session=False)
+        )
+        return {story_id: StoryService._touch_story(story_id)
+                for story_id in affected if story_id not in deleted_story_ids}
+
+    @staticmethod
+    def _forget_stories(story_ids):
+        for story_id in story_ids:
+            story_graph_cache.invalidate(story_id)
+            story_validation.discard(story_id)
+
+    @staticmethod
+    def delete_stories(story_ids):
+        # Set-based delete of stories with all their pages and choices in a
+        # single short transaction; returns the ids that actually existed.
+        story_ids = set(db.session.scalars(select(Story.id).where(Story.id.in_(story_ids))))
+        if not story_ids:
+            return []
+
+        try:
+            page_ids = select(Page.id).where(Page.story_id.in_(story_ids)).scalar_subquery()
+            touched = StoryService._delete_choices_touching(page_ids, story_ids)
+            db.session.execute(
+                update(Story).where(Story.id.in_(story_ids)).values(start_page_id=None)
+                .execution_options(synchronize_session=False)
+            )
+            db.session.execute(
+                delete(Page).where(Page.story_id.in_(story_ids)).execution_options(synchronize_session=False)
+            )
+            db.session.execute(
+                delete(Story).where(Story.id.in_(story_ids)).execution_options(synchronize_session=False)
+            )
             db.session.commit()
-        return story
+        except Exception:
+            db.session.rollback()
+            raise
+
+        db.session.expire_all()
+        StoryService._forget_stories(story_ids | set(touched))
+        return sorted(story_ids)
+
+    @staticmethod
+    def delete_story(story_id):
+        return bool(StoryService.delete_stories([story_id]))
     
     
     @staticmethod
     def create_page(story_id, text, is_ending=False, ending_label=None):
 
-        story = Story.query.get(story_id)
+        story = db.session.get(Story, story_id)
         if not story:
             return None
         
         page = Page(story_id=story_id, text=text, is_ending=is_ending, ending_label=ending_label)
         db.session.add(page)
-        db.session.commit()
+        db.session.flush()
 
         if story.start_page_id is None:
             story.start_page_id = page.id
-            db.session.commit()
 
+        choice = None
         previous_page = Page.query.filter_by(story_id=story_id).filter(Page.id != page.id).order_by(Page.id.desc()).first()
         if previous_page and not previous_page.is_ending:
 
@@ -86,78 +311,152 @@ class StoryService:
 
                 choice = Choice(page_id=previous_page.id, text="Continue", next_page_id=page.id)
                 db.session.add(choice)
-                db.session.commit()
+                db.session.flush()
 
+        start_page_id = story.start_page_id
+        version = StoryService._touch_story(story_id)
+        db.session.commit()
+        story_graph_cache.invalidate(story_id)
+
+        def change(state):
+            state.add_page(page.id, is_ending)
+            state.set_start(start_page_id)
+            if choice is not None:
+                state.add_choice(choice.id, choice.page_id, choice.next_page_id)
+        story_validation.apply(story_id, version, change)
         return page
 
 
     @staticmethod
     def create_choice(page_id, text, next_page_id):
-        page = Page.query.get(page_id)
-        if not page:
+        try:
+            next_page_id = int(next_page_id)
+        except (TypeError, ValueError):
+            raise ValueError('next_page_id must be a page id')
+        # Both ends in one statement; the story itself is never loaded.
+        story_ids = dict(db.session.execute(
+            select(Page.id, Page.story_id).where(Page.id.in_([page_id, next_page_id]))
+        ).all())
+        story_id = story_ids.get(page_id)
+        if story_id is None:
             return None
+        if story_ids.get(next_page_id) != story_id:
+            raise ValueError('next_page_id must be a page of the same story')
+
         choice = Choice(page_id=page_id, text=text, next_page_id=next_page_id)
         db.session.add(choice)
+        db.session.flush()
+        choice_id = choice.id
+        version = StoryService._touch_story(story_id)
         db.session.commit()
+        story_graph_cache.invalidate(story_id)
+        story_validation.apply(
+            story_id, version,
+            lambda state: state.add_choice(choice_id, page_id, next_page_id)
+        )
         return choice
 
 
     @staticmethod
-    def get_story_pages(story_id):
-
-        pages = Page.query.filter_by(story_id=story_id).all()
-        if not pages:
+    def get_story_pages(story_id, version=None):
+        graph = StoryService.get_story_graph(story_id, version)
+        if not graph:
             return []
+        return graph.pages_payload
+
 
-        page_id_to_seq = {page.id: idx for idx, page in enumerate(pages, 1)}
-
-        pages_with_seq = []
-        for idx, page in enumerate(pages, 1):
-            page_dict = {
-                'id': page.id,
-                'story_id': page.story_id,
-                'text': page.text,
-                'is_ending': page.is_ending,
-                'ending_label': page.ending_label,
-                'sequence': idx,
-                'choices': [{
-                    'id': c.id,
-                    'text': c.text,
-                    'next_page_id': c.next_page_id,
-                    'next_page_sequence': page_id_to_seq.get(c.next_page_id, '?')  # Add this
-                } for c in page.choices]
-            }
-            pages_with_seq.append(page_dict)
-
-        return pages_with_seq
-    
-    
     @staticmethod
-    def delete_page(page_id):
+    def get_story_bundle(story_id, version=None):
+        graph = StoryService.get_story_graph(story_id, version)
+        if not graph:
+            return None
+        return graph.bundle_payload()
+
+
+    @staticmethod
+    def get_story_analysis(story_id, version=None, choice_weights=None):
+        graph = StoryService.get_story_graph(story_id, version)
+        if not graph:
+            return None
+        if choice_weights:
+            return analyze_story(graph, choice_weights)
+        return cached_analysis(graph.story_id, graph, lambda: analyze_story(graph))
 
-        page = Page.query.get(page_id)
-        if not page:
-            return False
 
-        story_id = page.story_id
+    @staticmethod
+    def iter_export(since=None, status=None, after=None, batch_size=EXPORT_BATCH_SIZE):
+        # Streams (stories, pages, choices) batches of plain rows. Stories are
+        # read with a server-side cursor and never enter the identity map, so
+        # memory use depends on batch_size rather than on the catalog size.
+        query = db.select(
+            Story.id, Story.title, Story.description, Story.status, Story.start_page_id,
+            Story.author_id, Story.revision, Story.updated_at
+        ).order_by(Story.id)
+        if since is not None:
+            query = query.where(Story.updated_at >= since)
+        if status:
+            query = query.where(Story.status == status)
+        if after is not None:
+            query = query.where(Story.id > after)
 
+        result = db.session.execute(query.execution_options(yield_per=batch_size))
+        for stories in result.partitions():
+            story_ids = [story.id for story in stories]
+            pages = db.session.execute(
+                db.select(Page.id, Page.story_id, Page.text, Page.is_ending, Page.ending_label)
+                .where(Page.story_id.in_(story_ids))
+                .order_by(Page.story_id, Page.id)
+            ).all()
+            choices = db.session.execute(
+                db.select(Choice.id, Choice.page_id, Choice.text, Choice.next_page_id, Page.story_id)
+                .join(Page, Choice.page_id == Page.id)
+                .where(Page.story_id.in_(story_ids))
+                .order_by(Page.story_id, Choice.id)
+            ).all()
+            yield stories, pages, choices
 
-        story = Story.query.get(story_id)
-        if story and story.start_page_id == page_id:
 
-            next_start_page = Page.query.filter_by(story_id=story_id).filter(Page.id != page_id).order_by(Page.id).first()
-            story.start_page_id = next_start_page.id if next_start_page else None
+    @staticmethod
+    def delete_page(page_id):
 
-        db.session.delete(page)
-        db.session.commit()
+        row = db.session.execute(
+            select(Page.story_id, Story.start_page_id).join(Story, Page.story_id == Story.id).where(Page.id == page_id)
+        ).first()
+        if not row:
+            return False
+
+        story_id = row.story_id
+        try:
+            touched = StoryService._delete_choices_touching([page_id])
+            if row.start_page_id == page_id:
+                next_start_page = select(func.min(Page.id)) \
+                    .where(Page.story_id == story_id, Page.id != page_id).scalar_subquery()
+                db.session.execute(
+                    update(Story).where(Story.id == story_id).values(start_page_id=next_start_page)
+                    .execution_options(synchronize_session=False)
+                )
+            db.session.execute(delete(Page).where(Page.id == page_id).execution_options(synchronize_session=False))
+            if story_id not in touched:
+                StoryService._touch_story(story_id)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        db.session.expire_all()
+        StoryService._forget_stories({story_id} | set(touched))
         return True
     
     @staticmethod
     def delete_choice(choice_id):
 
-        choice = Choice.query.get(choice_id)
+        choice = db.session.get(Choice, choice_id)
         if choice:
+            story_id = choice.page.story_id
             db.session.delete(choice)
+            StoryService._touch_story(story_id)
             db.session.commit()
+            story_graph_cache.invalidate(story_id)
+            story_validation.discard(story_id)
             return True
         return False
\ No newline at end of file
@@ -0,0 +1,236 @@
+import threading
+from collections import OrderedDict, deque
+
+import numpy as np
+
+
+ANALYSIS_CACHE_SIZE = 256
+# Pages in one loop are solved together as a dense system: O(n^2) memory
+# and O(n^3) time in the size of the largest loop, not of the story.
+MAX_LOOP_PAGES = 1500
+
+
+class StoryTooComplex(Exception):
+    """Raised when a loop of pages is too large to analyse within a request."""
+
+_analysis_cache = OrderedDict()
+_analysis_lock = threading.Lock()
+
+
+def cached_analysis(story_id, version, compute):
+    key = (story_id, version.created_at, version.revision)
+    with _analysis_lock:
+        if key in _analysis_cache:
+            _analysis_cache.move_to_end(key)
+            return _analysis_cache[key]
+    result = compute()
+    with _analysis_lock:
+        _analysis_cache[key] = result
+        while len(_analysis_cache) > ANALYSIS_CACHE_SIZE:
+            _analysis_cache.popitem(last=False)
+    return result
+
+
+def strongly_connected_components(nodes, successors):
+    """Iterative Tarjan; components come out in reverse topological order."""
+    index = {}
+    low = {}
+    on_stack = set()
+    stack = []
+    components = []
+    counter = 0
+
+    for root in nodes:
+        if root in index:
+            continue
+        work = [(root, iter(successors(root)))]
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack.add(root)
+        while work:
+            node, edges = work[-1]
+            advanced = False
+            for nxt in edges:
+                if nxt not in index:
+                    index[nxt] = low[nxt] = counter
+                    counter += 1
+                    stack.append(nxt)
+                    on_stack.add(nxt)
+                    work.append((nxt, iter(successors(nxt))))
+                    advanced = True
+                    break
+                if nxt in on_stack:
+                    low[node] = min(low[node], index[nxt])
+            if advanced:
+                continue
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[node])
+            if low[node] == index[node]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    component.append(member)
+                    if member == node:
+                        break
+                components.append(component)
+    return components
+
+
+def _expected_visits(start, transient, transitions):
+    """Expected number of visits to each transient page, starting at ``start``.
+
+    This is the start row of N = (I - Q)^-1. Pages are visited in
+    topological order of their loops: a page outside any loop just sums
+    what flows in, and each loop is one small dense solve. Stories are
+    mostly acyclic, so this stays close to linear in the number of choices.
+    """
+    members = set(transient)
+
+    def successors(idx):
+        return [nxt for nxt, _p in transitions[idx] if nxt in members]
+
+    inflow = {start: 1.0}
+    visits = {}
+    for component in reversed(strongly_connected_components([start], successors)):
+        if len(component) == 1 and component[0] not in successors(component[0]):
+            idx = component[0]
+            visits[idx] = inflow.get(idx, 0.0)
+        else:
+            if len(component) > MAX_LOOP_PAGES:
+                raise StoryTooComplex(
+                    f'a loop of {len(component)} pages is larger than the {MAX_LOOP_PAGES} pages that can be analysed'
+                )
+            # Visits inside the loop solve (I - Q_cc)^T y = inflow.
+            position = {idx: i for i, idx in enumerate(component)}
+            system = np.eye(len(component))
+            for idx in component:
+                for nxt, p in transitions[idx]:
+                    if nxt in position:
+                        system[position[nxt], position[idx]] -= p
+            solved = np.linalg.solve(system, np.array([inflow.get(idx, 0.0) for idx in component]))
+            visits.update(zip(component, solved.tolist()))
+        for idx in component:
+            for nxt, p in transitions[idx]:
+                if nxt in members and nxt not in visits:
+                    inflow[nxt] = inflow.get(nxt, 0.0) + visits[idx] * p
+    return visits
+
+
+def analyze_story(graph, choice_weights=None):
+    """Solves the story as an absorbing Markov chain.
+
+    Each reachable non-ending page is a transient state; a reader picks one of
+    its choices uniformly at random, or in proportion to ``choice_weights``
+    ({choice_id: weight}) when given. Ending pages, dead ends (no usable
+    choices) and choices pointing outside the story are absorbing. Pages from
+    which no absorbing state can be reached are reported as "trapped".
+    """
+    result = {
+        'story_id': graph.story_id,
+        'revision': graph.revision,
+        'start_page_id': graph.start_page_id,
+        'weighting': 'weighted' if choice_weights else 'uniform',
+        'endings': [],
+        'dead_ends': [],
+        'broken_choice_probability': 0.0,
+        'trapped_probability': 0.0,
+        'expected_turns': None
+    }
+    start = graph.page_index.get(graph.start_page_id)
+    if start is None:
+        return result
+
+    # Reachable pages, in BFS order from the start page.
+    reachable = [start]
+    seen = {start}
+    queue = deque([start])
+    while queue:
+        idx = queue.popleft()
+        for _choice_id, next_page_id in graph.adjacency[idx]:
+            nxt = graph.page_index.get(next_page_id)
+            if nxt is not None and nxt not in seen:
+                seen.add(nxt)
+                reachable.append(nxt)
+                queue.append(nxt)
+
+    endings = [idx for idx in reachable if graph.is_ending[idx]]
+    dead_ends = [idx for idx in reachable if not graph.is_ending[idx] and not graph.adjacency[idx]]
+    absorbing = set(endings) | set(dead_ends)
+
+    # Transient pages that can never reach an absorbing state would make
+    # (I - Q) singular; they are collapsed into a single "trapped" sink.
+    reverse = {}
+    for idx in reachable:
+        if idx in absorbing:
+            continue
+        for _choice_id, next_page_id in graph.adjacency[idx]:
+            nxt = graph.page_index.get(next_page_id)
+            reverse.setdefault(nxt, []).append(idx)
+    # None stands for "outside the story", which also ends a play.
+    can_finish = set(absorbing)
+    queue = deque(list(absorbing) + [None])
+    while queue:
+        node = queue.popleft()
+        for prev in reverse.get(node, []):
+            if prev not in can_finish:
+                can_finish.add(prev)
+                queue.append(prev)
+
+    transient = [idx for idx in reachable if idx not in absorbing and idx in can_finish]
+    trapped = [idx for idx in reachable if idx not in absorbing and idx not in can_finish]
+
+    # Absorbing columns: endings, dead ends, then the broken and trapped sinks.
+    sinks = endings + dead_ends
+    broken_col = len(sinks)
+    trapped_col = broken_col + 1
+    column = {idx: col for col, idx in enumerate(sinks)}
+    for idx in trapped:
+        column[idx] = trapped_col
+    row = {idx: r for r, idx in enumerate(transient)}
+
+    if start not in row:
+        probabilities = np.zeros(trapped_col + 1)
+        probabilities[column[start]] = 1.0
+        expected = 0.0 if start in absorbing else None
+    else:
+        transitions = {}
+        for idx in transient:
+            edges = graph.adjacency[idx]
+            raw = [float(choice_weights.get(choice_id, 0)) if choice_weights else 1.0
+                   for choice_id, _next in edges]
+            total = sum(raw)
+            if total <= 0:
+                raw, total = [1.0] * len(edges), float(len(edges))
+            transitions[idx] = [(graph.page_index.get(next_page_id), weight / total)
+                                for (_choice_id, next_page_id), weight in zip(edges, raw)]
+        visits = _expected_visits(start, transient, transitions)
+
+        probabilities = np.zeros(trapped_col + 1)
+        for idx, count in visits.items():
+            for nxt, p in transitions[idx]:
+                if nxt not in row:
+                    probabilities[column.get(nxt, broken_col)] += count * p
+        expected = sum(visits.values())
+
+    for col, idx in enumerate(endings):
+        payload = graph.page_payloads[idx]
+        result['endings'].append({
+            'page_id': payload['id'],
+            'ending_label': payload['ending_label'],
+            'probability': round(float(probabilities[col]), 6)
+        })
+    for offset, idx in enumerate(dead_ends):
+        result['dead_ends'].append({
+            'page_id': graph.page_ids[idx],
+            'probability': round(float(probabilities[len(endings) + offset]), 6)
+        })
+    result['broken_choice_probability'] = round(float(probabilities[broken_col]), 6)
+    result['trapped_probability'] = round(float(probabilities[trapped_col]), 6)
+    # Turns are only finite when every path eventually finishes.
+    if expected is not None and result['trapped_probability'] == 0:
+        result['expected_turns'] = round(expected, 4)
+    return result
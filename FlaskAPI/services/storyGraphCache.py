@@ -0,0 +1,190 @@
+import threading
+import time
+from collections import OrderedDict
+
+from serializers import encode_page, encode_story
+
+
+# Rough per-object overheads used to keep the cache inside its memory budget.
+PAGE_OVERHEAD_BYTES = 600
+CHOICE_OVERHEAD_BYTES = 300
+
+
+class StoryGraph:
+    """Read-only compiled view of one story.
+
+    Pages are stored in dense arrays ordered by page id; ``adjacency[i]`` holds
+    the ``(choice_id, next_page_id)`` pairs leaving ``page_ids[i]``. The JSON
+    payloads served by the read endpoints are built once at compile time and
+    must not be mutated by callers.
+    """
+
+    def __init__(self, story, pages, choices):
+        self.story_id = story.id
+        self.revision = story.revision
+        self.created_at = story.created_at
+        self.start_page_id = story.start_page_id
+        self.story_payload = encode_story(story)
+
+        self.page_ids = [page.id for page in pages]
+        self.page_index = {page_id: idx for idx, page_id in enumerate(self.page_ids)}
+        self.is_ending = [bool(page.is_ending) for page in pages]
+        self.adjacency = [[] for _ in pages]
+
+        choice_payloads = [[] for _ in pages]
+        size = len(story.title) + len(story.description)
+        for c in choices:
+            idx = self.page_index.get(c.page_id)
+            if idx is None:
+                continue
+            self.adjacency[idx].append((c.id, c.next_page_id))
+            choice_payloads[idx].append({
+                'id': c.id,
+                'text': c.text,
+                'next_page_id': c.next_page_id
+            })
+            size += len(c.text) + CHOICE_OVERHEAD_BYTES
+
+        self.page_payloads = []
+        self.pages_payload = []
+        for idx, page in enumerate(pages):
+            self.page_payloads.append(encode_page(page, choices=choice_payloads[idx]))
+            self.pages_payload.append(encode_page(
+                page,
+                sequence=idx + 1,
+                choices=[{
+                    'id': c['id'],
+                    'text': c['text'],
+                    'next_page_id': c['next_page_id'],
+                    'next_page_sequence': self._sequence(c['next_page_id'])
+                } for c in choice_payloads[idx]]
+            ))
+            size += len(page.text) + len(page.ending_label or '') + PAGE_OVERHEAD_BYTES
+
+        self.size = size * 2
+        self.compiled_at = time.monotonic()
+
+    def _sequence(self, page_id):
+        idx = self.page_index.get(page_id)
+        return idx + 1 if idx is not None else '?'
+
+    def page_payload(self, page_id):
+        idx = self.page_index.get(page_id)
+        if idx is None:
+            return None
+        return self.page_payloads[idx]
+
+    def start_page_payload(self):
+        if self.start_page_id is None:
+            return None
+        return self.page_payload(self.start_page_id)
+
+    def bundle_payload(self):
+        return {
+            'story': self.story_payload,
+            'pages': self.page_payloads,
+            'version': self.revision
+        }
+
+
+class StoryGraphCache:
+    """LRU of compiled story graphs bounded by an approximate byte budget.
+
+    Writes in this process invalidate entries immediately. Readers that already
+    know the story's current version (its revision and created_at) pass it to
+    ``get`` so a graph compiled before an edit made by another worker, or for a
+    deleted story whose id was reused, is dropped; ``ttl`` bounds staleness for
+    the remaining reads.
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024, ttl=30):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._graphs = OrderedDict()
+        self._page_story = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def configure(self, max_bytes=None, ttl=None):
+        with self._lock:
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+            if ttl is not None:
+                self.ttl = ttl
+            self._evict()
+
+    def get(self, story_id, version=None):
+        with self._lock:
+            graph = self._graphs.get(story_id)
+            if graph is not None and version is not None and (
+                graph.revision != version.revision or graph.created_at != version.created_at
+            ):
+                self._remove(story_id)
+                graph = None
+            if graph is not None and self.ttl and time.monotonic() - graph.compiled_at > self.ttl:
+                self._remove(story_id)
+                graph = None
+            if graph is None:
+                self.misses += 1
+                return None
+            self._graphs.move_to_end(story_id)
+            self.hits += 1
+            return graph
+
+    def put(self, graph):
+        with self._lock:
+            self._remove(graph.story_id)
+            if graph.size > self.max_bytes:
+                return graph
+            self._graphs[graph.story_id] = graph
+            self._bytes += graph.size
+            for page_id in graph.page_ids:
+                self._page_story[page_id] = graph.story_id
+            self._evict()
+            return graph
+
+    def story_for_page(self, page_id):
+        with self._lock:
+            return self._page_story.get(page_id)
+
+    def invalidate(self, story_id):
+        with self._lock:
+            self._remove(story_id)
+
+    def clear(self):
+        with self._lock:
+            self._graphs.clear()
+            self._page_story.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._graphs),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+    def _remove(self, story_id):
+        graph = self._graphs.pop(story_id, None)
+        if graph is None:
+            return
+        self._bytes -= graph.size
+        for page_id in graph.page_ids:
+            if self._page_story.get(page_id) == story_id:
+                del self._page_story[page_id]
+
+    def _evict(self):
+        while self._graphs and self._bytes > self.max_bytes:
+            story_id = next(iter(self._graphs))
+            self._remove(story_id)
+            self.evictions += 1
+
+
+story_graph_cache = StoryGraphCache()
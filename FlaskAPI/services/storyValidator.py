@@ -0,0 +1,240 @@
+import threading
+from collections import OrderedDict, deque
+from types import SimpleNamespace
+
+from services.storyAnalysis import strongly_connected_components
+
+
+VALIDATION_STATE_SIZE = 512
+
+
+class StoryValidationError(Exception):
+
+    def __init__(self, report):
+        super().__init__('Story failed validation')
+        self.report = report
+
+
+class ValidationState:
+    """Structure of one story kept current as pages and choices are added.
+
+    Besides the reachable set, the state keeps the dead ends, the broken
+    choices and the pages that can still finish a play (reach an ending or
+    leave through a broken choice). Additions only ever grow these, so
+    they are applied in place and a report on a valid story costs no scan
+    of the pages. Deletions can shrink them and simply drop the state; the
+    next validation rebuilds it from the graph.
+    """
+
+    def __init__(self, graph):
+        self.revision = graph.revision
+        self.created_at = graph.created_at
+        self.start_page_id = graph.start_page_id
+        self.is_ending = {}
+        self.adjacency = {}
+        self.predecessors = {}
+        self.dead_ends = set()
+        self.broken = {}
+        self.finishing = set()
+        self.reachable = set()
+        self.unreachable = set()
+        self.stale = False
+        for idx, page_id in enumerate(graph.page_ids):
+            self.add_page(page_id, graph.is_ending[idx])
+        for idx, page_id in enumerate(graph.page_ids):
+            for choice_id, next_page_id in graph.adjacency[idx]:
+                self.add_choice(choice_id, page_id, next_page_id)
+        self._extend_reachable(self.start_page_id)
+
+    def _extend_reachable(self, page_id):
+        if page_id not in self.adjacency or page_id in self.reachable:
+            return
+        self.reachable.add(page_id)
+        self.unreachable.discard(page_id)
+        queue = deque([page_id])
+        while queue:
+            current = queue.popleft()
+            for _choice_id, next_page_id in self.adjacency[current]:
+                if next_page_id in self.adjacency and next_page_id not in self.reachable:
+                    self.reachable.add(next_page_id)
+                    self.unreachable.discard(next_page_id)
+                    queue.append(next_page_id)
+
+    def _mark_finishing(self, page_id):
+        # Walks back along choices; every page joins at most once.
+        if page_id in self.finishing:
+            return
+        self.finishing.add(page_id)
+        queue = deque([page_id])
+        while queue:
+            current = queue.popleft()
+            for previous in self.predecessors.get(current, ()):
+                if previous not in self.finishing:
+                    self.finishing.add(previous)
+                    queue.append(previous)
+
+    def add_page(self, page_id, is_ending):
+        if page_id in self.broken:
+            # Choices that led outside the story now lead to this page, so
+            # pages may stop being able to finish; rebuild instead.
+            self.stale = True
+        self.is_ending[page_id] = bool(is_ending)
+        self.adjacency.setdefault(page_id, [])
+        if page_id not in self.reachable:
+            self.unreachable.add(page_id)
+        if is_ending:
+            self._mark_finishing(page_id)
+        elif not self.adjacency[page_id]:
+            self.dead_ends.add(page_id)
+
+    def set_start(self, page_id):
+        if page_id != self.start_page_id:
+            self.start_page_id = page_id
+            self.unreachable |= self.reachable
+            self.reachable = set()
+            self._extend_reachable(page_id)
+
+    def add_choice(self, choice_id, page_id, next_page_id):
+        self.adjacency.setdefault(page_id, []).append((choice_id, next_page_id))
+        self.dead_ends.discard(page_id)
+        if next_page_id not in self.adjacency:
+            self.broken.setdefault(next_page_id, []).append({
+                'id': choice_id, 'page_id': page_id, 'next_page_id': next_page_id
+            })
+            self._mark_finishing(page_id)
+        else:
+            self.predecessors.setdefault(next_page_id, set()).add(page_id)
+            if next_page_id in self.finishing:
+                self._mark_finishing(page_id)
+        if page_id in self.reachable:
+            self._extend_reachable(next_page_id)
+
+    def report(self, story_id):
+        """Structural check of the story.
+
+        A story is publishable when it has a start page and, among pages a
+        reader can reach, there are no dead ends, no choices leading outside
+        the story and no cycles without an exit. Unreachable pages are
+        reported but do not block publishing.
+        """
+        broken = sorted((choice for choices in self.broken.values() for choice in choices),
+                        key=lambda choice: choice['id'])
+        trapped = self._trapped_cycles()
+
+        start_missing = self.start_page_id not in self.adjacency
+        return {
+            'story_id': story_id,
+            'revision': self.revision,
+            'valid': not start_missing
+                and not any(p in self.reachable for p in self.dead_ends)
+                and not any(c['page_id'] in self.reachable for c in broken)
+                and not trapped,
+            'start_page_missing': start_missing,
+            'unreachable_pages': sorted(self.unreachable),
+            'dead_end_pages': sorted(self.dead_ends),
+            'broken_choices': broken,
+            'trapped_cycles': trapped
+        }
+
+    def _trapped_cycles(self):
+        # A trapped cycle can never finish, so only reachable pages outside
+        # ``finishing`` need the SCC pass. An SCC there is a trap when it is
+        # a real cycle and has no edge leaving it.
+        stuck = self.reachable - self.finishing - self.dead_ends
+        if not stuck:
+            return []
+
+        def successors(page_id):
+            return [nxt for _choice_id, nxt in self.adjacency[page_id] if nxt in stuck]
+
+        trapped = []
+        for component in strongly_connected_components(sorted(stuck), successors):
+            members = set(component)
+            exits = any(nxt not in members for p in component for _c, nxt in self.adjacency[p])
+            is_cycle = len(component) > 1 or any(nxt == component[0] for _c, nxt in self.adjacency[component[0]])
+            if is_cycle and not exits:
+                trapped.append(sorted(component))
+        return trapped
+
+
+class ValidationRegistry:
+
+    def __init__(self, size=VALIDATION_STATE_SIZE):
+        self.size = size
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+
+    def apply(self, story_id, version, change=None):
+        # Only a state that saw the previous revision of the same story can
+        # take the delta; anything else (e.g. an edit made by another worker,
+        # or a deleted story whose id was reused) is dropped.
+        with self._lock:
+            state = self._states.get(story_id)
+            if state is None:
+                return
+            if state.created_at != version.created_at or state.revision != version.revision - 1:
+                del self._states[story_id]
+                return
+            if change:
+                change(state)
+            if state.stale:
+                del self._states[story_id]
+                return
+            state.revision = version.revision
+
+    def discard(self, story_id):
+        with self._lock:
+            self._states.pop(story_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._states.clear()
+
+    def validate(self, story_id, version, load_graph):
+        """Reports on the story at ``version`` (its revision and created_at).
+
+        A state kept up to date by ``apply`` answers without touching the
+        database; ``load_graph`` is only called to build a missing or
+        outdated one.
+        """
+        with self._lock:
+            state = self._states.get(story_id)
+            if state is not None and version is not None and (
+                state.revision == version.revision and state.created_at == version.created_at
+            ):
+                self._states.move_to_end(story_id)
+                return state.report(story_id)
+
+        graph = load_graph()
+        if graph is None:
+            return None
+        state = ValidationState(graph)
+        with self._lock:
+            self._states[story_id] = state
+            self._states.move_to_end(story_id)
+            while len(self._states) > self.size:
+                self._states.popitem(last=False)
+            return state.report(story_id)
+
+
+story_validation = ValidationRegistry()
+
+
+def validate_import(keys, pages, choices, start_page=None):
+    """Checks an import payload before anything is written.
+
+    Pages are named by their import keys and choices by their position in
+    ``choices``, so the report points at the payload rather than at ids.
+    """
+    adjacency = {key: [] for key in keys}
+    for position, choice in enumerate(choices):
+        adjacency[str(choice['page'])].append((position, str(choice['next_page'])))
+    graph = SimpleNamespace(
+        revision=None,
+        created_at=None,
+        start_page_id=str(start_page) if start_page is not None else (keys[0] if keys else None),
+        page_ids=keys,
+        is_ending=[bool(page.get('is_ending', False)) for page in pages],
+        adjacency=[adjacency[key] for key in keys]
+    )
+    return ValidationState(graph).report(None)
@@ -0,0 +1,83 @@
+import os
+import sys
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+# app.py builds an app at import time; keep it off the real database.
+os.environ['DATABASE_URL'] = 'sqlite://'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from config import Config
+from models import db
+from services.flaskServices import StoryService
+from services.storyGraphCache import story_graph_cache
+
+
+class TestConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+
+
+@pytest.fixture(scope='session')
+def app():
+    app = create_app(TestConfig)
+    with app.app_context():
+        yield app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def count_queries(app):
+    """Counts SQL statements sent to the database inside the block."""
+
+    @contextmanager
+    def counter():
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+    return counter
+
+
+@pytest.fixture
+def make_story(app):
+    """Creates a story of ``size`` pages: a chain with two choices per page.
+
+    Returns the story id and its page ids in order.
+    """
+
+    def make(size, status='published'):
+        pages = [{
+            'key': str(i),
+            'text': f'Page {i}',
+            'is_ending': i == size - 1,
+            'ending_label': 'The end' if i == size - 1 else None
+        } for i in range(size)]
+        choices = []
+        for i in range(size - 1):
+            choices.append({'page': str(i), 'next_page': str(i + 1), 'text': 'Go on'})
+            choices.append({'page': str(i), 'next_page': str(size - 1), 'text': 'Skip to the end'})
+        story, key_to_id = StoryService.import_story(
+            f'Story of {size}', 'A test story', pages, choices, status=status, start_page='0'
+        )
+        story_id = story.id
+        # Start every measurement from an empty session and a cold graph cache.
+        db.session.remove()
+        story_graph_cache.clear()
+        return story_id, [key_to_id[str(i)] for i in range(size)]
+
+    return make
@@ -0,0 +1,85 @@
+"""Response compression: encoding negotiation, thresholds and the body cache."""
+import gzip
+import json
+
+import pytest
+
+import compression
+from compression import compressed_bodies
+
+
+def _get(client, url, encoding=None, **headers):
+    if encoding:
+        headers['Accept-Encoding'] = encoding
+    return client.get(url, headers=headers)
+
+
+def test_gzip_is_used_when_it_is_the_only_encoding_accepted(client, make_story):
+    story_id, _ = make_story(40)
+    url = f'/api/stories/{story_id}/pages'
+    plain = _get(client, url)
+
+    response = _get(client, url, 'gzip')
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert gzip.decompress(response.data) == plain.data
+    # The compressed bytes only carry a weak version of the tag.
+    assert response.headers['ETag'] == f'W/{plain.headers["ETag"]}'
+
+
+@pytest.mark.skipif(compression.brotli is None, reason='brotli is not installed')
+def test_brotli_is_preferred_when_accepted(client, make_story):
+    story_id, _ = make_story(40)
+    url = f'/api/stories/{story_id}/pages'
+    plain = _get(client, url)
+
+    response = _get(client, url, 'gzip, br')
+    assert response.headers['Content-Encoding'] == 'br'
+    assert compression.brotli.decompress(response.data) == plain.data
+
+
+def test_identity_is_sent_without_accept_encoding(client, make_story):
+    story_id, _ = make_story(40)
+    response = _get(client, f'/api/stories/{story_id}/pages')
+    assert 'Content-Encoding' not in response.headers
+    # Caches must still key on the header the body depends on.
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert json.loads(response.data)
+
+
+def test_small_bodies_are_not_compressed(app, client, make_story):
+    story_id, _ = make_story(3)
+    response = _get(client, f'/api/stories/{story_id}', 'gzip, br')
+    assert response.content_length < app.config['COMPRESSION_MIN_SIZE']
+    assert 'Content-Encoding' not in response.headers
+    assert 'Accept-Encoding' in response.headers['Vary']
+
+
+def test_not_modified_responses_are_not_compressed(client, make_story):
+    story_id, _ = make_story(40)
+    url = f'/api/stories/{story_id}/pages'
+    etag = _get(client, url, 'gzip').headers['ETag']
+
+    response = _get(client, url, 'gzip', **{'If-None-Match': etag})
+    assert response.status_code == 304
+    assert 'Content-Encoding' not in response.headers
+    assert response.data == b''
+
+
+def test_compressed_bodies_are_reused_until_the_story_changes(client, make_story):
+    compressed_bodies.clear()
+    story_id, _ = make_story(40)
+    url = f'/api/stories/{story_id}/pages'
+
+    first = _get(client, url, 'gzip')
+    hits = compressed_bodies.stats()['hits']
+    second = _get(client, url, 'gzip')
+    assert compressed_bodies.stats()['hits'] == hits + 1
+    assert second.data == first.data
+
+    client.post(f'/api/stories/{story_id}/pages', json={'text': 'A new page', 'is_ending': True})
+    third = _get(client, url, 'gzip')
+    assert compressed_bodies.stats()['hits'] == hits + 1
+    assert third.headers['ETag'] != first.headers['ETag']
+    pages = json.loads(gzip.decompress(third.data))
+    assert pages[-1]['text'] == 'A new page'
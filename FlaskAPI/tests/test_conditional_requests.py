@@ -0,0 +1,47 @@
+"""ETags and Last-Modified on the story reads."""
+from models import db
+from services.flaskServices import StoryService
+from services.storyGraphCache import story_graph_cache
+
+
+def _replace_with_new_story(client, story_id):
+    # SQLite hands the highest id out again once its row is deleted.
+    assert client.delete(f'/api/stories/{story_id}').status_code == 200
+    new_story = StoryService.create_story('Someone else', 'A different story')
+    assert new_story.id == story_id
+    db.session.remove()
+
+
+def test_a_reused_story_id_does_not_match_the_deleted_story(client, make_story):
+    story_id, _ = make_story(3)
+    etag = client.get(f'/api/stories/{story_id}').headers['ETag']
+
+    _replace_with_new_story(client, story_id)
+
+    response = client.get(f'/api/stories/{story_id}', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.get_json()['title'] == 'Someone else'
+    assert response.headers['ETag'] != etag
+
+
+def test_a_graph_compiled_for_a_deleted_story_is_not_served(client, make_story):
+    story_id, _ = make_story(3)
+    client.get(f'/api/stories/{story_id}')
+    # Another worker compiled the old story and never saw the delete.
+    old_graph = story_graph_cache.get(story_id)
+
+    _replace_with_new_story(client, story_id)
+    story_graph_cache.put(old_graph)
+
+    assert client.get(f'/api/stories/{story_id}').get_json()['title'] == 'Someone else'
+    assert client.get(f'/api/stories/{story_id}/pages').get_json() == []
+
+
+def test_an_edit_within_the_same_second_is_not_reported_unmodified(client, make_story):
+    story_id, _ = make_story(3)
+    last_modified = client.get(f'/api/stories/{story_id}').headers['Last-Modified']
+    client.put(f'/api/stories/{story_id}', json={'title': 'Renamed'})
+
+    response = client.get(f'/api/stories/{story_id}', headers={'If-Modified-Since': last_modified})
+    assert response.status_code == 200
+    assert response.get_json()['title'] == 'Renamed'
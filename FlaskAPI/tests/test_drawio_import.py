@@ -0,0 +1,61 @@
+"""draw.io import: plain and compressed diagrams, loose arrow ends."""
+import base64
+import io
+import zlib
+from urllib.parse import quote
+
+from services.drawioImporter import parse_drawio
+
+
+def _model(pages):
+    # A chain of pages; every other arrow is only drawn up to its target.
+    cells = ['<mxCell id="0"/>', '<mxCell id="1" parent="0"/>']
+    for i in range(pages):
+        cells.append(
+            f'<mxCell id="p{i}" value="Page {i}" style="rounded=1;" vertex="1" parent="1">'
+            f'<mxGeometry x="{i * 300}" y="{(i % 7) * 150}" width="120" height="60" as="geometry"/></mxCell>'
+        )
+    for i in range(pages - 1):
+        if i % 2:
+            target = f'<mxPoint x="{(i + 1) * 300 + 5}" y="{((i + 1) % 7) * 150 + 5}" as="targetPoint"/>'
+            cells.append(f'<mxCell id="e{i}" value="Next" edge="1" source="p{i}" parent="1">'
+                         f'<mxGeometry relative="1" as="geometry">{target}</mxGeometry></mxCell>')
+        else:
+            cells.append(f'<mxCell id="e{i}" value="Next" edge="1" source="p{i}" target="p{i + 1}" parent="1">'
+                         '<mxGeometry relative="1" as="geometry"/></mxCell>')
+    return f'<mxGraphModel><root>{"".join(cells)}</root></mxGraphModel>'
+
+
+def _compress(xml):
+    deflate = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+    raw = deflate.compress(quote(xml, safe='').encode('ascii')) + deflate.flush()
+    encoded = base64.b64encode(raw).decode('ascii')
+    # draw.io may wrap the payload; the decoder must skip the whitespace.
+    return '\n'.join(encoded[i:i + 76] for i in range(0, len(encoded), 76))
+
+
+def _parse(diagram):
+    source = io.BytesIO(f'<mxfile><diagram name="Chain">{diagram}</diagram></mxfile>'.encode('utf-8'))
+    return parse_drawio(source)
+
+
+def test_compressed_diagram_matches_plain_one():
+    model = _model(500)
+    plain, plain_warnings = _parse(model)
+    compressed, compressed_warnings = _parse(_compress(model))
+    assert compressed == plain
+    assert compressed_warnings == plain_warnings == []
+
+
+def test_loose_arrow_ends_snap_to_the_nearest_page():
+    graph, warnings = _parse(_model(500))
+    assert warnings == []
+    assert len(graph['choices']) == 499
+    assert all(choice['next_page'] == f"p{int(choice['page'][1:]) + 1}" for choice in graph['choices'])
+    assert graph['start_page'] == 'p0'
+
+
+def test_long_arrow_labels_are_cut_to_the_choice_column():
+    model = _model(2).replace('value="Next"', f'value="{"x" * 300}"')
+    graph, _warnings = _parse(model)
+    assert [len(choice['text']) for choice in graph['choices']] == [255]
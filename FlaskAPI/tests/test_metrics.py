@@ -0,0 +1,55 @@
+"""Request metrics and request IDs served by /api/_metrics."""
+from unittest import mock
+
+from metrics import request_metrics
+from services.flaskServices import StoryService
+
+PAGE_ROUTE = 'route="/api/pages/<int:page_id>",method="GET"'
+
+
+def _metrics(client):
+    response = client.get('/api/_metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain; version=0.0.4')
+    return response.get_data(as_text=True)
+
+
+def test_requests_are_counted_per_route(client, make_story, count_queries):
+    request_metrics.reset()
+    story_id, page_ids = make_story(3)
+    with count_queries() as statements:
+        client.get(f'/api/pages/{page_ids[0]}')
+    client.get(f'/api/pages/{page_ids[1]}')
+
+    text = _metrics(client)
+    assert f'nahb_http_requests_total{{{PAGE_ROUTE},status="200"}} 2' in text
+    assert f'nahb_http_request_duration_seconds_count{{{PAGE_ROUTE}}} 2' in text
+    # Both statement counts are recorded; the first request compiled the graph.
+    assert f'nahb_http_request_sql_statements_sum{{{PAGE_ROUTE}}} {len(statements) + 1}' in text
+    assert 'nahb_story_graph_cache_hits_total' in text
+    # The scrape itself is not measured.
+    assert '/api/_metrics' not in text
+
+
+def test_controller_errors_are_counted(client, make_story):
+    request_metrics.reset()
+    story_id, page_ids = make_story(3)
+    with mock.patch.object(StoryService, 'get_story_version', side_effect=RuntimeError('boom')):
+        response = client.get(f'/api/stories/{story_id}')
+    assert response.status_code == 500
+
+    text = _metrics(client)
+    assert ('nahb_http_request_errors_total{route="/api/stories/<int:story_id>",method="GET",'
+            'exception="RuntimeError"} 1') in text
+
+
+def test_request_id_is_echoed(client):
+    response = client.get('/api/stories', headers={'X-Request-ID': 'abc-123'})
+    assert response.headers['X-Request-ID'] == 'abc-123'
+
+    traceparent = '00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01'
+    response = client.get('/api/stories', headers={'traceparent': traceparent})
+    assert response.headers['X-Request-ID'] == '4bf92f3577b34da6a3ce929d0e0e4736'
+    assert response.headers['traceparent'] == traceparent
+
+    assert len(client.get('/api/stories').headers['X-Request-ID']) == 32
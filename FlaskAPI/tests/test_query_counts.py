@@ -0,0 +1,127 @@
+"""SQL statement budgets for the read endpoints.
+
+Every count here must stay the same whatever the size of the story. If a
+change makes one of these tests fail, the endpoint has started issuing
+queries per page or per choice; fix the query rather than the number.
+"""
+import pytest
+
+from models import db
+from services.flaskServices import StoryService
+from services.storyGraphCache import story_graph_cache
+from services.storyValidator import story_validation
+
+SIZES = (3, 40)
+
+# Story reads compile the story graph once: a version lookup, then the
+# story, its pages and all of its choices.
+GRAPH_ENDPOINTS = [
+    '/api/stories/{story_id}',
+    '/api/stories/{story_id}/start',
+    '/api/pages/{page_id}',
+    '/api/stories/{story_id}/pages',
+    '/api/stories/{story_id}/bundle',
+    '/api/stories/{story_id}/analysis',
+    '/api/stories/{story_id}/validation',
+]
+COLD_GRAPH_STATEMENTS = 4
+WARM_GRAPH_STATEMENTS = 1
+
+CATALOG_ENDPOINTS = {
+    '/api/stories': 2,
+    '/api/stories?limit=10': 2,
+    '/api/export': 3,
+}
+
+
+def _get(client, count_queries, url, cold=True):
+    if cold:
+        story_graph_cache.clear()
+        story_validation.clear()
+        db.session.remove()
+    with count_queries() as statements:
+        response = client.get(url)
+    assert response.status_code == 200, response.data
+    return statements
+
+
+@pytest.mark.parametrize('endpoint', GRAPH_ENDPOINTS)
+@pytest.mark.parametrize('size', SIZES)
+def test_story_reads_use_a_fixed_number_of_statements(client, make_story, count_queries, endpoint, size):
+    story_id, page_ids = make_story(size)
+    url = endpoint.format(story_id=story_id, page_id=page_ids[-2])
+
+    statements = _get(client, count_queries, url)
+    assert len(statements) == COLD_GRAPH_STATEMENTS, statements
+
+    statements = _get(client, count_queries, url, cold=False)
+    assert len(statements) == WARM_GRAPH_STATEMENTS, statements
+
+
+@pytest.mark.parametrize('endpoint', GRAPH_ENDPOINTS)
+def test_not_modified_reads_only_check_the_revision(client, make_story, count_queries, endpoint):
+    story_id, page_ids = make_story(10)
+    url = endpoint.format(story_id=story_id, page_id=page_ids[0])
+    etag = client.get(url).headers['ETag']
+
+    with count_queries() as statements:
+        response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert len(statements) == 1, statements
+
+
+@pytest.mark.parametrize('endpoint, budget', CATALOG_ENDPOINTS.items())
+def test_catalog_reads_do_not_grow_with_the_catalog(client, make_story, count_queries, endpoint, budget):
+    make_story(3)
+    assert len(_get(client, count_queries, endpoint)) == budget
+
+    for size in SIZES:
+        make_story(size)
+    assert len(_get(client, count_queries, endpoint)) == budget
+
+
+def test_get_story_pages_does_not_load_choices_per_page(app, make_story, count_queries):
+    story_id, _ = make_story(40)
+    with count_queries() as statements:
+        pages = StoryService.get_story_pages(story_id)
+    assert len(pages) == 40
+    assert all(len(page['choices']) == 2 for page in pages[:-1])
+    assert len(statements) == 3, statements
+
+
+def test_create_choice_does_not_load_the_story(client, make_story, count_queries):
+    story_id, page_ids = make_story(40)
+    with count_queries() as statements:
+        response = client.post(f'/api/pages/{page_ids[0]}/choices',
+                               json={'text': 'Back', 'next_page_id': page_ids[1]})
+    assert response.status_code == 201
+    # One select for both pages, the insert, the revision bump and reading
+    # the new choice back for the response.
+    assert len(statements) == 4
+
+
+def test_create_choice_rejects_pages_of_other_stories(client, make_story):
+    story_id, page_ids = make_story(3)
+    other_story_id, other_page_ids = make_story(3)
+    response = client.post(f'/api/pages/{page_ids[0]}/choices',
+                           json={'text': 'Jump', 'next_page_id': other_page_ids[0]})
+    assert response.status_code == 400
+    response = client.post(f'/api/pages/{page_ids[0]}/choices', json={'text': 'Jump', 'next_page_id': 999999})
+    assert response.status_code == 400
+    response = client.post('/api/pages/999999/choices', json={'text': 'Jump', 'next_page_id': page_ids[0]})
+    assert response.status_code == 404
+
+
+def test_publishing_after_edits_does_not_reload_the_story(client, make_story, count_queries):
+    story_id, page_ids = make_story(40, status='draft')
+    assert client.get(f'/api/stories/{story_id}/validation').get_json()['valid']
+
+    page = client.post(f'/api/stories/{story_id}/pages', json={'text': 'Another end', 'is_ending': True}).get_json()
+    client.post(f'/api/pages/{page_ids[0]}/choices', json={'text': 'Shortcut', 'next_page_id': page['id']})
+
+    # The edits were applied to the kept validation state, so publishing
+    # reads the story row only: no pages, no choices.
+    with count_queries() as statements:
+        response = client.put(f'/api/stories/{story_id}', json={'status': 'published'})
+    assert response.status_code == 200, response.data
+    assert not [s for s in statements if 'FROM page' in s or 'FROM choice' in s], statements
@@ -0,0 +1,36 @@
+"""GET /api/stories/<id>/analysis on stories with and without loops."""
+from services import storyAnalysis
+from services.flaskServices import StoryService
+
+
+def _loop_story(size):
+    # Pages 0..size-1 in a ring; the last page can also leave to the ending.
+    pages = [{'key': str(i), 'text': f'Page {i}'} for i in range(size)]
+    pages.append({'key': 'end', 'text': 'The end', 'is_ending': True, 'ending_label': 'Out'})
+    choices = [{'page': str(i), 'next_page': str((i + 1) % size), 'text': 'Go on'} for i in range(size)]
+    choices.append({'page': str(size - 1), 'next_page': 'end', 'text': 'Leave'})
+    story, _key_to_id = StoryService.import_story('Loop', 'A looping story', pages, choices, start_page='0')
+    return story.id
+
+
+def test_acyclic_story_ends_with_certainty(client, make_story):
+    story_id, page_ids = make_story(40)
+    analysis = client.get(f'/api/stories/{story_id}/analysis').get_json()
+    assert [ending['probability'] for ending in analysis['endings']] == [1.0]
+    assert analysis['expected_turns'] > 0
+
+
+def test_loops_are_solved_exactly(client):
+    story_id = _loop_story(4)
+    analysis = client.get(f'/api/stories/{story_id}/analysis').get_json()
+    assert analysis['endings'][0]['probability'] == 1.0
+    # Each lap takes 4 turns and the exit is taken half the time at page 3.
+    assert analysis['expected_turns'] == 8.0
+
+
+def test_oversized_loops_are_refused(client, monkeypatch):
+    monkeypatch.setattr(storyAnalysis, 'MAX_LOOP_PAGES', 3)
+    story_id = _loop_story(4)
+    response = client.get(f'/api/stories/{story_id}/analysis')
+    assert response.status_code == 422
+    assert 'loop of 4 pages' in response.get_json()['error']
@@ -0,0 +1,51 @@
+"""Validation of POST /api/stories/import bodies."""
+import pytest
+
+from models.flaskModel import Story
+
+PAGES = [{'key': 'a', 'text': 'Start'}, {'key': 'b', 'text': 'The end', 'is_ending': True}]
+CHOICES = [{'page': 'a', 'next_page': 'b', 'text': 'Go on'}]
+
+
+def _import(client, **fields):
+    body = dict({'title': 'Imported', 'description': 'A test story', 'pages': PAGES, 'choices': CHOICES}, **fields)
+    return client.post('/api/stories/import', json=body)
+
+
+@pytest.mark.parametrize('fields', [
+    {'pages': [1, 'x']},
+    {'pages': [None]},
+    {'choices': ['a->b']},
+    {'choices': [['a', 'b', 'Go on']]},
+])
+def test_malformed_entries_are_rejected(client, fields):
+    before = Story.query.count()
+    response = _import(client, **fields)
+    assert response.status_code == 400
+    assert 'must be an object' in response.get_json()['error']
+    assert Story.query.count() == before
+
+
+def test_well_formed_import_is_created(client):
+    response = _import(client)
+    assert response.status_code == 201
+    assert set(response.get_json()['page_ids']) == {'a', 'b'}
+
+
+def test_unknown_status_is_rejected(client):
+    response = _import(client, status='featured')
+    assert response.status_code == 400
+    assert 'status must be one of' in response.get_json()['error']
+
+
+def test_published_import_must_pass_validation(client):
+    before = Story.query.count()
+    dead_end = [{'key': 'a', 'text': 'Start'}, {'key': 'b', 'text': 'Nowhere'}]
+    response = _import(client, pages=dead_end, status='published')
+    assert response.status_code == 422
+    assert response.get_json()['problems']['dead_end_pages'] == ['b']
+    assert Story.query.count() == before
+
+    response = _import(client, status='published')
+    assert response.status_code == 201
+    assert response.get_json()['status'] == 'published'